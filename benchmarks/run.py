@@ -0,0 +1,403 @@
+"""
+Benchmarks of the query, conversion and preprocessing hot paths, run against local stand-ins of ClickHouse and
+Hypersync (see `benchmarks/standin.py`), so that results do not depend on the network or on production data.
+
+Usage, from the repository root:
+
+    python -m benchmarks.run                          # small and medium sizes, compared to the stored baseline
+    python -m benchmarks.run --sizes large --only queries
+    python -m benchmarks.run --save-baseline          # store the results as the new baseline
+
+Every benchmark reports latency percentiles over `--repeat` runs, throughput in rows per second and the peak
+resident memory (RSS) of the process while it ran. Benchmarks whose median latency or peak RSS grew by more than
+`--threshold` over the baseline are flagged, and the exit code is 1 if any are.
+
+Timings only compare on the machine they were recorded on, so the baseline is not committed: each machine, or CI
+runner, saves its own from the commit a change starts from, then compares the change to it.
+"""
+import argparse
+import asyncio
+import contextlib
+import copy
+import datetime
+import io
+import json
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+import polars as pl
+import pyarrow as pa
+
+from dataclasses import asdict, dataclass
+from ethpandaops_python.async_client import AsyncQueries
+from ethpandaops_python.client import ClientPool, Queries, normalize_arrow, to_polars
+from ethpandaops_python.executor import ShardedExecutor
+from ethpandaops_python.hypersync import Hypersync
+from ethpandaops_python.preprocessor import Preprocessor
+from ethpandaops_python.schema import arrow_to_pandas
+from ethpandaops_python.store import DatasetStore
+from benchmarks.standin import StandInClient, StandInHypersyncClient, synthetic_hypersync
+from typing import Any, Callable, Dict, Mapping, Optional
+
+# rows per day of the largest tables, per data size
+SIZES: Dict[str, int] = {
+    'small': 10_000,
+    'medium': 100_000,
+    'large': 1_000_000,
+}
+
+# days of data held by the stand-ins and queried by the benchmarks
+DAYS: int = 2
+
+BASELINE: str = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+# latency changes below this many milliseconds are noise rather than regressions
+MIN_DELTA_MS: float = 1.0
+
+
+def rss_bytes() -> int:
+    """
+    rss_bytes() returns the current resident memory of the process, or its peak where the current value is unavailable.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class PeakRss:
+    """
+    `PeakRss` samples the resident memory of the process in a background thread and keeps the peak, so that
+    memory released before the end of a benchmark is still accounted for.
+    """
+
+    def __init__(self, interval: float = 0.002):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self) -> None:
+        while not self._stop.is_set():
+            self.peak = max(self.peak, rss_bytes())
+            time.sleep(self.interval)
+
+    def __enter__(self) -> 'PeakRss':
+        self.peak = rss_bytes()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, rss_bytes())
+
+
+@dataclass
+class Result:
+    name: str
+    size: str
+    rows: int
+    runs: int
+    p50_ms: float
+    p90_ms: float
+    p99_ms: float
+    mean_ms: float
+    rows_per_s: float
+    peak_rss_mb: float
+
+    @property
+    def key(self) -> str:
+        return f'{self.name}@{self.size}'
+
+
+def num_rows(result: Any) -> int:
+    """
+    num_rows() returns the number of rows of a benchmark result: a DataFrame, an Arrow table, a dict of them or an int.
+    """
+    if isinstance(result, int):
+        return result
+    if isinstance(result, Mapping):
+        return sum(num_rows(value) for value in result.values())
+    if isinstance(result, (pl.DataFrame, pa.Table)):
+        return result.shape[0]
+    return len(result)
+
+
+def measure(name: str, size: str, fn: Callable[[], Any], repeat: int, warmup: int = 1,
+            setup: Optional[Callable[[], None]] = None) -> Result:
+    """
+    measure() runs `fn` `warmup` times untimed, then `repeat` times timed, and summarizes the runs.
+    `setup` runs untimed before every run.
+    """
+    for _ in range(warmup):
+        if setup is not None:
+            setup()
+        fn()
+
+    latencies = []
+    rows = 0
+    with PeakRss() as rss:
+        for _ in range(repeat):
+            if setup is not None:
+                setup()
+            start = time.perf_counter()
+            result = fn()
+            latencies.append(time.perf_counter() - start)
+            rows = num_rows(result)
+            del result
+
+    latencies_ms = np.array(latencies) * 1000
+    p50 = float(np.percentile(latencies_ms, 50))
+    return Result(
+        name=name,
+        size=size,
+        rows=rows,
+        runs=repeat,
+        p50_ms=p50,
+        p90_ms=float(np.percentile(latencies_ms, 90)),
+        p99_ms=float(np.percentile(latencies_ms, 99)),
+        mean_ms=float(latencies_ms.mean()),
+        rows_per_s=rows / (p50 / 1000) if p50 > 0 else 0.0,
+        peak_rss_mb=rss.peak / 1024**2,
+    )
+
+
+def quiet(fn: Callable[[], Any]) -> Callable[[], Any]:
+    """
+    quiet() silences the progress printed by `fn`.
+    """
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            return fn()
+    return run
+
+
+def bench_queries(size: str, standin: StandInClient, repeat: int) -> list[Result]:
+    """
+    bench_queries() times every `Queries` method in each result format, plus sharded and streamed variants.
+    """
+    producer = Preprocessor.__dataclass_fields__['blob_producer'].default_factory()
+    cases: Dict[str, Callable[[Queries], Any]] = {
+        'slot_inclusion_mempool': lambda q: q.slot_inclusion_mempool(producer, n_days=DAYS, network='mainnet'),
+        'slot_inclusion_sidecar': lambda q: q.slot_inclusion_sidecar(n_days=DAYS),
+        'canonical_beacon_block_execution_transaction': lambda q: q.canonical_beacon_block_execution_transaction(
+            all_cols='all', time=DAYS),
+        'mempool_transaction': lambda q: q.mempool_transaction(all_cols='all', time=DAYS),
+        'mempool_transaction_aggregate': lambda q: q.mempool_transaction(all_cols='aggregate', time=DAYS),
+        'mempool_transaction_first_seen': lambda q: q.mempool_transaction(all_cols='first_seen', time=DAYS),
+        'canonical_beacon_chain': lambda q: q.canonical_beacon_chain(time=DAYS),
+        'blob_propagation': lambda q: q.blob_propagation(time=DAYS),
+        'blob_propagation_aggregate': lambda q: q.blob_propagation(all_cols='aggregate', time=DAYS),
+    }
+
+    results = []
+    for result_format in ('pandas', 'arrow', 'polars'):
+        queries = Queries(pool=ClientPool(client=standin), result_format=result_format)
+        for name, case in cases.items():
+            results.append(measure(
+                f'queries.{name}[{result_format}]', size, lambda: case(queries), repeat))
+
+    sharded = Queries(pool=ClientPool(client=standin), result_format='polars',
+                      executor=ShardedExecutor(window=datetime.timedelta(hours=6)))
+    results.append(measure('queries.mempool_transaction[polars,sharded]', size,
+                           lambda: sharded.mempool_transaction(all_cols='all', time=DAYS), repeat))
+
+    streaming = Queries(pool=ClientPool(client=standin), result_format='polars')
+    results.append(measure('queries.mempool_transaction_stream[polars]', size,
+                           lambda: sum(batch.height for batch in streaming.mempool_transaction_stream(
+                               time=DAYS, batch_size=16_384)), repeat))
+
+    # a fixed delay per query shows the effect of awaiting queries concurrently rather than one after the other
+    slow = copy.copy(standin)
+    slow.latency = 0.05
+    blocking = Queries(pool=ClientPool(client=slow), result_format='polars')
+    results.append(measure('queries.blob_propagation[latency,sequential=8]', size,
+                           lambda: sum(blocking.blob_propagation(time=DAYS).height for _ in range(8)), repeat))
+
+    async def concurrent() -> int:
+        async with AsyncQueries(blocking, max_concurrency=8) as queries:
+            frames = await asyncio.gather(*(queries.blob_propagation(time=DAYS) for _ in range(8)))
+        return sum(df.height for df in frames)
+    results.append(measure('queries.blob_propagation[latency,async=8]', size,
+                           lambda: asyncio.run(concurrent()), repeat))
+    return results
+
+
+def bench_conversion(size: str, standin: StandInClient, repeat: int) -> list[Result]:
+    """
+    bench_conversion() times the conversions of a raw ClickHouse Arrow result to each result format, the ones `Queries`
+    runs. pandas results are converted to polars from the frame `Queries` returns in the 'pandas' format.
+    """
+    raw = standin.table('mempool_transaction')
+    normalized = normalize_arrow(raw)
+    df = arrow_to_pandas(normalized)
+    return [
+        measure('convert.normalize_arrow', size, lambda: normalize_arrow(raw), repeat),
+        measure('convert.arrow_to_pandas', size, lambda: arrow_to_pandas(normalized), repeat),
+        measure('convert.arrow_to_polars', size, lambda: pl.from_arrow(normalized), repeat),
+        measure('convert.pandas_to_polars', size, lambda: to_polars(df), repeat),
+    ]
+
+
+def bench_hypersync(size: str, hypersync: Hypersync, repeat: int) -> list[Result]:
+    """
+    bench_hypersync() times `Hypersync.query_txs()`, whose cost is the join of transactions to blocks and `unique()`.
+    """
+    producer = Preprocessor.__dataclass_fields__['blob_producer'].default_factory()
+    results = [measure('hypersync.query_txs', size,
+                       lambda: hypersync.query_txs(producer['sequencer_addresses'], period=DAYS), repeat),
+               measure('hypersync.query_txs[stream]', size,
+                       lambda: hypersync.query_txs(producer['sequencer_addresses'], period=DAYS, stream=True), repeat)]
+
+    # a fixed delay per request shows the effect of fetching block range shards concurrently
+    slow = StandInHypersyncClient(hypersync.client.transactions, hypersync.client.blocks, latency=0.05)
+    for concurrency in (1, 8):
+        sharded = Hypersync(client=slow, shard_blocks=1800, concurrency=concurrency,
+                            resolver=hypersync.resolver)
+        results.append(measure(f'hypersync.query_txs[latency,concurrency={concurrency}]', size,
+                               lambda: sharded.query_txs(producer['sequencer_addresses'], period=DAYS), repeat))
+    return results
+
+
+def bench_preprocessor(size: str, standin: StandInClient, hypersync: Hypersync, root: str, repeat: int) -> list[Result]:
+    """
+    bench_preprocessor() times a cold `Preprocessor`, which queries every source and writes the store, a warm one,
+    which reads every dataset of the store, a lazy warm one, which reads none, and an incremental refresh of a warm
+    store.
+    """
+    store = DatasetStore(root=os.path.join(root, 'store'))
+
+    def preprocessor(incremental: bool = False) -> Mapping[str, pl.DataFrame]:
+        return Preprocessor(
+            period=DAYS,
+            clickhouse_client=Queries(pool=ClientPool(client=standin), result_format='polars'),
+            hypersync_client=hypersync,
+            store=store,
+            incremental=incremental,
+        ).cached_data
+
+    def clear() -> None:
+        shutil.rmtree(store.root, ignore_errors=True)
+
+    results = [measure('preprocessor.cold', size, quiet(preprocessor), repeat, setup=clear)]
+    quiet(preprocessor)()
+    results.append(measure('preprocessor.warm', size, quiet(lambda: dict(preprocessor())), repeat))
+    results.append(measure('preprocessor.warm[lazy]', size,
+                           quiet(lambda: len(preprocessor())), repeat))
+    results.append(measure('preprocessor.incremental', size,
+                           quiet(lambda: preprocessor(incremental=True)), repeat))
+    return results
+
+
+def run(sizes: list[str], only: Optional[list[str]], repeat: int) -> list[Result]:
+    results = []
+    for size in sizes:
+        rows_per_day = SIZES[size]
+        with tempfile.TemporaryDirectory(prefix='ethpandaops-bench-') as root:
+            standin = StandInClient(rows_per_day=rows_per_day, days=DAYS)
+            standin.warm()
+
+            now = datetime.datetime.now(datetime.timezone.utc)
+            hypersync = Hypersync(client=StandInHypersyncClient(*synthetic_hypersync(rows_per_day, DAYS, now)),
+                                  sync_folder=os.path.join(root, 'hypersync'))
+
+            suites: Dict[str, Callable[[], list[Result]]] = {
+                'queries': lambda: bench_queries(size, standin, repeat),
+                'convert': lambda: bench_conversion(size, standin, repeat),
+                'hypersync': lambda: bench_hypersync(size, hypersync, repeat),
+                'preprocessor': lambda: bench_preprocessor(size, standin, hypersync, root, repeat),
+            }
+            for name, suite in suites.items():
+                if only is None or name in only:
+                    for result in suite():
+                        report(result)
+                        results.append(result)
+    return results
+
+
+def report(result: Result) -> None:
+    print(f'{result.key:<70} {result.rows:>10,} rows  p50 {result.p50_ms:9.2f}ms  p90 {result.p90_ms:9.2f}ms  '
+          f'p99 {result.p99_ms:9.2f}ms  {result.rows_per_s:>14,.0f} rows/s  rss {result.peak_rss_mb:8.1f}MB')
+
+
+def regressions(results: list[Result], baseline: Dict[str, dict], threshold: float) -> list[str]:
+    """
+    regressions() compares results to the baseline and describes every benchmark whose median latency or
+    peak RSS grew by more than `threshold`.
+    """
+    flagged = []
+    for result in results:
+        previous = baseline.get(result.key)
+        if previous is None:
+            continue
+        if (result.p50_ms > previous['p50_ms'] * (1 + threshold)
+                and result.p50_ms - previous['p50_ms'] > MIN_DELTA_MS):
+            flagged.append(f"{result.key}: p50 {previous['p50_ms']:.2f}ms -> {result.p50_ms:.2f}ms")
+        if result.peak_rss_mb > previous['peak_rss_mb'] * (1 + threshold):
+            flagged.append(
+                f"{result.key}: peak rss {previous['peak_rss_mb']:.1f}MB -> {result.peak_rss_mb:.1f}MB")
+    return flagged
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', nargs='+', choices=list(SIZES), default=['small', 'medium'])
+    parser.add_argument('--only', nargs='+', choices=['queries', 'convert', 'hypersync', 'preprocessor'])
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs per benchmark')
+    parser.add_argument('--baseline', default=BASELINE, help='baseline file to compare to or save')
+    parser.add_argument('--save-baseline', action='store_true', help='store the results as the baseline')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='relative growth of p50 latency or peak RSS flagged as a regression')
+    parser.add_argument('--output', help='also write the results to this JSON file')
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.only, args.repeat)
+
+    document = {
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'machine': {'python': platform.python_version(), 'platform': platform.platform(),
+                    'cpus': os.cpu_count()},
+        'results': {result.key: asdict(result) for result in results},
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(document, f, indent=2)
+
+    if args.save_baseline:
+        # results of benchmarks that did not run are kept
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                document['results'] = {**json.load(f)['results'], **document['results']}
+        with open(args.baseline, 'w') as f:
+            json.dump(document, f, indent=2)
+        print(f'saved baseline to {args.baseline}')
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f'no baseline at {args.baseline}, run with --save-baseline to store one')
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)['results']
+    flagged = regressions(results, baseline, args.threshold)
+    if flagged:
+        print(f'{len(flagged)} regressions over {args.threshold:.0%} against {args.baseline}:')
+        for line in flagged:
+            print(f'  {line}')
+        return 1
+    print(f'no regressions over {args.threshold:.0%} against {args.baseline}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
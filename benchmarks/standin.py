@@ -0,0 +1,402 @@
+import asyncio
+import datetime
+import io
+import json
+import time
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from dataclasses import dataclass, field
+from types import SimpleNamespace
+from ethpandaops_python.cache import query_table
+from ethpandaops_python.client import normalize_arrow
+from ethpandaops_python.instrumentation import SUMMARY_HEADER
+from typing import Dict, Optional, Tuple
+
+# rows of each table per day, relative to the `rows_per_day` scale of the stand-in
+TABLE_RATIOS: Dict[str, float] = {
+    'mempool_transaction': 1.0,
+    'canonical_beacon_block_execution_transaction': 1.0,
+    'beacon_api_eth_v1_events_blob_sidecar': 0.5,
+    'canonical_beacon_blob_sidecar': 0.1,
+    'canonical_beacon_block': 0.01,
+}
+
+# rows of the Hypersync transactions fixture per day, relative to `rows_per_day`
+HYPERSYNC_RATIO: float = 0.05
+
+SECONDS_PER_SLOT = 12
+
+
+def _hex(rng: np.random.Generator, n: int, width: int, pool: Optional[int] = None) -> pa.Array:
+    """
+    _hex() returns `n` random 0x prefixed hex strings of `width` bytes, drawn from `pool` distinct values if set.
+    """
+    size = pool if pool is not None else n
+    raw = rng.bytes(size * width).hex()
+    values = ['0x' + raw[i:i + 2 * width] for i in range(0, len(raw), 2 * width)]
+    if pool is None:
+        return pa.array(values, pa.string())
+    return pa.array(np.array(values, dtype=object)[rng.integers(0, pool, n)], pa.string())
+
+
+def _wide_int(rng: np.random.Generator, n: int, width: int, high: int) -> pa.Array:
+    """
+    _wide_int() returns `n` random little endian (U)Int128/(U)Int256 values below `high`, the way ClickHouse
+    writes them to Arrow: as fixed size binary.
+    """
+    limbs = np.zeros((n, width // 8), dtype='<u8')
+    limbs[:, 0] = rng.integers(0, high, n, dtype=np.uint64)
+    return pa.FixedSizeBinaryArray.from_buffers(pa.binary(width), n, [None, pa.py_buffer(limbs.tobytes())])
+
+
+def _columns(table: str, rng: np.random.Generator, seconds: np.ndarray, network: str) -> Dict[str, pa.Array]:
+    """
+    _columns() generates the columns of a synthetic `table` with one row per timestamp in `seconds`, using the
+    Arrow types ClickHouse returns: DateTime as uint32, DateTime64 as a timestamp with a time zone and
+    (U)Int128/(U)Int256 as fixed size binary.
+    """
+    n = len(seconds)
+    slots = ((seconds - seconds.min()) // SECONDS_PER_SLOT).astype(np.uint32) + 9_000_000
+    slot_start = pa.array(seconds - seconds % SECONDS_PER_SLOT, pa.uint32())
+    networks = pa.array(np.full(n, network, dtype=object), pa.string())
+    clients = pa.array(np.array(['lighthouse', 'prysm', 'teku', 'nimbus', 'lodestar'], dtype=object)[
+        rng.integers(0, 5, n)], pa.string())
+
+    match table:
+        case 'mempool_transaction':
+            return {
+                'event_date_time': pa.array(seconds * 1000 + rng.integers(0, 1000, n), pa.timestamp('ms', tz='UTC')),
+                'type': pa.array(rng.choice([2, 3], n), pa.uint8()),
+                'blob_sidecars_size': pa.array(rng.integers(0, 6, n) * 131_072, pa.uint32()),
+                'blob_sidecars_empty_size': pa.array(rng.integers(0, 131_072, n), pa.uint32()),
+                'hash': _hex(rng, n, 32, pool=max(n // 4, 1)),
+                'to': _hex(rng, n, 20, pool=64),
+                'from': _hex(rng, n, 20, pool=64),
+                'blob_hashes': pa.array([[h] for h in _hex(rng, n, 32, pool=max(n // 4, 1)).to_pylist()],
+                                        pa.list_(pa.string())),
+                'nonce': pa.array(rng.integers(0, 1_000_000, n), pa.uint64()),
+                'meta_network_name': networks,
+                'meta_client_name': clients,
+                'blob_gas': pa.array(rng.integers(0, 6, n) * 131_072, pa.uint64()),
+                'blob_gas_fee_cap': _wide_int(rng, n, 16, 10**12),
+                'gas_price': _wide_int(rng, n, 16, 10**12),
+                'gas_tip_cap': _wide_int(rng, n, 16, 10**10),
+                'gas_fee_cap': _wide_int(rng, n, 16, 10**12),
+                'value': _wide_int(rng, n, 32, 10**18),
+                'size': pa.array(rng.integers(100, 10_000, n), pa.uint32()),
+                # computed by the mempool queries
+                'blob_hashes_length': pa.array(np.ones(n), pa.uint64()),
+                'fill_percentage': pa.array(rng.integers(0, 10_000, n) / 100, pa.float64()),
+            }
+        case 'canonical_beacon_blob_sidecar':
+            return {
+                'slot': pa.array(slots, pa.uint32()),
+                'slot_start_date_time': slot_start,
+                'block_root': _hex(rng, n, 32, pool=max(n // 3, 1)),
+                'kzg_commitment': _hex(rng, n, 48),
+                'meta_network_name': networks,
+                'blob_index': pa.array(rng.integers(0, 6, n), pa.uint64()),
+                'versioned_hash': _hex(rng, n, 32),
+                'blob_size': pa.array(np.full(n, 131_072), pa.uint32()),
+                'blob_empty_size': pa.array(rng.integers(0, 131_072, n), pa.uint32()),
+            }
+        case 'canonical_beacon_block_execution_transaction':
+            return {
+                'slot': pa.array(slots, pa.uint32()),
+                'slot_start_date_time': slot_start,
+                'block_root': _hex(rng, n, 32, pool=max(n // 150, 1)),
+                'block_number': pa.array(slots.astype(np.uint64) + 10_000_000, pa.uint64()),
+                'position': pa.array(rng.integers(0, 300, n), pa.uint32()),
+                'hash': _hex(rng, n, 32),
+                'from': _hex(rng, n, 20, pool=4096),
+                'to': _hex(rng, n, 20, pool=4096),
+                'nonce': pa.array(rng.integers(0, 1_000_000, n), pa.uint64()),
+                'gas_price': _wide_int(rng, n, 16, 10**12),
+                'gas': pa.array(rng.integers(21_000, 1_000_000, n), pa.uint64()),
+                'gas_tip_cap': _wide_int(rng, n, 16, 10**10),
+                'gas_fee_cap': _wide_int(rng, n, 16, 10**12),
+                'value': _wide_int(rng, n, 32, 10**18),
+                'type': pa.array(rng.choice([0, 2, 3], n, p=[0.2, 0.75, 0.05]), pa.uint8()),
+                'size': pa.array(rng.integers(100, 10_000, n), pa.uint32()),
+                'call_data_size': pa.array(rng.integers(0, 10_000, n), pa.uint32()),
+                'blob_gas': pa.array(rng.integers(0, 6, n) * 131_072, pa.uint64()),
+                'blob_gas_fee_cap': _wide_int(rng, n, 16, 10**12),
+                'meta_network_name': networks,
+            }
+        case 'canonical_beacon_block':
+            return {
+                'slot': pa.array(slots, pa.uint32()),
+                'slot_start_date_time': slot_start,
+                'epoch': pa.array(slots // 32, pa.uint32()),
+                'block_root': _hex(rng, n, 32),
+                'block_total_bytes': pa.array(rng.integers(10_000, 500_000, n), pa.uint32()),
+                'execution_payload_block_number': pa.array(slots.astype(np.uint64) + 10_000_000, pa.uint64()),
+                'execution_payload_transactions_count': pa.array(rng.integers(0, 300, n), pa.uint32()),
+                'meta_network_name': networks,
+            }
+        case 'beacon_api_eth_v1_events_blob_sidecar':
+            return {
+                'slot': pa.array(slots, pa.uint32()),
+                'slot_start_date_time': slot_start,
+                'event_date_time': pa.array(seconds * 1000 + rng.integers(0, 1000, n), pa.timestamp('ms', tz='UTC')),
+                'propagation_slot_start_diff': pa.array(rng.gamma(2.0, 800.0, n).astype(np.uint32), pa.uint32()),
+                'blob_index': pa.array(rng.integers(0, 6, n), pa.uint64()),
+                'kzg_commitment': _hex(rng, n, 48, pool=max(n // 8, 1)),
+                'versioned_hash': _hex(rng, n, 32, pool=max(n // 8, 1)),
+                'meta_client_name': clients,
+                'meta_network_name': networks,
+            }
+        case _:
+            raise ValueError(f"no synthetic schema for table '{table}'")
+
+
+def synthetic_table(table: str, rows_per_day: int, days: int, end: datetime.datetime,
+                    network: str = 'mainnet', seed: int = 0) -> pa.Table:
+    """
+    synthetic_table() generates `days` days of a ClickHouse table ending at `end`, sorted by time, with
+    `rows_per_day` scaled by the table's ratio in `TABLE_RATIOS`.
+    """
+    rng = np.random.default_rng(seed)
+    n = max(int(rows_per_day * TABLE_RATIOS[table] * days), 1)
+    end_ts = int(end.timestamp())
+    seconds = np.sort(rng.integers(end_ts - days * 86_400, end_ts, n))
+    return pa.table(_columns(table, rng, seconds, network))
+
+
+@dataclass
+class StandInClient:
+    """
+    `StandInClient` is a local stand-in for the clickhouse_connect client, used as
+    `Queries(pool=ClientPool(client=StandInClient(...)))`.
+
+    It does not evaluate SQL. A query returns the rows of the synthetic table it reads from (see `query_table()`)
+    that fall in the `start` and `end` parameters of its time window, so sharded and streamed queries return
+    the same rows as a single query. The high-water marks of incremental queries (the `since_ms` and `since_slot`
+    parameters) narrow the rows further. Other filters, and external tables, are ignored. Queries with a GROUP BY return one row in `group_ratio`. `latency` adds a
+    fixed delay per query, which stands in for the network round trip and server time.
+    """
+    rows_per_day: int = 10_000
+    days: int = 7
+    network: str = 'mainnet'
+    latency: float = 0.0
+    group_ratio: int = 100
+    seed: int = 0
+
+    queries: int = field(default=0, init=False)
+    _tables: Dict[str, pa.Table] = field(default_factory=dict, init=False, repr=False)
+    _seconds: Dict[str, np.ndarray] = field(default_factory=dict, init=False, repr=False)
+    _end: datetime.datetime = field(default_factory=lambda: datetime.datetime.now(
+        datetime.timezone.utc).replace(microsecond=0), init=False, repr=False)
+
+    def table(self, name: str) -> pa.Table:
+        """
+        table() returns the synthetic table `name`, generated on first use.
+        """
+        if name not in self._tables:
+            table = synthetic_table(name, self.rows_per_day, self.days, self._end, self.network, self.seed)
+            self._tables[name] = table
+            time_column = 'event_date_time' if 'event_date_time' in table.column_names else 'slot_start_date_time'
+            seconds = table.column(time_column).to_numpy()
+            if np.issubdtype(seconds.dtype, np.datetime64):
+                seconds = seconds.astype('datetime64[s]').astype(np.int64)
+            self._seconds[name] = seconds.astype(np.int64)
+        return self._tables[name]
+
+    def warm(self) -> None:
+        """
+        warm() generates every synthetic table, so that generation is not timed as part of a query.
+        """
+        for name in TABLE_RATIOS:
+            self.table(name)
+
+    def _result(self, query: str, parameters: Optional[dict]) -> pa.Table:
+        self.queries += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+        name = query_table(query)
+        table = self.table(name)
+        if parameters and 'start' in parameters and 'end' in parameters:
+            start = parameters['start']
+            # the high-water mark of incremental mempool queries narrows the window
+            if 'since_ms' in parameters:
+                start = max(start, parameters['since_ms'] // 1000 + 1)
+            seconds = self._seconds[name]
+            lo, hi = np.searchsorted(seconds, [start, parameters['end']])
+            table = table.slice(lo, max(hi - lo, 0))
+        # as does the high-water mark of incremental sidecar queries
+        if parameters and 'since_slot' in parameters:
+            table = table.filter(pc.greater(table.column('slot'), parameters['since_slot']))
+        if 'GROUP BY' in query.upper():
+            table = table.take(np.arange(0, table.num_rows, self.group_ratio))
+        return table
+
+    def _summary(self, table: pa.Table) -> dict:
+        # the stand-in reads exactly the rows it returns
+        return {'read_rows': str(table.num_rows), 'read_bytes': str(table.nbytes),
+                'elapsed_ns': str(int(self.latency * 1e9))}
+
+    def raw_query(self, query: str, parameters: Optional[dict] = None, settings: Optional[dict] = None,
+                  fmt: Optional[str] = None, use_database: bool = True, external_data=None, stream: bool = False):
+        table = self._result(query, parameters)
+        sink = pa.BufferOutputStream()
+        if fmt == 'ArrowStream':
+            block_size = (settings or {}).get('max_block_size', 65_536)
+            with pa.ipc.new_stream(sink, table.schema) as writer:
+                for batch in table.combine_chunks().to_batches(max_chunksize=block_size):
+                    writer.write_batch(batch)
+        else:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        response = StandInResponse(sink.getvalue().to_pybytes(),
+                                   headers={SUMMARY_HEADER: json.dumps(self._summary(table))})
+        return response if stream else response.data
+
+    def create_query_context(self, **kwargs) -> SimpleNamespace:
+        return SimpleNamespace(**kwargs)
+
+    def query(self, context: SimpleNamespace) -> SimpleNamespace:
+        table = self._result(context.query, context.parameters)
+        return SimpleNamespace(df_result=normalize_arrow(table).to_pandas(), summary=self._summary(table))
+
+
+class StandInResponse(io.BytesIO):
+    """
+    `StandInResponse` stands in for the streamed urllib3 response `StandInClient.raw_query()` returns.
+    """
+
+    def __init__(self, data: bytes, headers: Dict[str, str]):
+        super().__init__(data)
+        self.headers = headers
+
+    @property
+    def data(self) -> bytes:
+        return self.getvalue()
+
+    def release_conn(self) -> None:
+        pass
+
+
+def synthetic_hypersync(rows_per_day: int, days: int, end: datetime.datetime, seed: int = 0) -> Tuple[pa.Table, pa.Table]:
+    """
+    synthetic_hypersync() generates the transactions and blocks tables of `days` days of sequencer transactions ending
+    at `end`, in the types Hypersync returns with the column mapping of `Hypersync.fetch_data()`.
+    """
+    rng = np.random.default_rng(seed)
+    n_txs = max(int(rows_per_day * HYPERSYNC_RATIO * days), 1)
+    n_blocks = days * 7200
+    height = 20_000_000
+    first_block = height - n_blocks
+    end_ts = int(end.timestamp())
+
+    block_numbers = np.sort(rng.integers(first_block, height, n_txs)).astype(np.uint64)
+    transactions = pa.table({
+        'block_number': pa.array(block_numbers, pa.uint64()),
+        'transaction_index': pa.array(rng.integers(0, 300, n_txs), pa.uint64()),
+        'hash': _hex(rng, n_txs, 32),
+        'from': _hex(rng, n_txs, 20, pool=9),
+        'to': _hex(rng, n_txs, 20, pool=9),
+        'gas': pa.array(rng.integers(21_000, 1_000_000, n_txs).astype(np.float64)),
+        'gas_price': pa.array(rng.integers(10**9, 10**11, n_txs).astype(np.float64)),
+        'effective_gas_price': pa.array(rng.integers(10**9, 10**11, n_txs).astype(np.float64)),
+        'gas_used': pa.array(rng.integers(21_000, 1_000_000, n_txs).astype(np.float64)),
+        'cumulative_gas_used': pa.array(rng.integers(21_000, 30_000_000, n_txs).astype(np.float64)),
+        'max_fee_per_gas': pa.array(rng.integers(10**9, 10**11, n_txs).astype(np.float64)),
+        'max_priority_fee_per_gas': pa.array(rng.integers(10**8, 10**10, n_txs).astype(np.float64)),
+        'max_fee_per_blob_gas': pa.array(rng.integers(1, 10**10, n_txs).astype(np.float64)),
+        'nonce': pa.array(rng.integers(0, 1_000_000, n_txs), pa.int64()),
+        'value': pa.array(np.zeros(n_txs)),
+        'input': _hex(rng, n_txs, 64),
+    })
+
+    numbers = np.arange(first_block, height + 1, dtype=np.uint64)
+    blocks = pa.table({
+        'number': pa.array(numbers, pa.uint64()),
+        'hash': _hex(rng, len(numbers), 32),
+        'timestamp': pa.array(end_ts - (height - numbers.astype(np.int64)) * SECONDS_PER_SLOT, pa.int64()),
+        'extra_data': _hex(rng, len(numbers), 8, pool=16),
+        'base_fee_per_gas': pa.array(rng.integers(10**8, 10**11, len(numbers)).astype(np.float64)),
+        'gas_limit': pa.array(np.full(len(numbers), 30_000_000.0)),
+        'gas_used': pa.array(rng.integers(0, 30_000_000, len(numbers)).astype(np.float64)),
+        'size': pa.array(rng.integers(1_000, 200_000, len(numbers)).astype(np.float64)),
+    })
+
+    return transactions, blocks
+
+
+@dataclass
+class StandInHypersyncClient:
+    """
+    `StandInHypersyncClient` is a local stand-in for `hypersync.HypersyncClient`, used as
+    `Hypersync(client=StandInHypersyncClient(*synthetic_hypersync(...)))`. `collect_arrow()` returns the rows of
+    the synthetic tables in the block range of the query, with only the selected fields, and `stream_arrow()`
+    returns them in pages of `page_blocks` blocks. `latency` adds a fixed delay per request.
+    """
+    transactions: pa.Table
+    blocks: pa.Table
+    latency: float = 0.0
+    # blocks per page returned by `stream_arrow()`
+    page_blocks: int = 1_000
+
+    queries: int = field(default=0, init=False)
+    # block number columns of the tables, which are sorted by them so block ranges are slices
+    _numbers: Dict[str, np.ndarray] = field(default_factory=dict, init=False, repr=False)
+
+    def __post_init__(self):
+        self.transactions = self.transactions.sort_by('block_number')
+        self.blocks = self.blocks.sort_by('number')
+        self._numbers = {'block_number': self.transactions.column('block_number').to_numpy(),
+                         'number': self.blocks.column('number').to_numpy()}
+
+    async def get_height(self) -> int:
+        return int(pc.max(self.blocks.column('number')).as_py()) + 1
+
+    async def collect_arrow(self, query, config) -> SimpleNamespace:
+        self.queries += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        def select(table: pa.Table, column: str, fields: Optional[list]) -> pa.Table:
+            if not fields:
+                return pa.table({})
+            lo, hi = np.searchsorted(self._numbers[column], [query.from_block, query.to_block])
+            names = set(table.column_names)
+            return table.slice(lo, hi - lo).select([name for name in fields if name in names])
+
+        # transactions are only returned for queries with a transaction selection
+        data = SimpleNamespace(
+            transactions=select(self.transactions, 'block_number', getattr(query.field_selection, 'transaction', None)
+                                if getattr(query, 'transactions', None) else None),
+            blocks=select(self.blocks, 'number', getattr(query.field_selection, 'block', None)),
+        )
+        return SimpleNamespace(data=data, next_block=query.to_block)
+
+    async def stream_arrow(self, query, config) -> 'StandInStream':
+        return StandInStream(self, query, page_blocks=self.page_blocks)
+
+
+@dataclass
+class StandInStream:
+    """
+    `StandInStream` is the receiver returned by `StandInHypersyncClient.stream_arrow()`. Every `recv()` returns the
+    next page of `page_blocks` blocks, and None once the block range of the query is exhausted.
+    """
+    client: StandInHypersyncClient
+    query: object
+    page_blocks: int
+
+    _next_block: Optional[int] = field(default=None, init=False, repr=False)
+
+    async def recv(self) -> Optional[SimpleNamespace]:
+        start = self.query.from_block if self._next_block is None else self._next_block
+        if start >= self.query.to_block:
+            return None
+        self._next_block = min(start + self.page_blocks, self.query.to_block)
+        page = SimpleNamespace(**{**vars(self.query), 'from_block': start, 'to_block': self._next_block})
+        return await self.client.collect_arrow(page, None)
+
+    async def close(self) -> None:
+        pass
+
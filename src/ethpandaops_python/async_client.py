@@ -0,0 +1,161 @@
+import asyncio
+import functools
+
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from ethpandaops_python.client import Queries, ResultFrame
+from typing import Any, AsyncIterator, Callable, Coroutine, Dict, Iterator, Optional, Tuple, TypeVar
+
+T = TypeVar('T')
+
+# returned by `next()` once a stream is exhausted, as StopIteration cannot cross into a future
+_EXHAUSTED = object()
+
+
+def run_sync(coroutine: Coroutine[Any, Any, T]) -> T:
+    """
+    run_sync() runs a coroutine to completion for a blocking API. Inside a running event loop, e.g. in Jupyter, where
+    `asyncio.run()` cannot be used, the coroutine runs on its own event loop in a helper thread, and the calling
+    thread, with its loop, blocks until it completes. Await the async version instead to keep the loop running.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix='ethpandaops-run-sync') as executor:
+        return executor.submit(asyncio.run, coroutine).result()
+
+
+@dataclass
+class AsyncQueries:
+    """
+    `AsyncQueries` is the asyncio API of `Queries`: every query method can be awaited from a running event loop, and
+    every stream method is an async iterator, so an async service can run many queries concurrently without blocking
+    the loop.
+
+    Queries run on the pooled HTTP connections of `queries.pool`, from a thread pool of at most `max_concurrency`
+    workers, so at most that many queries are in flight. clickhouse_connect has no asyncio transport, and a worker
+    only waits on its connection, so this costs one idle thread per query in flight. Results, caching, sharding and
+    instrumentation are those of `queries`.
+
+    A cancelled query stops being awaited but runs to completion on its worker.
+
+    Usage:
+
+        async with AsyncQueries(Queries(result_format='polars')) as queries:
+            mempool_df, sidecar_df = await asyncio.gather(
+                queries.slot_inclusion_mempool(blob_producer, n_days=1, network='mainnet'),
+                queries.slot_inclusion_sidecar(n_days=1, network='mainnet'),
+            )
+            async for batch in queries.mempool_transaction_stream(time=7):
+                ...
+    """
+    queries: Queries = field(default_factory=Queries)
+    # maximum number of queries in flight, the connection pool size of `queries.pool` by default
+    max_concurrency: Optional[int] = None
+
+    _executor: Optional[ThreadPoolExecutor] = field(
+        default=None, init=False, repr=False)
+
+    async def __aenter__(self) -> 'AsyncQueries':
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        """
+        aclose() waits for the queries in flight and stops the worker threads. They are started again on the next query.
+        """
+        if self._executor is not None:
+            executor, self._executor = self._executor, None
+            await asyncio.get_running_loop().run_in_executor(None, executor.shutdown)
+
+    def _workers(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_concurrency or self.queries.pool.maxsize,
+                thread_name_prefix='ethpandaops-query')
+        return self._executor
+
+    async def _call(self, method: Callable[..., T], *args, **kwargs) -> T:
+        """
+        _call() runs a blocking `Queries` method on a worker thread.
+        """
+        return await asyncio.get_running_loop().run_in_executor(
+            self._workers(), functools.partial(method, *args, **kwargs))
+
+    async def _iterate(self, batches: Iterator[ResultFrame]) -> AsyncIterator[ResultFrame]:
+        """
+        _iterate() reads a `Queries` stream on worker threads, one batch at a time. The stream, and its connection, is
+        closed when iteration stops early.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                batch = await loop.run_in_executor(self._workers(), next, batches, _EXHAUSTED)
+                if batch is _EXHAUSTED:
+                    return
+                yield batch
+        finally:
+            await loop.run_in_executor(self._workers(), batches.close)
+
+    async def slot_inclusion_query(self, *args, **kwargs) -> Dict[str, ResultFrame]:
+        """
+        Awaitable `Queries.slot_inclusion_query()`.
+        """
+        return await self._call(self.queries.slot_inclusion_query, *args, **kwargs)
+
+    async def slot_inclusion_batch(self, *args, **kwargs) -> Dict[str, Dict[Tuple[str, str], ResultFrame]]:
+        """
+        Awaitable `Queries.slot_inclusion_batch()`.
+        """
+        return await self._call(self.queries.slot_inclusion_batch, *args, **kwargs)
+
+    async def slot_inclusion_mempool(self, *args, **kwargs) -> ResultFrame:
+        """
+        Awaitable `Queries.slot_inclusion_mempool()`.
+        """
+        return await self._call(self.queries.slot_inclusion_mempool, *args, **kwargs)
+
+    async def slot_inclusion_sidecar(self, *args, **kwargs) -> ResultFrame:
+        """
+        Awaitable `Queries.slot_inclusion_sidecar()`.
+        """
+        return await self._call(self.queries.slot_inclusion_sidecar, *args, **kwargs)
+
+    async def canonical_beacon_block_execution_transaction(self, *args, **kwargs) -> ResultFrame:
+        """
+        Awaitable `Queries.canonical_beacon_block_execution_transaction()`.
+        """
+        return await self._call(self.queries.canonical_beacon_block_execution_transaction, *args, **kwargs)
+
+    def canonical_beacon_block_execution_transaction_stream(self, *args, **kwargs) -> AsyncIterator[ResultFrame]:
+        """
+        Async iterator version of `Queries.canonical_beacon_block_execution_transaction_stream()`.
+        """
+        return self._iterate(self.queries.canonical_beacon_block_execution_transaction_stream(*args, **kwargs))
+
+    async def mempool_transaction(self, *args, **kwargs) -> ResultFrame:
+        """
+        Awaitable `Queries.mempool_transaction()`.
+        """
+        return await self._call(self.queries.mempool_transaction, *args, **kwargs)
+
+    def mempool_transaction_stream(self, *args, **kwargs) -> AsyncIterator[ResultFrame]:
+        """
+        Async iterator version of `Queries.mempool_transaction_stream()`.
+        """
+        return self._iterate(self.queries.mempool_transaction_stream(*args, **kwargs))
+
+    async def canonical_beacon_chain(self, *args, **kwargs) -> ResultFrame:
+        """
+        Awaitable `Queries.canonical_beacon_chain()`.
+        """
+        return await self._call(self.queries.canonical_beacon_chain, *args, **kwargs)
+
+    async def blob_propagation(self, *args, **kwargs) -> ResultFrame:
+        """
+        Awaitable `Queries.blob_propagation()`.
+        """
+        return await self._call(self.queries.blob_propagation, *args, **kwargs)
@@ -0,0 +1,165 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Tuple
+
+
+def normalize_sql(query: str) -> str:
+    """
+    normalize_sql() collapses whitespace so that queries that only differ in formatting share a cache key.
+    """
+    return " ".join(query.split())
+
+
+def query_table(query: str) -> str:
+    """
+    query_table() returns the table a query reads from, which selects the TTL of its cache entries: the first table
+    of the outer query, or the first table of a subquery if the outer query only reads from subqueries.
+    """
+    matches = list(re.finditer(r'\bFROM\s+(\w+)', query, re.IGNORECASE))
+    for match in matches:
+        prefix = query[:match.start()]
+        if prefix.count('(') == prefix.count(')'):
+            return match.group(1)
+    return matches[0].group(1) if matches else ''
+
+
+@dataclass
+class QueryCache:
+    """
+    `QueryCache` is an opt-in cache of query results, set with `Queries(cache=QueryCache())`.
+
+    Entries are keyed on the normalized SQL and its parameters. `Queries` rounds the end of the query window down to
+    `granularity` seconds, so repeated calls within that interval share an entry. Results are stored as parquet files
+    in `directory` with a small in-memory LRU tier in front of them. Entries expire after the TTL of their table
+    (`ttls`, falling back to `default_ttl`), and the least recently used files are evicted once the directory
+    grows beyond `max_bytes`.
+    """
+    directory: str = os.path.join('data', 'query_cache')
+    # seconds the query window is rounded down to
+    granularity: int = 300
+    # seconds an entry stays valid, per table
+    ttls: Dict[str, float] = field(default_factory=dict)
+    default_ttl: float = 3600
+    # size cap of the parquet files on disk
+    max_bytes: int = 2 * 1024**3
+    # number of results kept in memory
+    memory_items: int = 16
+
+    _memory: "OrderedDict[str, Tuple[float, pa.Table]]" = field(
+        default_factory=OrderedDict, init=False, repr=False)
+    _lock: threading.Lock = field(
+        default_factory=threading.Lock, init=False, repr=False)
+
+    def __post_init__(self):
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, query: str, parameters: Optional[dict] = None, namespace: str = '') -> str:
+        """
+        key() returns the content address of a query: a hash of its normalized SQL, parameters and namespace.
+        """
+        payload = json.dumps(
+            [namespace, normalize_sql(query), parameters or {}], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def ttl(self, query: str) -> float:
+        return self.ttls.get(query_table(query), self.default_ttl)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f'{key}.parquet')
+
+    def get(self, key: str, query: str) -> Optional[pa.Table]:
+        """
+        get() returns the cached result of `key`, or None if it is missing or expired.
+        """
+        ttl = self.ttl(query)
+        now = time.time()
+
+        with self._lock:
+            if key in self._memory:
+                created, table = self._memory[key]
+                if now - created <= ttl:
+                    self._memory.move_to_end(key)
+                    return table
+                del self._memory[key]
+
+        path = self._path(key)
+        try:
+            created = os.path.getmtime(path)
+        except FileNotFoundError:
+            return None
+        if now - created > ttl:
+            self._remove(path)
+            return None
+
+        try:
+            table = pq.read_table(path)
+        except (FileNotFoundError, pa.ArrowInvalid):
+            return None
+        # the access time orders files for LRU eviction, the modification time keeps the creation time
+        os.utime(path, (now, created))
+        self._remember(key, created, table)
+        return table
+
+    def put(self, key: str, table: pa.Table) -> None:
+        """
+        put() stores a result in memory and on disk, then evicts files beyond `max_bytes`.
+        """
+        path = self._path(key)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        pq.write_table(table, tmp_path, compression='zstd')
+        os.replace(tmp_path, path)
+
+        self._remember(key, os.path.getmtime(path), table)
+        self._evict()
+
+    def clear(self) -> None:
+        """
+        clear() removes every cached result.
+        """
+        with self._lock:
+            self._memory.clear()
+        for name in os.listdir(self.directory):
+            if name.endswith('.parquet'):
+                self._remove(os.path.join(self.directory, name))
+
+    def _remember(self, key: str, created: float, table: pa.Table) -> None:
+        with self._lock:
+            self._memory[key] = (created, table)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+
+    def _evict(self) -> None:
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.parquet'):
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_atime, stat.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._remove(os.path.join(self.directory, name))
+            with self._lock:
+                self._memory.pop(name[:-len('.parquet')], None)
+            total -= size
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
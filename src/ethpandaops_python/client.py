@@ -1,11 +1,25 @@
 import clickhouse_connect
+import contextlib
 import pandas as pd
+import polars as pl
+import pyarrow as pa
+import datetime
 import os
+import re
+import threading
 
 from clickhouse_connect.driver.client import Client
-from dataclasses import dataclass
+from clickhouse_connect.driver.httputil import get_pool_manager
+from dataclasses import dataclass, field
 from dotenv import load_dotenv
-from typing import Union, Dict
+from ethpandaops_python.cache import QueryCache, query_table
+from ethpandaops_python.executor import ShardedExecutor
+from ethpandaops_python.inclusion import sequencer_names
+from ethpandaops_python.instrumentation import (Instrumentation, QueryEvent, measure, record_summary, response_summary,
+                                                result_bytes, timed)
+from ethpandaops_python.query import ExternalTable, Select, external_data, sequencer_column
+from ethpandaops_python.schema import apply_arrow, apply_pandas, arrow_to_pandas, pandas_to_arrow, table_schema
+from typing import Iterator, Optional, Sequence, Tuple, Union, Dict
 
 # Set read formats to customize data output from Clickhouse
 # https://clickhouse.com/docs/en/integrations/python#read-format-options-python-types
@@ -17,8 +31,182 @@ set_read_format("IPv*", "string")
 # Return binary as string
 set_read_format("FixedString", "string")
 
-# sets large ints to floats so that there are no large int overflow errors when converting to polars dataframe
-set_read_format("Int*", "float")
+# Integer columns keep exact types. Each result is converted to the column types of its table by `schema.py`.
+
+# Arrow output settings. FixedString columns (hashes, addresses) are returned as strings rather than
+# fixed size byte arrays, which leaves fixed size binary for the 128 and 256 bit integer columns only.
+# https://clickhouse.com/docs/en/interfaces/formats#data-types-matching-arrow
+ARROW_SETTINGS: Dict[str, int] = {
+    "output_format_arrow_fixed_string_as_fixed_byte_array": 0,
+    # String columns as Arrow strings rather than binary, which `Client.query_arrow(use_strings=True)` sets
+    "output_format_arrow_string_as_string": 1,
+}
+
+ResultFrame = Union[pd.DataFrame, pa.Table, pl.DataFrame]
+
+# columns of the `canonical_beacon_blob_sidecar_df` of `Queries.slot_inclusion_query()`
+SIDECAR_COLUMNS = ['slot', 'slot_start_date_time', 'block_root', 'kzg_commitment', 'meta_network_name',
+                   'blob_index', 'versioned_hash', 'blob_size', 'blob_empty_size']
+
+
+def normalize_arrow(table: pa.Table, schema: Optional[Dict[str, str]] = None) -> pa.Table:
+    """
+    Normalizes a ClickHouse Arrow result so it matches the types of the pandas result path:
+     * `DateTime` columns, which ClickHouse sends as uint32 seconds, become naive UTC timestamps.
+     * timezone aware `DateTime64` columns become naive UTC timestamps.
+     * (U)Int128/(U)Int256 columns, which ClickHouse sends as fixed size binary, are decoded exactly, and columns of
+       the table `schema` are narrowed or dictionary encoded, see `schema.apply_arrow()`.
+    """
+    for i, column_field in enumerate(table.schema):
+        column = table.column(i)
+        if column_field.name.endswith('date_time') and pa.types.is_uint32(column_field.type):
+            column = column.cast(pa.int64()).cast(pa.timestamp('s'))
+        elif pa.types.is_timestamp(column_field.type) and column_field.type.tz is not None:
+            # Arrow stores timestamps as UTC instants, so dropping the timezone keeps UTC wall time
+            column = column.cast(pa.timestamp(column_field.type.unit))
+        else:
+            continue
+        table = table.set_column(i, column_field.name, column)
+    return apply_arrow(table, schema or {})
+
+
+def aggregate_keys(time_column: str, group_by: Sequence[str], bucket: Optional[str] = None) -> tuple[str, str]:
+    """
+    aggregate_keys() returns the comma separated grouping keys of an aggregate query, as (select keys, group by keys).
+    If `bucket` is set, e.g. '1 HOUR' or '15 MINUTE', `time_column` is rounded down to buckets of that size and
+    added as a `bucket` key.
+    """
+    for key in group_by:
+        if not re.fullmatch(r'\w+', key):
+            raise ValueError(f"invalid group_by column '{key}'")
+
+    select_keys = list(group_by)
+    group_keys = list(group_by)
+    if bucket is not None:
+        if not re.fullmatch(r'\d+ (SECOND|MINUTE|HOUR|DAY|WEEK)', bucket.upper()):
+            raise ValueError(
+                f"bucket must look like '1 HOUR' or '15 MINUTE', got '{bucket}'")
+        select_keys.insert(
+            0, f"toStartOfInterval({time_column}, INTERVAL {bucket}) AS bucket")
+        group_keys.insert(0, "bucket")
+
+    if not group_keys:
+        raise ValueError(
+            'an aggregate needs at least one group_by column or a bucket')
+    return ", ".join(select_keys), ", ".join(group_keys)
+
+
+def sidecar_restriction(
+    sidecar_filter: str,
+    network: Union[str, Sequence[str]],
+    blob_producer: Union[str, Dict[list[str], list[str]]],
+) -> dict:
+    """
+    sidecar_restriction() returns the `Queries.slot_inclusion_sidecar()` arguments of a `sidecar_filter`:
+     * 'none' returns the sidecars of every network.
+     * 'network' returns only the sidecars of `network`.
+     * 'producer' returns only the sidecars of blobs `blob_producer` sent to the mempool in the window.
+    """
+    match sidecar_filter:
+        case 'none':
+            return {}
+        case 'network':
+            return {'network': network}
+        case 'producer':
+            return {'network': network, 'blob_producer': blob_producer}
+        case _:
+            raise ValueError(
+                f"sidecar_filter must be 'none', 'network' or 'producer', got '{sidecar_filter}'")
+
+
+def quantile_name(level: float) -> str:
+    """
+    quantile_name() names a quantile column after its percentile, e.g. 0.5 -> 'p50' and 0.999 -> 'p99_9'.
+    """
+    return f"p{level * 100:g}".replace('.', '_')
+
+
+def partition_frames(df: ResultFrame, by: Sequence[str]) -> Dict[tuple, ResultFrame]:
+    """
+    partition_frames() splits a `Queries` result into one result of the same format per distinct value of the `by`
+    columns, keyed by the tuple of those values.
+    """
+    def as_key(key) -> tuple:
+        return key if isinstance(key, tuple) else (key,)
+
+    if isinstance(df, pl.DataFrame):
+        return {as_key(key): part for key, part in df.partition_by(list(by), as_dict=True).items()}
+    if isinstance(df, pd.DataFrame):
+        return {as_key(key): part for key, part in df.groupby(list(by), observed=True, sort=False)}
+    # Arrow tables are split by the row positions of each key
+    positions = pl.from_arrow(df.select(list(by))).with_row_index('position')
+    return {as_key(key): df.take(part.get_column('position').to_arrow())
+            for key, part in positions.partition_by(list(by), as_dict=True).items()}
+
+
+def to_polars(df: ResultFrame) -> pl.DataFrame:
+    """
+    to_polars() converts a `Queries` result to a polars DataFrame, only going through pandas when the
+    result is already a pandas DataFrame.
+    """
+    if isinstance(df, pl.DataFrame):
+        return df
+    if isinstance(df, pd.DataFrame):
+        return pl.from_arrow(pandas_to_arrow(df))
+    return pl.from_arrow(df)
+
+
+@dataclass
+class ClientPool:
+    """
+    `ClientPool` lazily creates a ClickHouse client backed by a pool of HTTP connections. Nothing connects until
+    the first query, so importing the library needs no network access. A pool can be shared across `Queries`
+    instances and threads.
+
+    Credentials default to the HOST, USERNAME and PASSWORD variables of the environment or `.env` file.
+    """
+    host: Optional[str] = None
+    username: Optional[str] = None
+    password: Optional[str] = None
+    secure: bool = True
+    # maximum number of pooled connections, it should be at least the number of threads querying concurrently
+    maxsize: int = 8
+    # an existing client to use instead of creating one
+    client: Optional[Client] = None
+
+    _lock: threading.Lock = field(
+        default_factory=threading.Lock, init=False, repr=False)
+
+    def get_client(self) -> Client:
+        """
+        get_client() returns the pool's client, creating it on the first call.
+        """
+        if self.client is None:
+            with self._lock:
+                if self.client is None:
+                    load_dotenv()
+                    self.client = clickhouse_connect.get_client(
+                        host=self.host or os.environ.get("HOST"),
+                        username=self.username or os.environ.get("USERNAME"),
+                        password=self.password or os.environ.get("PASSWORD"),
+                        secure=self.secure,
+                        # threads wait for a free connection rather than opening connections beyond maxsize
+                        pool_mgr=get_pool_manager(
+                            maxsize=self.maxsize, block=True),
+                        # queries may run concurrently from several threads, which ClickHouse rejects within a single session
+                        autogenerate_session_id=False,
+                    )
+        return self.client
+
+
+_default_pool = ClientPool()
+
+
+def default_pool() -> ClientPool:
+    """
+    default_pool() returns the connection pool shared by `Queries` instances that are not given their own.
+    """
+    return _default_pool
 
 
 @dataclass
@@ -28,148 +216,481 @@ class Queries:
     purpose of this class is to categorize different queries by table and make it easier to automate broad filters such as
     network and number of days to query from.
     """
-    load_dotenv()
-    # Create ClickHouse client
-    client: Client = clickhouse_connect.get_client(
-        host=os.environ.get("HOST"),
-        username=os.environ.get("USERNAME"),
-        password=os.environ.get("PASSWORD"),
-        secure=True,
-    )
+    # ClickHouse connection pool, shared by every Queries instance by default. The client connects on the first query.
+    pool: ClientPool = field(default_factory=default_pool)
+
+    # result_format sets the type returned by every query method:
+    #  * 'pandas' returns a pandas DataFrame built by clickhouse_connect.
+    #  * 'arrow' returns a pyarrow Table read straight from the ClickHouse Arrow format.
+    #  * 'polars' returns a polars DataFrame built zero-copy from the Arrow result, without a pandas step.
+    result_format: str = 'pandas'
+
+    # optional executor that splits the time window of every query into shards that run in parallel,
+    # e.g. ShardedExecutor(window=datetime.timedelta(hours=6), max_workers=8)
+    executor: Optional[ShardedExecutor] = None
+
+    # optional local cache of query results, e.g. QueryCache(ttls={'mempool_transaction': 600})
+    cache: Optional[QueryCache] = None
+
+    # optional instrumentation that records the timings, rows and bytes of every query,
+    # e.g. Instrumentation(hooks=[Collector()])
+    instrumentation: Optional[Instrumentation] = None
+
+    @property
+    def client(self) -> Client:
+        """
+        The ClickHouse client of the connection pool, created on first use.
+        """
+        return self.pool.get_client()
+
+    @staticmethod
+    def _settings(event: Optional[QueryEvent], settings: Optional[dict] = None) -> Optional[dict]:
+        """
+        _settings() adds the query id of an instrumented query to its settings.
+        """
+        if event is None:
+            return settings
+        return {**(settings or {}), 'query_id': event.query_id}
+
+    def _query_arrow(self, query: str, parameters: Optional[dict] = None, event: Optional[QueryEvent] = None,
+                     external: Sequence[ExternalTable] = ()) -> pa.Table:
+        """
+        _query_arrow() runs a query using the ClickHouse Arrow format and normalizes the column types. The query is run
+        with `Client.raw_query()` rather than `Client.query_arrow()`, which drops the summary of the response.
+        """
+        with timed(event, 'transfer'):
+            response = self.client.raw_query(query, parameters=parameters, settings=self._settings(
+                event, ARROW_SETTINGS), fmt='Arrow', external_data=external_data(external), stream=True)
+            try:
+                record_summary(event, response_summary(response))
+                table = pa.ipc.open_file(response.data).read_all()
+            finally:
+                response.release_conn()
+        with timed(event, 'convert'):
+            return normalize_arrow(table, table_schema(query_table(query)))
+
+    def _query_df(self, query: str, parameters: Optional[dict] = None, event: Optional[QueryEvent] = None,
+                  external: Sequence[ExternalTable] = ()) -> pd.DataFrame:
+        """
+        _query_df() runs a query into a pandas DataFrame built by clickhouse_connect, which decodes while it receives.
+        """
+        with timed(event, 'transfer'):
+            # `Client.query_df()` drops the summary of the result
+            result = self.client.query(context=self.client.create_query_context(
+                query=query, parameters=parameters, settings=self._settings(event), use_numpy=True, as_pandas=True,
+                external_data=external_data(external)))
+            record_summary(event, result.summary)
+            df = result.df_result
+        with timed(event, 'convert'):
+            return apply_pandas(df, table_schema(query_table(query)))
+
+    def _query(self, query: str, parameters: Optional[dict] = None, external: Sequence[ExternalTable] = ()) -> ResultFrame:
+        """
+        _query() runs a query and returns the result in the configured `result_format`, going through the `cache` if set.
+        If `instrumentation` is set, the query is sent with a query id and measured. `external` tables are sent along
+        with the query.
+        """
+        if self.instrumentation is None:
+            return self._execute(query, parameters, external=external)
+
+        with measure(self.instrumentation, 'clickhouse', query_table(query)) as event:
+            result = self._execute(query, parameters, event, external)
+            event.rows = len(result)
+            event.result_bytes = result_bytes(result)
+        return result
+
+    def _execute(self, query: str, parameters: Optional[dict] = None, event: Optional[QueryEvent] = None,
+                 external: Sequence[ExternalTable] = ()) -> ResultFrame:
+        if self.cache is not None:
+            return self._query_cached(query, parameters, event, external)
+
+        match self.result_format:
+            case 'pandas':
+                return self._query_df(query, parameters, event, external)
+            case 'arrow':
+                return self._query_arrow(query, parameters, event, external)
+            case 'polars':
+                table = self._query_arrow(query, parameters, event, external)
+                with timed(event, 'convert'):
+                    return pl.from_arrow(table)
+            case _:
+                raise ValueError(
+                    f"result_format must be one of 'pandas', 'arrow' or 'polars', got '{self.result_format}'")
+
+    def _query_cached(self, query: str, parameters: Optional[dict] = None, event: Optional[QueryEvent] = None,
+                      external: Sequence[ExternalTable] = ()) -> ResultFrame:
+        """
+        _query_cached() returns a cached result if there is one, otherwise it runs the query and caches its result.
+        Results are cached as Arrow tables, pandas results are keyed separately as their column types differ, and
+        converted with `pandas_to_arrow()` so their wide integer columns do not overflow.
+        The rows of `external` tables are part of the key, as they are not in the query text.
+        """
+        namespace = 'pandas' if self.result_format == 'pandas' else 'arrow'
+        key_parameters = {**(parameters or {}), **{f'external.{table.name}': table.rows for table in external}}
+        key = self.cache.key(query, key_parameters, namespace)
+
+        table = self.cache.get(key, query)
+        if table is None:
+            if namespace == 'pandas':
+                df = self._query_df(query, parameters, event, external)
+                with timed(event, 'convert'):
+                    table = pandas_to_arrow(df)
+            else:
+                table = self._query_arrow(query, parameters, event, external)
+            self.cache.put(key, table)
+        elif event is not None:
+            event.cached = True
+
+        with timed(event, 'convert'):
+            match self.result_format:
+                case 'pandas':
+                    return arrow_to_pandas(table)
+                case 'arrow':
+                    return table
+                case 'polars':
+                    return pl.from_arrow(table)
+                case _:
+                    raise ValueError(
+                        f"result_format must be one of 'pandas', 'arrow' or 'polars', got '{self.result_format}'")
+
+    def _run(self, statement: Select, n_days: int, shard: bool = True, newest_first: bool = False,
+             end: Optional[datetime.datetime] = None) -> ResultFrame:
+        """
+        _run() runs a statement over the `n_days` days before `end`, or the last `n_days` days if `end` is not set.
+        The statement selects its window with `Select.window()`, and subqueries that span every shard with
+        `Select.window(full=True)`. Its bound parameters and external tables are sent with every shard.
+
+        If an `executor` is set and `shard` is True, the window is split into shards that are queried in parallel.
+        Queries that aggregate over the whole window or use LIMIT must not be sharded. `newest_first` concatenates
+        shards from the newest to the oldest, for queries ordered by time descending.
+        """
+        if end is None:
+            end = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+            if self.cache is not None:
+                # round the window so that calls within `granularity` seconds share cache entries
+                end = datetime.datetime.fromtimestamp(
+                    int(end.timestamp()) // self.cache.granularity * self.cache.granularity, datetime.timezone.utc)
+        elif end.tzinfo is None:
+            # naive datetimes are UTC
+            end = end.replace(tzinfo=datetime.timezone.utc)
+        start = end - datetime.timedelta(days=n_days)
+
+        query = statement.sql()
+        parameters = dict(statement.parameters)
+        external = list(statement.external.values())
+        if '{window_start:UInt32}' in query:
+            parameters.update(window_start=int(start.timestamp()),
+                              window_end=int(end.timestamp()))
+
+        def fetch(shard_start: datetime.datetime, shard_end: datetime.datetime) -> ResultFrame:
+            return self._query(query, {**parameters, 'start': int(shard_start.timestamp()),
+                                       'end': int(shard_end.timestamp())}, external)
+
+        if self.executor is None or not shard:
+            return fetch(start, end)
+        return self.executor.run(fetch, start, end, reverse=newest_first)
+
+    def _stream(self, statement: Select, n_days: int, batch_size: int) -> Iterator[ResultFrame]:
+        """
+        _stream() runs a statement over the last `n_days` days and yields its result in batches of at most `batch_size`
+        rows, in the configured `result_format`. Only one batch is held in memory at a time.
+        """
+        end = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+        start = end - datetime.timedelta(days=n_days)
+        query = statement.sql()
+        parameters = {**statement.parameters, 'start': int(start.timestamp()),
+                      'end': int(end.timestamp())}
+        # ClickHouse writes one Arrow record batch per block, so the block size bounds the batch size
+        settings = {**ARROW_SETTINGS, 'max_block_size': batch_size}
+
+        # a stream is measured as one event, from the query until its last batch is read
+        with measure(self.instrumentation, 'clickhouse', query_table(query)) as event:
+            if self.instrumentation is not None:
+                settings = self._settings(event, settings)
+            # ClickHouse only sends the response once the query has finished, so its summary is already complete
+            response = self.client.raw_query(query, parameters=parameters, settings=settings, fmt='ArrowStream',
+                                             external_data=external_data(list(statement.external.values())),
+                                             stream=True)
+            record_summary(event, response_summary(response))
+            with contextlib.closing(response):
+                batches = iter(pa.ipc.open_stream(response))
+                while True:
+                    with timed(event, 'transfer'):
+                        batch = next(batches, None)
+                    if batch is None:
+                        break
+
+                    with timed(event, 'convert'):
+                        table = normalize_arrow(pa.Table.from_batches(
+                            [batch]), table_schema(query_table(query)))
+                        match self.result_format:
+                            case 'pandas':
+                                result = arrow_to_pandas(table)
+                            case 'arrow':
+                                result = table
+                            case 'polars':
+                                result = pl.from_arrow(table)
+                            case _:
+                                raise ValueError(
+                                    f"result_format must be one of 'pandas', 'arrow' or 'polars', got '{self.result_format}'")
+                    event.rows += table.num_rows
+                    event.result_bytes += result_bytes(result)
+                    yield result
 
     def slot_inclusion_query(
         self,
         blob_producer: Union[str, Dict[list[str], list[str]]],
         n_days: int,
-        network: str,
-    ) -> dict[str, pd.DataFrame]:
+        network: Union[str, Sequence[str]],
+        mempool_since: Optional[datetime.datetime] = None,
+        sidecar_since_slot: Optional[int] = None,
+        end: Optional[datetime.datetime] = None,
+        sidecar_filter: str = 'network',
+        label_sequencers: bool = False,
+    ) -> dict[str, ResultFrame]:
         """
         slot_inclusion_query() makes queries to the Ethpandaops Clickhouse instance to get mempool and canonical beacon block sidecar data for a specific rollup.
 
+        `mempool_since` (naive UTC) and `sidecar_since_slot` are optional high-water marks. When set, only mempool events
+        after `mempool_since` and sidecars after `sidecar_since_slot` are returned, which lets callers refresh incrementally.
+
+        `end` sets the end of the `n_days` window, now by default. Pass the same `end` as `Hypersync.query_txs(end_time=...)`
+        to query the transactions of exactly the same window.
+
+        `sidecar_filter` restricts the sidecars ClickHouse returns to `network` or to the blobs of `blob_producer`,
+        see `sidecar_restriction()`.
+
+        `network` may be a list of networks. `label_sequencers` adds a categorical `sequencer` column to both results,
+        see `slot_inclusion_batch()`; it requires `sidecar_filter='producer'`.
+
         Returns a dictionary formatted as:
 
         {'mempool_df': mempool_df,
         'canonical_beacon_blob_sidecar_df': canonical_beacon_blob_sidecar_df,
         }
         """
+        # Query dataframes
+        mempool_df: ResultFrame = self.slot_inclusion_mempool(
+            blob_producer=blob_producer, n_days=n_days, network=network, since=mempool_since, end=end,
+            label_sequencers=label_sequencers)
+        canonical_beacon_blob_sidecar_df: ResultFrame = self.slot_inclusion_sidecar(
+            n_days=n_days, since_slot=sidecar_since_slot, end=end, label_sequencers=label_sequencers,
+            **sidecar_restriction(sidecar_filter, network, blob_producer))
+
+        return {
+            "mempool_df": mempool_df,
+            "canonical_beacon_blob_sidecar_df": canonical_beacon_blob_sidecar_df,
+        }
+
+    def slot_inclusion_batch(
+        self,
+        blob_producer: Union[str, Dict[list[str], list[str]]],
+        n_days: int,
+        networks: Sequence[str],
+        end: Optional[datetime.datetime] = None,
+    ) -> dict[str, Dict[Tuple[str, str], ResultFrame]]:
+        """
+        slot_inclusion_batch() is `slot_inclusion_query()` for several networks and every sequencer of `blob_producer` at
+        once. It runs one query per table, filtered on `networks` and on the sequencer addresses, which are sent as an
+        external table, instead of one pair of queries per network and rollup.
+
+        Both results are labelled with a categorical `sequencer` column, from the `sequencer_addresses`/`sequencer_names`
+        mapping of `blob_producer`, and partitioned per network and sequencer. Sidecars are restricted to the blobs of
+        `blob_producer` (`sidecar_filter='producer'`), so each sidecar belongs to the sequencer that sent its blob. Every
+        requested pair is returned, empty when it has no rows.
+
+        Returns a dictionary formatted as:
+
+        {'mempool_df': {(network, sequencer): mempool_df, ...},
+        'canonical_beacon_blob_sidecar_df': {(network, sequencer): canonical_beacon_blob_sidecar_df, ...},
+        }
+        """
+        results = self.slot_inclusion_query(
+            blob_producer=blob_producer, n_days=n_days, network=list(networks), end=end,
+            sidecar_filter='producer', label_sequencers=True)
 
-        # Build query conditions based on blob_producer type
-        if isinstance(blob_producer, str):
-            blob_producer_condition = f"from = '{blob_producer}'"
-        elif isinstance(blob_producer, dict):
-            # Convert the dictionary values to a properly formatted SQL string
-            blob_producer_list = ", ".join(
-                f"'{addr}'" for addr in blob_producer['sequencer_addresses'])
+        names = list(dict.fromkeys(sequencer_names(blob_producer).values()))
+        batches = {}
+        for name, df in results.items():
+            partitions = partition_frames(df, ['meta_network_name', 'sequencer'])
+            empty = df.head(0) if not isinstance(df, pa.Table) else df.slice(0, 0)
+            batches[name] = {(network, sequencer): partitions.get((network, sequencer), empty)
+                             for network in networks for sequencer in names}
+        return batches
 
-            blob_producer_condition = f"from IN ({blob_producer_list})"
+    def slot_inclusion_mempool(
+        self,
+        blob_producer: Union[str, Dict[list[str], list[str]]],
+        n_days: int,
+        network: Union[str, Sequence[str]],
+        since: Optional[datetime.datetime] = None,
+        end: Optional[datetime.datetime] = None,
+        label_sequencers: bool = False,
+    ) -> ResultFrame:
+        """
+        slot_inclusion_mempool() queries the blob transactions a rollup sent to the mempool, the `mempool_df` of `slot_inclusion_query()`.
+
+        `since` (naive UTC) is an optional high-water mark, only events after it are returned. `end` sets the end of the window.
+
+        `network` may be a list of networks. `label_sequencers` adds the sequencer name of each transaction, see
+        `query.sequencer_column()`.
+        """
+        columns = ['event_date_time', 'type', 'blob_sidecars_size', 'blob_sidecars_empty_size', 'hash', 'to', 'from',
+                   'blob_hashes', 'nonce', 'meta_network_name', 'meta_client_name']
+        if label_sequencers:
+            columns.append(sequencer_column())
 
         # Mempool query
-        mempool_query = f"""
-        SELECT
-            event_date_time,
-            type,
-            blob_sidecars_size,
-            blob_sidecars_empty_size,
-            hash,
-            to,
-            from,
-            blob_hashes,
-            nonce,
-            meta_network_name,
-            length(blob_hashes) as blob_hashes_length,
-            ROUND(100 - (blob_sidecars_empty_size / blob_sidecars_size) * 100, 2) AS fill_percentage,
-            blob_gas,
-            blob_gas_fee_cap,
-            gas_price,
-            gas_tip_cap,
-            gas_fee_cap
-        FROM mempool_transaction
-        WHERE event_date_time > NOW() - INTERVAL '{n_days} DAYS'
-        AND type = 3
-        AND meta_network_name = '{network}'
-        AND {blob_producer_condition}
-        """
-
-        # Canonical beacon block sidecar query
-        canonical_beacon_blob_sidecar_query = f"""
-        SELECT
-            slot,
-            slot_start_date_time,
-            block_root,
-            kzg_commitment,
-            meta_network_name,
-            blob_index,
-            versioned_hash,
-            blob_size,
-            blob_empty_size
-        FROM canonical_beacon_blob_sidecar
-        WHERE slot_start_date_time > NOW() - INTERVAL '{n_days} DAYS'
+        mempool_query = Select('mempool_transaction', columns=[
+            *columns,
+            'length(blob_hashes) as blob_hashes_length',
+            'ROUND(100 - (blob_sidecars_empty_size / blob_sidecars_size) * 100, 2) AS fill_percentage',
+            'blob_gas',
+            'blob_gas_fee_cap',
+            'gas_price',
+            'gas_tip_cap',
+            'gas_fee_cap',
+        ]).window().tx_type(3).network(network).producer(blob_producer).since(since)
+
+        return self._run(mempool_query, n_days, end=end)
+
+    def slot_inclusion_sidecar(
+        self,
+        n_days: int,
+        since_slot: Optional[int] = None,
+        end: Optional[datetime.datetime] = None,
+        network: Optional[Union[str, Sequence[str]]] = None,
+        blob_producer: Optional[Union[str, Dict[list[str], list[str]]]] = None,
+        columns: Optional[Sequence[str]] = None,
+        label_sequencers: bool = False,
+    ) -> ResultFrame:
         """
+        slot_inclusion_sidecar() queries canonical beacon blob sidecars, the `canonical_beacon_blob_sidecar_df` of `slot_inclusion_query()`.
 
-        # Query dataframes
-        mempool_df: pd.DataFrame = self.client.query_df(mempool_query)
-        canonical_beacon_blob_sidecar_df: pd.DataFrame = self.client.query_df(
-            canonical_beacon_blob_sidecar_query
-        )
+        `since_slot` is an optional high-water mark, only sidecars of later slots are returned. `end` sets the end of the window.
 
-        return {
-            "mempool_df": mempool_df,
-            "canonical_beacon_blob_sidecar_df": canonical_beacon_blob_sidecar_df,
-        }
+        The filters below run in ClickHouse, so sidecars that cannot match a tracked rollup are never downloaded:
+         * `network` keeps only the sidecars of that network, or of a list of networks.
+         * `blob_producer` keeps only the sidecars whose versioned hash is one of the blob hashes `blob_producer` sent to
+           the mempool in the same window, a semi-join on `mempool_transaction`.
+         * `columns` selects a subset of `SIDECAR_COLUMNS`, all of them by default.
+
+        `label_sequencers` adds the name of the sequencer that sent each blob, see `query.sequencer_column()`. The
+        semi-join then becomes a join on the versioned hash and network, which requires `blob_producer`.
+        """
+        if columns is None:
+            columns = SIDECAR_COLUMNS
+        for column in columns:
+            if column not in SIDECAR_COLUMNS:
+                raise ValueError(f"invalid sidecar column '{column}'")
+        if label_sequencers:
+            if blob_producer is None:
+                raise ValueError('label_sequencers requires a blob_producer')
+            columns = [*columns, 'sequencer']
+
+        # Canonical beacon block sidecar query, only of slots newer than the high-water mark, if any
+        canonical_beacon_blob_sidecar_query = Select('canonical_beacon_blob_sidecar', columns=columns)
+
+        # the mempool side of the semi-join uses the same network and whole window, so it matches `slot_inclusion_mempool()`
+        # in every shard
+        if label_sequencers:
+            producer_blobs = Select('mempool_transaction', distinct=True, columns=[
+                'arrayJoin(blob_hashes) AS versioned_hash', 'meta_network_name', sequencer_column(),
+            ]).window(full=True).tx_type(3).network(network).producer(blob_producer)
+            canonical_beacon_blob_sidecar_query.join(
+                'ANY INNER JOIN', producer_blobs, 'producer_blobs', 'USING (versioned_hash, meta_network_name)')
+
+        canonical_beacon_blob_sidecar_query.window().network(network).after_slot(since_slot)
+
+        if blob_producer is not None and not label_sequencers:
+            canonical_beacon_blob_sidecar_query.filter_in('versioned_hash', Select(
+                'mempool_transaction', columns=['arrayJoin(blob_hashes)'],
+            ).window(full=True).tx_type(3).network(network).producer(blob_producer))
+
+        return self._run(canonical_beacon_blob_sidecar_query, n_days, end=end)
 
-    def canonical_beacon_block_execution_transaction(self, all_cols: str = 'blobs', time: int = 7, network: str = 'mainnet', type: int = 3) -> pd.DataFrame:
+    def canonical_beacon_block_execution_transaction(self, all_cols: str = 'blobs', time: int = 7, network: Union[str, Sequence[str]] = 'mainnet', type: int = 3) -> ResultFrame:
         """
         Queries that utilize data captured by Xatu Cannon, which collect execution layer transaction data from the beacon chain.
         - https://dbt.platform.ethpandaops.io/#!/source/source.xatu.clickhouse.canonical_beacon_block_execution_transaction
         """
         match all_cols:
             case 'blobs':
-                query = f"""
-                SELECT
-                    slot_start_date_time,
-                    slot,
-                    epoch,
-                    hash,
-                    blob_hashes,
-                    length(blob_hashes) as blob_hashes_length,
-                    type,
-                    gas_price,
-                    gas,
-                    size,
-                    call_data_size,
-                    gas_tip_cap as priority_fee,
-                    gas_fee_cap as max_fee_per_gas,
-                    blob_gas,
-                    blob_gas_fee_cap,
-                    meta_network_name
-                FROM canonical_beacon_block_execution_transaction
-                WHERE slot_start_date_time > NOW() - INTERVAL '{time} DAYS'
-                AND type = {type} AND meta_network_name = '{network}'
-                ORDER BY slot DESC
-                """
-                return self.client.query_df(query)
+                query = Select('canonical_beacon_block_execution_transaction', columns=[
+                    'slot_start_date_time',
+                    'slot',
+                    'epoch',
+                    'hash',
+                    'blob_hashes',
+                    'length(blob_hashes) as blob_hashes_length',
+                    'type',
+                    'gas_price',
+                    'gas',
+                    'size',
+                    'call_data_size',
+                    'gas_tip_cap as priority_fee',
+                    'gas_fee_cap as max_fee_per_gas',
+                    'blob_gas',
+                    'blob_gas_fee_cap',
+                    'meta_network_name',
+                ], order_by=['slot DESC']).window().tx_type(type).network(network)
+                return self._run(query, time, newest_first=True)
             case 'all':
-                query = f"""
-                    SELECT * FROM canonical_beacon_block_execution_transaction
-                    WHERE slot_start_date_time > NOW() - INTERVAL '{time} DAYS'
-                    AND meta_network_name = '{network}'
-                    """
-                return self.client.query_df(query)
+                query = Select('canonical_beacon_block_execution_transaction').window().network(network)
+                return self._run(query, time)
             case 'sample':
-                query = f"""
-                    SELECT * FROM canonical_beacon_block_execution_transaction
-                    WHERE slot_start_date_time > NOW() - INTERVAL '{time} DAYS'
-                    AND meta_network_name = '{network}'
-                    LIMIT 1000
-                    """
-                return self.client.query_df(query)
+                query = Select('canonical_beacon_block_execution_transaction',
+                               limit=1000).window().network(network)
+                return self._run(query, time, shard=False)
+
+    def canonical_beacon_block_execution_transaction_stream(self,
+                                                            all_cols: str = 'all',
+                                                            columns: Optional[Sequence[str]] = None,
+                                                            time: int = 7,
+                                                            network: Union[str, Sequence[str]] = 'mainnet',
+                                                            batch_size: int = 65_536,
+                                                            ) -> Iterator[ResultFrame]:
+        """
+        Streaming version of the 'all' and 'sample' modes of `canonical_beacon_block_execution_transaction()`, which
+        yields batches of at most `batch_size` rows instead of building the whole result in memory.
+
+        `columns` selects the columns to return, the projection is applied by ClickHouse. Batches can be written to
+        partitioned parquet files with `ParquetSink`.
+        """
+        query = Select('canonical_beacon_block_execution_transaction', columns=columns or (),
+                       limit=1000 if all_cols == 'sample' else None).window().network(network)
+        return self._stream(query, time, batch_size)
+
+    def mempool_transaction_stream(self,
+                                   all_cols: str = 'all',
+                                   columns: Optional[Sequence[str]] = None,
+                                   time: int = 7,
+                                   network: Optional[Union[str, Sequence[str]]] = None,
+                                   batch_size: int = 65_536,
+                                   ) -> Iterator[ResultFrame]:
+        """
+        Streaming version of the 'all' and 'sample' modes of `mempool_transaction()`, which yields batches of at most
+        `batch_size` rows instead of building the whole result in memory.
+
+        `columns` selects the columns to return, the projection is applied by ClickHouse. Like the 'all' mode, all
+        networks are returned unless `network` is set. Batches can be written to partitioned parquet files with
+        `ParquetSink`.
+        """
+        query = Select('mempool_transaction', columns=columns or (),
+                       limit=1000 if all_cols == 'sample' else None).window().network(network or None)
+        return self._stream(query, time, batch_size)
 
     def mempool_transaction(self,
                             all_cols: str = 'blobs',
                             time: int = 7,
-                            network: str = 'mainnet',
-                            type: int = 3
-                            ) -> pd.DataFrame:
+                            network: Union[str, Sequence[str]] = 'mainnet',
+                            type: int = 3,
+                            group_by: Sequence[str] = ('hash',),
+                            bucket: Optional[str] = None,
+                            since: Optional[datetime.datetime] = None,
+                            end: Optional[datetime.datetime] = None,
+                            lookback: Optional[datetime.timedelta] = None,
+                            ) -> ResultFrame:
         """
         Queries that utilize mempool_data table - https://dbt.platform.ethpandaops.io/#!/source/source.xatu.clickhouse.mempool_transaction
         Xatu Mimicry collectes this data from the execution layer P2P network.
@@ -178,48 +699,76 @@ class Queries:
          * 'blobs' returns blob mempool data.
          * 'all' returns all mempool data.
          * 'sample' returns all mempool data with LIMIT 1000
+         * 'aggregate' returns, per `group_by` keys (and `bucket` of event time such as '1 HOUR', if set), the first and
+           last time a transaction was seen, the number of sightings and the number of distinct clients that saw it.
+           The default `group_by=['hash']` returns the first seen time per transaction hash.
+         * 'first_seen' returns, per transaction hash, the first and last time it was seen, the number of sightings and
+           the client that saw it first. Unlike 'aggregate', every column can be merged across windows, so results of
+           later windows can be merged into earlier ones, see `FirstSeenTable`. `since` (naive UTC) only counts
+           sightings after that high-water mark and `end` sets the end of the window. With `lookback`, sightings up to
+           `lookback` before `since`, which may have reached ClickHouse late, also update the first and last sightings,
+           but are not counted, as the window before `since` may have counted them already.
         """
         match all_cols:
             case 'blobs':
-                query = f"""
-                SELECT
-                    MIN(event_date_time) AS earliest_event_date_time,
-                    type,
-                    blob_sidecars_size,
-                    blob_sidecars_empty_size,
-                    hash,
-                    blob_hashes,
-                    nonce,
-                    meta_network_name,
-                    length(blob_hashes) as blob_hashes_length,
-                    ROUND(100 - (blob_sidecars_empty_size / blob_sidecars_size) * 100, 2) AS fill_percentage,
-                    from,
-                    to
-                FROM mempool_transaction
-                WHERE event_date_time > NOW() - INTERVAL '{time} DAYS'
-                AND type = {type} AND meta_network_name = '{network}'
-                GROUP BY hash, type, blob_sidecars_size, blob_sidecars_empty_size, blob_hashes, nonce, meta_network_name, blob_hashes_length, fill_percentage, to, from
-                """
-                return self.client.query_df(query)
+                query = Select('mempool_transaction', columns=[
+                    'MIN(event_date_time) AS earliest_event_date_time',
+                    'type',
+                    'blob_sidecars_size',
+                    'blob_sidecars_empty_size',
+                    'hash',
+                    'blob_hashes',
+                    'nonce',
+                    'meta_network_name',
+                    'length(blob_hashes) as blob_hashes_length',
+                    'ROUND(100 - (blob_sidecars_empty_size / blob_sidecars_size) * 100, 2) AS fill_percentage',
+                    'from',
+                    'to',
+                ], group_by=['hash', 'type', 'blob_sidecars_size', 'blob_sidecars_empty_size', 'blob_hashes', 'nonce',
+                             'meta_network_name', 'blob_hashes_length', 'fill_percentage', 'to', 'from'],
+                ).window().tx_type(type).network(network)
+                return self._run(query, time, shard=False)
             case 'all':
-                query = f"""
-                    SELECT * FROM mempool_transaction
-                    WHERE event_date_time > NOW() - INTERVAL '{time} DAYS'
-                    """
-                return self.client.query_df(query).drop('meta_labels', axis=1)
+                query = Select('mempool_transaction').window()
+                return self._run(query, time)
             case 'sample':
-                query = f"""
-                    SELECT * FROM mempool_transaction
-                    WHERE event_date_time > NOW() - INTERVAL '{time} DAYS'
-                    LIMIT 1000
-                    """
-                return self.client.query_df(query).drop('meta_labels', axis=1)
+                query = Select('mempool_transaction', limit=1000).window()
+                return self._run(query, time, shard=False)
+            case 'aggregate':
+                select_keys, group_keys = aggregate_keys(
+                    'event_date_time', group_by, bucket)
+                query = Select('mempool_transaction', columns=[
+                    select_keys,
+                    'MIN(event_date_time) AS first_seen',
+                    'MAX(event_date_time) AS last_seen',
+                    'COUNT() AS sightings',
+                    'uniqExact(meta_client_name) AS clients',
+                ], group_by=[group_keys], order_by=['first_seen']).window().tx_type(type).network(network)
+                return self._run(query, time, shard=False)
+            case 'first_seen':
+                sightings = 'COUNT() AS sightings'
+                if since is not None and lookback:
+                    sightings = 'countIf(event_date_time > fromUnixTimestamp64Milli({counted_since_ms:Int64})) AS sightings'
+                # hashes are deduplicated with aggregates alone, rather than grouping by every transaction column
+                query = Select('mempool_transaction', columns=[
+                    'hash',
+                    'MIN(event_date_time) AS first_seen',
+                    'MAX(event_date_time) AS last_seen',
+                    sightings,
+                    'argMin(meta_client_name, event_date_time) AS first_seen_client',
+                ], group_by=['hash']).window().tx_type(type).network(network)
+                if since is not None and lookback:
+                    query.since(since - lookback).bind(counted_since_ms=int(
+                        since.replace(tzinfo=datetime.timezone.utc).timestamp() * 1000))
+                else:
+                    query.since(since)
+                return self._run(query, time, shard=False, end=end)
 
     def canonical_beacon_chain(self,
                                all_cols: str = 'block_blobs',
                                time: int = 7,
-                               network: str = 'mainnet',
-                               ) -> pd.DataFrame:
+                               network: Union[str, Sequence[str]] = 'mainnet',
+                               ) -> ResultFrame:
         """
         Queries that utilize data captured by Xatu Cannon, which collect canonical consensus client data from the beacon chain.
         - https://dbt.platform.ethpandaops.io/#!/source/source.xatu.clickhouse.canonical_beacon_blob_sidecar
@@ -231,86 +780,82 @@ class Queries:
         """
         match all_cols:
             case 'block_blobs':
-                query = f"""
-                SELECT
-                    a.slot,
-                    a.slot_start_date_time,
-                    a.epoch,
-                    a.epoch_start_date_time,
-                    a.block_total_bytes,
-                    a.block_total_bytes_compressed,
-                    a.eth1_data_block_hash,
-                    a.execution_payload_block_number,
-                    a.execution_payload_transactions_count,
-                    a.execution_payload_transactions_total_bytes,
-                    a.execution_payload_transactions_total_bytes_compressed,
-                    b.blob_index,
-                    b.blob_size,
-                    a.meta_network_name AS meta_network_name_block,
-                    b.meta_network_name AS meta_network_name_blob
-                FROM
-                    (SELECT
-                        slot,
-                        slot_start_date_time,
-                        epoch,
-                        epoch_start_date_time,
-                        block_total_bytes,
-                        block_total_bytes_compressed,
-                        eth1_data_block_hash,
-                        execution_payload_block_number,
-                        execution_payload_transactions_count,
-                        execution_payload_transactions_total_bytes,
-                        execution_payload_transactions_total_bytes_compressed,
-                        meta_network_name
-                    FROM canonical_beacon_block
-                    WHERE slot_start_date_time > NOW() - INTERVAL '{time} DAYS'
-                    AND meta_network_name = '{network}'
-                    ) AS a
-                LEFT JOIN
-                    (SELECT
-                        slot,
-                        slot_start_date_time,
-                        epoch,
-                        block_root,
-                        versioned_hash,
-                        kzg_commitment,
-                        kzg_proof,
-                        blob_index,
-                        blob_size,
-                        blob_empty_size,
-                        meta_network_name
-                    FROM canonical_beacon_blob_sidecar
-                    WHERE slot_start_date_time > NOW() - INTERVAL '{time} DAYS'
-                    AND meta_network_name = '{network}'
-                    ) AS b
-                ON a.slot = b.slot
-                """
-                return self.client.query_df(query)
+                blobs = Select('canonical_beacon_blob_sidecar', columns=[
+                    'slot',
+                    'slot_start_date_time',
+                    'epoch',
+                    'block_root',
+                    'versioned_hash',
+                    'kzg_commitment',
+                    'kzg_proof',
+                    'blob_index',
+                    'blob_size',
+                    'blob_empty_size',
+                    'meta_network_name',
+                ]).window().network(network)
+                # the blocks are filtered in the WHERE clause of the outer query, the blobs before they are joined
+                query = Select('canonical_beacon_block', alias='a', columns=[
+                    'a.slot',
+                    'a.slot_start_date_time',
+                    'a.epoch',
+                    'a.epoch_start_date_time',
+                    'a.block_total_bytes',
+                    'a.block_total_bytes_compressed',
+                    'a.eth1_data_block_hash',
+                    'a.execution_payload_block_number',
+                    'a.execution_payload_transactions_count',
+                    'a.execution_payload_transactions_total_bytes',
+                    'a.execution_payload_transactions_total_bytes_compressed',
+                    'b.blob_index',
+                    'b.blob_size',
+                    'a.meta_network_name AS meta_network_name_block',
+                    'b.meta_network_name AS meta_network_name_blob',
+                ]).join('LEFT JOIN', blobs, 'b', 'ON a.slot = b.slot AND a.meta_network_name = b.meta_network_name') \
+                    .window().network(network)
+                return self._run(query, time)
 
     def blob_propagation(self,
                          all_cols: str = 'blob_propagation',
                          time: int = 7,
-                         network: str = 'mainnet',
-                         ) -> pd.DataFrame:
+                         network: Union[str, Sequence[str]] = 'mainnet',
+                         group_by: Sequence[str] = ('slot',),
+                         bucket: Optional[str] = None,
+                         quantiles: Sequence[float] = (0.5, 0.9, 0.99),
+                         ) -> ResultFrame:
         """
         Queries that utilize data captured by Xatu Sentry, which collect consensus client event data from the beacon chain.
         - https://dbt.platform.ethpandaops.io/#!/source/source.xatu.clickhouse.beacon_api_eth_v1_events_blob_sidecar
 
         all_cols:
          * 'blob_propagation' returns blob sidecar events.
+         * 'aggregate' returns, per `group_by` keys (and `bucket` of slot time such as '1 HOUR', if set), the event count
+           and the min, max and `quantiles` of `propagation_slot_start_diff`, computed by ClickHouse. Quantile columns
+           are named after their percentile, e.g. `p50` and `p99_9`.
+           Use `group_by=['meta_client_name']` for per client summaries.
         """
         match all_cols:
             case 'blob_propagation':
-                query = f"""
-                SELECT
-                    slot_start_date_time,
-                    propagation_slot_start_diff,
-                    slot,
-                    epoch,
-                    meta_network_name,
-                    meta_client_name
-                FROM beacon_api_eth_v1_events_blob_sidecar
-                WHERE slot_start_date_time > NOW() - INTERVAL '{time} DAYS'
-                AND meta_network_name = '{network}'
-                """
-                return self.client.query_df(query)
+                query = Select('beacon_api_eth_v1_events_blob_sidecar', columns=[
+                    'slot_start_date_time',
+                    'propagation_slot_start_diff',
+                    'slot',
+                    'epoch',
+                    'meta_network_name',
+                    'meta_client_name',
+                ]).window().network(network)
+                return self._run(query, time)
+            case 'aggregate':
+                select_keys, group_keys = aggregate_keys(
+                    'slot_start_date_time', group_by, bucket)
+                # ClickHouse computes the identical quantiles() aggregate once for all of the columns. Levels are
+                # parameters of the aggregate function, which must be literals.
+                levels = ", ".join(str(float(q)) for q in quantiles)
+                query = Select('beacon_api_eth_v1_events_blob_sidecar', columns=[
+                    select_keys,
+                    'COUNT() AS events',
+                    'MIN(propagation_slot_start_diff) AS min_propagation_slot_start_diff',
+                    'MAX(propagation_slot_start_diff) AS max_propagation_slot_start_diff',
+                    *(f"quantiles({levels})(propagation_slot_start_diff)[{i + 1}] AS {quantile_name(q)}"
+                      for i, q in enumerate(quantiles)),
+                ], group_by=[group_keys], order_by=[group_keys]).window().network(network)
+                return self._run(query, time, shard=False)
@@ -0,0 +1,138 @@
+"""
+Long-running refresh service, which keeps the datasets of a `Preprocessor` store fresh and publishes snapshots of
+them for reader processes.
+
+Usage:
+
+    ethpandaops-refresh --root data --network mainnet --period 7 --cadence mempool_df=60 --cadence txs=300
+
+Readers in other processes memory-map the latest published version of a dataset without copying it:
+
+    DatasetStore(root='data').snapshot('inclusion_df', 'mainnet')
+"""
+import argparse
+import signal
+import threading
+import time
+
+from dataclasses import dataclass, field
+from ethpandaops_python.preprocessor import DATASETS, Preprocessor
+from ethpandaops_python.store import DatasetStore
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+# seconds between refreshes of each dataset
+DEFAULT_CADENCES: Dict[str, float] = {
+    'mempool_df': 60,
+    'canonical_beacon_blob_sidecar_df': 120,
+    'txs': 300,
+}
+
+
+@dataclass
+class RefreshService:
+    """
+    `RefreshService` refreshes each dataset of a `Preprocessor` on its own cadence, and publishes a snapshot of the
+    refreshed dataset and of the inclusion index after every refresh.
+
+    Every refresh holds the store's write lock of the network, so several services, or cron runs of `Preprocessor`,
+    can share a store: they take turns and each refresh starts from the high-water marks the previous one stored.
+    A failed refresh is printed and retried on the next tick of its cadence.
+    """
+    preprocessor_factory: Callable[[], Preprocessor] = field(
+        default_factory=lambda: lambda: Preprocessor(incremental=True, publish=True))
+    # seconds between refreshes of each dataset, see `DEFAULT_CADENCES`
+    cadences: Dict[str, float] = field(
+        default_factory=lambda: dict(DEFAULT_CADENCES))
+
+    preprocessor: Optional[Preprocessor] = field(default=None, init=False)
+    _stop: threading.Event = field(
+        default_factory=threading.Event, init=False, repr=False)
+
+    def run(self, once: bool = False) -> None:
+        """
+        run() refreshes every dataset, then keeps refreshing each one when its cadence is due until `stop()` is
+        called. With `once`, it returns after the first refresh.
+        """
+        for name in self.cadences:
+            if name not in DATASETS:
+                raise ValueError(
+                    f"cadences must be set for datasets of {list(DATASETS)}, got '{name}'")
+
+        # an incremental Preprocessor refreshes every dataset when it is constructed
+        self.preprocessor = self.preprocessor_factory()
+        if once:
+            return
+
+        next_run = {name: time.monotonic() + cadence for name, cadence in self.cadences.items()}
+        while not self._stop.is_set():
+            name = min(next_run, key=next_run.get)
+            if self._stop.wait(max(next_run[name] - time.monotonic(), 0)):
+                break
+            self.refresh(name)
+            next_run[name] = time.monotonic() + self.cadences[name]
+
+    def refresh(self, name: str) -> None:
+        """
+        refresh() incrementally refreshes one dataset and publishes it with the inclusion index.
+        """
+        start = time.perf_counter()
+        try:
+            self.preprocessor.incremental_refresh(datasets=[name])
+        except Exception as e:
+            print(f'{name}: refresh failed ({e!r}), retrying in {self.cadences[name]}s')
+            return
+        print(f'{name}: refreshed in {time.perf_counter() - start:.2f}s')
+
+    def stop(self) -> None:
+        """
+        stop() ends `run()` once the refresh in progress, if any, completes.
+        """
+        self._stop.set()
+
+
+def parse_cadence(value: str) -> Tuple[str, float]:
+    """
+    parse_cadence() parses a `dataset=seconds` argument.
+    """
+    name, _, seconds = value.partition('=')
+    if name not in DATASETS:
+        raise argparse.ArgumentTypeError(
+            f"cadences can be set for {', '.join(DATASETS)}, got '{name}'")
+    try:
+        return name, float(seconds)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"cadence must look like 'mempool_df=60', got '{value}'")
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog='ethpandaops-refresh', description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--root', default='data',
+                        help='root folder of the dataset store')
+    parser.add_argument('--network', default='mainnet')
+    parser.add_argument('--period', type=int, default=1,
+                        help='rolling window kept in the store, in days')
+    parser.add_argument('--cadence', action='append', default=[], type=parse_cadence, metavar='DATASET=SECONDS',
+                        help=f'seconds between refreshes of a dataset, defaults: {DEFAULT_CADENCES}')
+    parser.add_argument('--keep-snapshots', type=int, default=3,
+                        help='snapshot versions kept per dataset')
+    parser.add_argument('--once', action='store_true',
+                        help='refresh and publish every dataset once, then exit')
+    args = parser.parse_args(argv)
+
+    store = DatasetStore(root=args.root, keep_snapshots=args.keep_snapshots)
+    service = RefreshService(
+        preprocessor_factory=lambda: Preprocessor(
+            period=args.period, network=args.network, store=store, incremental=True, publish=True),
+        cadences={**DEFAULT_CADENCES, **dict(args.cadence)},
+    )
+
+    # SIGTERM and SIGINT stop the service between refreshes, never while it writes
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: service.stop())
+    service.run(once=args.once)
+
+
+if __name__ == '__main__':
+    main()
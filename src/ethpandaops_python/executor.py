@@ -0,0 +1,113 @@
+import datetime
+import logging
+import threading
+import pandas as pd
+import polars as pl
+import pyarrow as pa
+
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from clickhouse_connect.driver.exceptions import OperationalError
+from dataclasses import dataclass
+from typing import Callable, Optional, Tuple, Type, TypeVar
+
+Frame = TypeVar('Frame', pd.DataFrame, pa.Table, pl.DataFrame)
+
+logger = logging.getLogger('ethpandaops_python')
+
+
+def concat_frames(frames: list[Frame]) -> Frame:
+    """
+    concat_frames() concatenates pandas, Arrow or polars results in order.
+    """
+    first = frames[0]
+    if isinstance(first, pl.DataFrame):
+        return pl.concat(frames, how='vertical_relaxed')
+    if isinstance(first, pa.Table):
+        return pa.concat_tables(frames, promote_options='permissive')
+    return pd.concat(frames, ignore_index=True)
+
+
+@dataclass
+class ShardedExecutor:
+    """
+    `ShardedExecutor` splits a long time window into smaller windows (shards) and queries them in parallel.
+    Each shard is retried on its own, so a transient error only re-runs that shard rather than the whole window.
+    The results are concatenated in chronological order. Once a shard fails for good, the shards that have not
+    started are cancelled and the running ones stop retrying, so the error surfaces without waiting for them.
+
+    The number of parallel shards is bounded by `max_workers`, which should not exceed the connection pool
+    size of the client running the queries.
+    """
+    # size of each shard, e.g. datetime.timedelta(hours=1) or datetime.timedelta(days=1)
+    window: datetime.timedelta = datetime.timedelta(days=1)
+    max_workers: int = 4
+    # number of retries per shard
+    max_retries: int = 3
+    # seconds to wait before the first retry, doubled on every following retry
+    backoff: float = 1.0
+    # transient errors that are retried: clickhouse_connect raises OperationalError for connection failures and
+    # timeouts, while server errors such as syntax errors or memory limits fail at once
+    retry_on: Tuple[Type[Exception], ...] = (OperationalError, ConnectionError, TimeoutError)
+
+    def shards(self, start: datetime.datetime, end: datetime.datetime) -> list[Tuple[datetime.datetime, datetime.datetime]]:
+        """
+        shards() splits [start, end) into consecutive windows of at most `window`.
+        """
+        shards = []
+        shard_start = start
+        while shard_start < end:
+            shard_end = min(shard_start + self.window, end)
+            shards.append((shard_start, shard_end))
+            shard_start = shard_end
+        return shards
+
+    def run(self,
+            fetch: Callable[[datetime.datetime, datetime.datetime], Frame],
+            start: datetime.datetime,
+            end: datetime.datetime,
+            reverse: bool = False,
+            ) -> Frame:
+        """
+        run() calls `fetch(shard_start, shard_end)` for every shard of [start, end) and concatenates the results in
+        chronological order, or newest shard first if `reverse` is True.
+        """
+        shards = self.shards(start, end)
+        if len(shards) <= 1:
+            return self._fetch_with_retries(fetch, start, end)
+        if reverse:
+            shards.reverse()
+
+        # set once a shard fails for good, so that the running shards stop retrying
+        failed = threading.Event()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(self._fetch_with_retries, fetch, *shard, failed) for shard in shards]
+            done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+            error = next((future.exception() for future in futures
+                          if future in done and future.exception() is not None), None)
+            if error is not None:
+                failed.set()
+                for future in futures:
+                    future.cancel()
+                raise error
+
+        return concat_frames([future.result() for future in futures])
+
+    def _fetch_with_retries(self,
+                            fetch: Callable[[datetime.datetime, datetime.datetime], Frame],
+                            start: datetime.datetime,
+                            end: datetime.datetime,
+                            failed: Optional[threading.Event] = None,
+                            ) -> Frame:
+        failed = failed or threading.Event()
+        for attempt in range(self.max_retries + 1):
+            try:
+                return fetch(start, end)
+            except self.retry_on as e:
+                if attempt == self.max_retries or failed.is_set():
+                    raise
+                delay = self.backoff * 2**attempt
+                logger.warning(
+                    f'shard {start} - {end} failed ({e}), retrying in {delay:.1f}s')
+                # the wait ends early when another shard fails for good
+                if failed.wait(delay):
+                    raise
@@ -0,0 +1,117 @@
+import datetime
+import polars as pl
+
+from dataclasses import dataclass, field
+from ethpandaops_python.client import Queries, to_polars
+from ethpandaops_python.store import DatasetStore
+from typing import Optional, Tuple
+
+# columns of the 'first_seen' mode of `Queries.mempool_transaction()`, and of a `FirstSeenTable`
+FIRST_SEEN_COLUMNS = ['hash', 'first_seen', 'last_seen',
+                      'sightings', 'first_seen_client']
+
+
+def merge_first_seen(table: pl.DataFrame, sightings: pl.DataFrame) -> Tuple[pl.DataFrame, pl.DataFrame]:
+    """
+    merge_first_seen() merges the 'first_seen' rows of a later window into a first-seen table: the earliest first
+    sighting and its client, the latest last sighting and the sum of sightings. Returns the merged table and its new
+    or changed rows.
+    """
+    sightings = sightings.select(FIRST_SEEN_COLUMNS)
+    seen = pl.col('hash').is_in(sightings.get_column('hash'))
+
+    changed = pl.concat([table.filter(seen), sightings], how='vertical_relaxed') \
+        .group_by('hash', maintain_order=True).agg(
+            pl.col('first_seen').min(),
+            pl.col('last_seen').max(),
+            # a hash sighted only in the uncounted lookback of `refresh()` was still seen once
+            pl.col('sightings').sum().clip(lower_bound=1),
+            pl.col('first_seen_client').sort_by('first_seen').first(),
+    )
+    return pl.concat([table.filter(~seen), changed], how='vertical_relaxed'), changed
+
+
+@dataclass
+class FirstSeenTable:
+    """
+    `FirstSeenTable` keeps the first sighting of every mempool transaction of the last `period` days: when and by
+    which client it was first seen, when it was last seen and how many times it was seen, one row per hash.
+
+    The first `refresh()` aggregates the whole period in ClickHouse. Later refreshes only aggregate the sightings after
+    the latest one in the table, and those of the `lookback` before it that may have reached ClickHouse late, and merge
+    them in with `merge_first_seen()`, then rewrite only the stored dates whose rows changed. Late sightings update the
+    first and last sightings but are not counted in `sightings`, which can undercount but never counts one twice.
+
+    Usage:
+
+        first_seen = FirstSeenTable(network='mainnet', period=7)
+        first_seen.refresh()
+        first_seen.df
+    """
+    queries: Queries = field(
+        default_factory=lambda: Queries(result_format='polars'))
+    network: str = 'mainnet'
+    # default time period, in days
+    period: int = 1
+    # transaction type, 3 for blob transactions
+    type: int = 3
+    # sightings this long before the latest one in the table are queried again by `refresh()`
+    lookback: datetime.timedelta = field(
+        default_factory=lambda: datetime.timedelta(minutes=10))
+    # the table is stored as the `first_seen_df` dataset, partitioned by the date of `first_seen`
+    store: DatasetStore = field(default_factory=DatasetStore)
+
+    df: Optional[pl.DataFrame] = field(default=None, init=False)
+
+    def load(self) -> Optional[pl.DataFrame]:
+        """
+        load() reads the stored table, None if nothing is stored.
+        """
+        if self.store.exists('first_seen_df', self.network):
+            self.df = self.store.read('first_seen_df', self.network)
+        else:
+            self.df = None
+        return self.df
+
+    def refresh(self, end: Optional[datetime.datetime] = None) -> pl.DataFrame:
+        """
+        refresh() queries the sightings until `end` (now by default) that are newer than the table, merges them in and
+        drops transactions first seen before the rolling `period`. Returns the new or changed rows.
+        """
+        if end is None:
+            end = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+        elif end.tzinfo is None:
+            # naive datetimes are UTC
+            end = end.replace(tzinfo=datetime.timezone.utc)
+        if self.df is None:
+            self.load()
+
+        since = self.df.get_column('last_seen').max() if self.df is not None else None
+        sightings = to_polars(self.queries.mempool_transaction(
+            all_cols='first_seen', time=self.period, network=self.network, type=self.type, since=since, end=end,
+            lookback=self.lookback))
+
+        if self.df is None:
+            self.df, changed = sightings.select(FIRST_SEEN_COLUMNS), sightings.select(FIRST_SEEN_COLUMNS)
+            previous_dates = pl.Series('first_seen', [], dtype=pl.Date)
+            mode = 'overwrite'
+        else:
+            # a late sighting can move the first sighting of a hash to an earlier date than it is stored under
+            previous_dates = self.df.filter(pl.col('hash').is_in(sightings.get_column('hash'))) \
+                .get_column('first_seen').dt.date()
+            self.df, changed = merge_first_seen(self.df, sightings)
+            mode = 'replace'
+        print(f'first_seen_df: merged {sightings.height} sighted transactions, {changed.height} new or changed')
+
+        # only the dates of changed rows, before and after the merge, are rewritten, with every row of those dates
+        changed_dates = pl.concat([changed.get_column('first_seen').dt.date(), previous_dates]).unique()
+        self.store.write('first_seen_df', self.network,
+                         self.df.filter(pl.col('first_seen').dt.date().is_in(changed_dates)),
+                         date_column='first_seen', sort_by='first_seen', mode=mode, dates=changed_dates.to_list())
+
+        # stored timestamps are naive UTC
+        cutoff = end.astimezone(datetime.timezone.utc).replace(
+            tzinfo=None) - datetime.timedelta(days=self.period)
+        self.df = self.df.filter(pl.col('first_seen') > cutoff)
+        self.store.delete_before('first_seen_df', self.network, 'first_seen', cutoff)
+        return changed
@@ -1,127 +1,677 @@
+from contextlib import asynccontextmanager
 from dataclasses import dataclass, field
 import asyncio
+import datetime
+import hashlib
+import json
+import os
 import hypersync
 import polars as pl
-from typing import List, Union, Dict
+import pyarrow as pa
+from typing import AsyncIterator, Awaitable, List, Optional, Sequence, Tuple, Union, Dict
 from hypersync import BlockField, TransactionField, HypersyncClient, ColumnMapping, DataType
+from ethpandaops_python.async_client import run_sync
+from ethpandaops_python.instrumentation import Instrumentation, QueryEvent, measure, result_bytes, timed
+
+# Transaction and block fields requested by default, the columns `query_txs()` returns
+TRANSACTION_FIELDS: List[TransactionField] = [
+    TransactionField.BLOCK_NUMBER,
+    TransactionField.HASH,
+    TransactionField.FROM,
+    TransactionField.TO,
+    TransactionField.GAS,
+    TransactionField.TRANSACTION_INDEX,
+    TransactionField.GAS_PRICE,
+    TransactionField.EFFECTIVE_GAS_PRICE,
+    TransactionField.GAS_USED,
+    TransactionField.CUMULATIVE_GAS_USED,
+    TransactionField.MAX_FEE_PER_GAS,
+    TransactionField.MAX_PRIORITY_FEE_PER_GAS,
+]
+BLOCK_FIELDS: List[BlockField] = [
+    BlockField.NUMBER,
+    BlockField.EXTRA_DATA,
+    BlockField.BASE_FEE_PER_GAS,
+    BlockField.TIMESTAMP,
+]
+
+# configuration settings to predetermine type output, applied to the fields that are requested
+TRANSACTION_MAPPING: Dict[TransactionField, DataType] = {
+    TransactionField.GAS_USED: DataType.FLOAT64,
+    TransactionField.MAX_FEE_PER_BLOB_GAS: DataType.FLOAT64,
+    TransactionField.MAX_PRIORITY_FEE_PER_GAS: DataType.FLOAT64,
+    TransactionField.GAS_PRICE: DataType.FLOAT64,
+    TransactionField.CUMULATIVE_GAS_USED: DataType.FLOAT64,
+    TransactionField.EFFECTIVE_GAS_PRICE: DataType.FLOAT64,
+    TransactionField.NONCE: DataType.INT64,
+    TransactionField.GAS: DataType.FLOAT64,
+    TransactionField.MAX_FEE_PER_GAS: DataType.FLOAT64,
+    TransactionField.VALUE: DataType.FLOAT64,
+}
+BLOCK_MAPPING: Dict[BlockField, DataType] = {
+    BlockField.GAS_LIMIT: DataType.FLOAT64,
+    BlockField.GAS_USED: DataType.FLOAT64,
+    BlockField.SIZE: DataType.FLOAT64,
+    BlockField.BLOB_GAS_USED: DataType.FLOAT64,
+    BlockField.EXCESS_BLOB_GAS: DataType.FLOAT64,
+    BlockField.BASE_FEE_PER_GAS: DataType.FLOAT64,
+    BlockField.TIMESTAMP: DataType.INT64,
+}
+
+
+SECONDS_PER_SLOT = 12
+
+
+def concat_tables(tables: List[pa.Table]) -> pa.Table:
+    """
+    concat_tables() concatenates the Arrow tables of several shards, skipping empty shards, whose tables have no columns.
+    """
+    tables = [table for table in tables if table.num_rows > 0]
+    if not tables:
+        return pa.table({})
+    return pa.concat_tables(tables, promote_options='permissive')
 
 
 @dataclass
-class Hypersync:
-    client: HypersyncClient = field(
-        default_factory=lambda: HypersyncClient(
-            hypersync.ClientConfig(
-                url='http://eth.hypersync.xyz'
-            )
+class BlockResolver:
+    """
+    `BlockResolver` resolves timestamps to block numbers, so that a block range covers exactly the same time window
+    as a ClickHouse query rather than an estimate of 7200 blocks per day.
+
+    `block_at()` binary searches block timestamps between the closest known (block, timestamp) anchors. As there is
+    at most one block per 12 second slot since the merge, the distance in time to an anchor bounds the distance in
+    blocks, which narrows the search to a few requests. Once the range is at most `scan_blocks` blocks, the
+    timestamps of the whole range are fetched in one request. Resolved anchors are kept in `anchors_file`, if set,
+    so later calls start from a narrow range. Anchors only hold for the chain of `client`, so each chain needs its own
+    `anchors_file`.
+    """
+    client: HypersyncClient
+    anchors_file: Optional[str] = None
+    scan_blocks: int = 2_000
+
+    _anchors: Optional[Dict[int, int]] = field(default=None, init=False, repr=False)
+
+    def _load_anchors(self) -> Dict[int, int]:
+        if self._anchors is None:
+            self._anchors = {}
+            if self.anchors_file is not None and os.path.exists(self.anchors_file):
+                with open(self.anchors_file) as f:
+                    self._anchors = {int(block): timestamp for block, timestamp in json.load(f).items()}
+        return self._anchors
+
+    def _save_anchors(self) -> None:
+        if self.anchors_file is None:
+            return
+        os.makedirs(os.path.dirname(self.anchors_file) or '.', exist_ok=True)
+        with open(f'{self.anchors_file}.tmp', 'w') as f:
+            json.dump({str(block): timestamp for block, timestamp in sorted(self._anchors.items())}, f)
+        os.replace(f'{self.anchors_file}.tmp', self.anchors_file)
+
+    async def _timestamps(self, from_block: int, to_block: int) -> Dict[int, int]:
+        """
+        _timestamps() fetches the timestamps of the blocks in [from_block, to_block).
+        """
+        query = hypersync.Query(
+            from_block=from_block,
+            to_block=to_block,
+            include_all_blocks=True,
+            field_selection=hypersync.FieldSelection(
+                block=[BlockField.NUMBER.value, BlockField.TIMESTAMP.value]),
         )
-    )
-    transactions: List[hypersync.TransactionField] = field(
-        default_factory=list)
-    blocks: List[hypersync.BlockField] = field(default_factory=list)
+        config = hypersync.StreamConfig(
+            column_mapping=ColumnMapping(block={BlockField.TIMESTAMP: DataType.INT64}))
+        blocks = (await self.client.collect_arrow(query, config)).data.blocks
+        if blocks.num_rows == 0:
+            return {}
+        return dict(zip(blocks.column('number').to_pylist(), blocks.column('timestamp').to_pylist()))
 
-    async def fetch_data(self, address: Union[str, Dict[str, str]], period: int) -> None:
+    async def block_at(self, timestamp: Union[int, datetime.datetime], height: Optional[int] = None) -> int:
         """
-        Asynchronously fetches blockchain data for a specified "from" address over a given block range. .
+        block_at() returns the first block with a timestamp at or after `timestamp` (unix seconds or an aware
+        datetime), or `height` if no block up to the chain height is that recent. Block ranges of
+        [block_at(start), block_at(end)) hold exactly the blocks of [start, end).
+        """
+        if isinstance(timestamp, datetime.datetime):
+            timestamp = int(timestamp.timestamp())
+        if height is None:
+            height = await self.client.get_height()
+
+        anchors = self._load_anchors()
+        # the latest block is the upper anchor of recent timestamps
+        if height - 1 not in anchors:
+            anchors.update(await self._timestamps(height - 1, height))
+        below = [(block, ts) for block, ts in anchors.items() if ts < timestamp and block < height]
+        above = [(block, ts) for block, ts in anchors.items() if ts >= timestamp and block < height]
+        if not above:
+            return height
+
+        hi_block, hi_ts = min(above)
+        # the target is at most hi_block, and at least one block per slot behind it
+        low = hi_block - (hi_ts - timestamp) // SECONDS_PER_SLOT
+        high = hi_block
+        if below:
+            lo_block, lo_ts = max(below)
+            low = max(low, lo_block + 1)
+            high = min(high, lo_block + 1 + (timestamp - 1 - lo_ts) // SECONDS_PER_SLOT)
+        low = max(low, 0)
+
+        while high - low > self.scan_blocks:
+            middle = (low + high) // 2
+            probe = await self._timestamps(middle, middle + 1)
+            if middle not in probe:
+                break
+            anchors[middle] = probe[middle]
+            if probe[middle] >= timestamp:
+                high = middle
+                low = max(low, middle - (probe[middle] - timestamp) // SECONDS_PER_SLOT)
+            else:
+                low = middle + 1
+                high = min(high, middle + 1 + (timestamp - 1 - probe[middle]) // SECONDS_PER_SLOT)
 
-        Saves query results as parquet files in a data folder.
+        block = high
+        scanned = await self._timestamps(low, high) if high > low else {}
+        for number in sorted(scanned):
+            if scanned[number] >= timestamp:
+                block = number
+                break
+
+        # keep the boundary of the resolved timestamp as anchors
+        for number in (block - 1, block):
+            if number in scanned:
+                anchors[number] = scanned[number]
+        self._save_anchors()
+        return block
+
+    async def block_range(self,
+                          start: datetime.datetime,
+                          end: datetime.datetime,
+                          height: Optional[int] = None,
+                          ) -> Tuple[int, int]:
         """
+        block_range() returns the [from_block, to_block) range of the blocks with timestamps in [start, end).
+        """
+        if height is None:
+            height = await self.client.get_height()
+        return await self.block_at(start, height), await self.block_at(end, height)
+
 
-        # Get the current block height from the blockchain.
+@dataclass
+class Hypersync:
+    # Defaults to a client of the Hypersync server at `url`
+    client: Optional[HypersyncClient] = None
+    # URL of the Hypersync server of the chain, which also keys the block anchors of `resolver`, so a client of
+    # another chain should be passed with its URL
+    url: str = 'http://eth.hypersync.xyz'
+    # fields requested from Hypersync, only these columns are downloaded. Can be overridden per call of `query_txs()`.
+    transactions: List[hypersync.TransactionField] = field(
+        default_factory=lambda: list(TRANSACTION_FIELDS))
+    blocks: List[hypersync.BlockField] = field(
+        default_factory=lambda: list(BLOCK_FIELDS))
+
+    # The block range is split into shards of `shard_blocks` blocks, of which `concurrency` are queried at a time
+    shard_blocks: int = 7200
+    concurrency: int = 8
+    # Maximum number of transactions per response page. Larger pages need fewer round trips.
+    page_size: int = 50_000
+
+    # `sync()` keeps a checkpoint and the synced transactions of every address set in a subfolder of `sync_folder`
+    sync_folder: str = os.path.join('data', 'hypersync')
+    # number of blocks below the checkpoint that are fetched again on every sync, replacing rows of reorged blocks
+    reorg_blocks: int = 64
+
+    # resolves the time window of a query to its exact block range, sharing the client.
+    # Defaults to a resolver that keeps the anchors of the chain at `url` in `sync_folder`.
+    resolver: Optional[BlockResolver] = None
+
+    # optional instrumentation that records the timings, rows and bytes of every shard, query and stream
+    instrumentation: Optional[Instrumentation] = None
+
+    def __post_init__(self):
+        if self.client is None:
+            self.client = HypersyncClient(hypersync.ClientConfig(url=self.url))
+        if self.resolver is None:
+            # block numbers and timestamps differ per chain, so each server keeps its own anchors
+            chain = hashlib.sha256(self.url.encode()).hexdigest()[:16]
+            self.resolver = BlockResolver(
+                self.client, anchors_file=os.path.join(self.sync_folder, f'anchors-{chain}.json'))
+
+    async def block_range(self, period: int, end_time: Optional[datetime.datetime] = None) -> Tuple[int, int, int]:
+        """
+        block_range() returns the chain height and the [from_block, to_block) range of the blocks of the `period` days
+        before `end_time` (now by default). Passing the `end` of a ClickHouse query window as `end_time` makes both
+        cover exactly the same time window.
+        """
         height = await self.client.get_height()
+        end = end_time if end_time is not None else datetime.datetime.now(datetime.timezone.utc)
+        if end.tzinfo is None:
+            # naive datetimes are UTC, like the cached ClickHouse timestamps
+            end = end.replace(tzinfo=datetime.timezone.utc)
+        start_block, end_block = await self.resolver.block_range(
+            end - datetime.timedelta(days=period), end, height)
+        return height, start_block, end_block
 
-        # The starting block is calculated based on the given period and an assumption of 7200 blocks per day.
-        query = hypersync.Query(
-            from_block=height - (period * 7200),  # Calculate starting block.
+    def _fields(self,
+                transactions: Optional[Sequence[TransactionField]],
+                blocks: Optional[Sequence[BlockField]],
+                ) -> Tuple[List[TransactionField], List[BlockField]]:
+        """
+        _fields() returns the transaction and block fields to request, defaulting to the fields set on the instance.
+        """
+        transaction_fields = [TransactionField(el)
+                              for el in transactions or self.transactions]
+        block_fields = [BlockField(el) for el in blocks or self.blocks]
+        # the join keys are always needed
+        if TransactionField.BLOCK_NUMBER not in transaction_fields:
+            transaction_fields.append(TransactionField.BLOCK_NUMBER)
+        if BlockField.NUMBER not in block_fields:
+            block_fields.append(BlockField.NUMBER)
+        return transaction_fields, block_fields
+
+    def _query(self,
+               address: Union[str, List[str]],
+               from_block: int,
+               to_block: int,
+               transaction_fields: List[TransactionField],
+               block_fields: List[BlockField],
+               ) -> hypersync.Query:
+        return hypersync.Query(
+            from_block=from_block,
             transactions=[
                 hypersync.TransactionSelection(
                     # Specify the address to fetch transactions from.
                     from_=address
                 )
             ],
-            to_block=height,
+            # to_block is exclusive
+            to_block=to_block,
             field_selection=hypersync.FieldSelection(
-                # Select transaction fields to fetch.
-                transaction=[el.value for el in TransactionField],
-                # Select block fields to fetch.
-                block=[el.value for el in BlockField],
+                transaction=[el.value for el in transaction_fields],
+                block=[el.value for el in block_fields],
             ),
         )
 
-        # Setting this number lower reduces client sync console error messages.
-        query.max_num_transactions = 1_000  # for troubleshooting
-
+    def _config(self,
+                transaction_fields: List[TransactionField],
+                block_fields: List[BlockField],
+                concurrency: Optional[int] = None,
+                ) -> hypersync.StreamConfig:
         # configuration settings to predetermine type output here
-        config = hypersync.StreamConfig(
+        return hypersync.StreamConfig(
             hex_output=hypersync.HexOutput.PREFIXED,
+            max_num_transactions=self.page_size,
+            concurrency=concurrency,
             column_mapping=ColumnMapping(
                 transaction={
-                    TransactionField.GAS_USED: DataType.FLOAT64,
-                    TransactionField.MAX_FEE_PER_BLOB_GAS: DataType.FLOAT64,
-                    TransactionField.MAX_PRIORITY_FEE_PER_GAS: DataType.FLOAT64,
-                    TransactionField.GAS_PRICE: DataType.FLOAT64,
-                    TransactionField.CUMULATIVE_GAS_USED: DataType.FLOAT64,
-                    TransactionField.EFFECTIVE_GAS_PRICE: DataType.FLOAT64,
-                    TransactionField.NONCE: DataType.INT64,
-                    TransactionField.GAS: DataType.FLOAT64,
-                    TransactionField.MAX_FEE_PER_GAS: DataType.FLOAT64,
-                    TransactionField.MAX_FEE_PER_BLOB_GAS: DataType.FLOAT64,
-                    TransactionField.VALUE: DataType.FLOAT64,
-                },
-                block={
-                    BlockField.GAS_LIMIT: DataType.FLOAT64,
-                    BlockField.GAS_USED: DataType.FLOAT64,
-                    BlockField.SIZE: DataType.FLOAT64,
-                    BlockField.BLOB_GAS_USED: DataType.FLOAT64,
-                    BlockField.EXCESS_BLOB_GAS: DataType.FLOAT64,
-                    BlockField.BASE_FEE_PER_GAS: DataType.FLOAT64,
-                    BlockField.TIMESTAMP: DataType.INT64,
-                }
+                    key: value for key, value in TRANSACTION_MAPPING.items() if key in transaction_fields},
+                block={key: value for key, value in BLOCK_MAPPING.items()
+                       if key in block_fields},
             )
         )
 
-        return await self.client.collect_parquet('data', query, config)
+    @asynccontextmanager
+    async def _fetch_shards(self,
+                            address: Union[str, List[str]],
+                            start_block: int,
+                            end_block: int,
+                            transaction_fields: List[TransactionField],
+                            block_fields: List[BlockField],
+                            ) -> AsyncIterator[List[Tuple[int, int, Awaitable[Tuple[pa.Table, pa.Table]]]]]:
+        """
+        _fetch_shards() splits [start_block, end_block) into shards of `shard_blocks` blocks and starts fetching them,
+        at most `concurrency` at a time. Yields the range of every shard with a task resolving to its transactions
+        and blocks, in block order. Shards still running when the context exits, because one of them failed or the
+        caller raised, are cancelled and awaited.
+        """
+        config = self._config(transaction_fields, block_fields)
+        semaphore = asyncio.Semaphore(self.concurrency)
 
-    def query_txs(self, address: Union[str, Dict[list, list]], period: int) -> pl.DataFrame:
-        """ Query transactions for a given address and period.
+        async def fetch_shard(shard_start: int, shard_end: int) -> Tuple[pa.Table, pa.Table]:
+            query = self._query(address, shard_start, shard_end,
+                                transaction_fields, block_fields)
+            async with semaphore:
+                with measure(self.instrumentation, 'hypersync', 'collect_arrow') as event:
+                    with timed(event, 'transfer'):
+                        response = await self.client.collect_arrow(query, config)
+                    self._record(event, response)
+            return response.data.transactions, response.data.blocks
 
-         Parameters:
-         - address (str): The blockchain address to query transactions for.
-         - period (int): The time period over which transactions should be queried.
+        shards = []
+        for shard_start in range(start_block, end_block, self.shard_blocks):
+            shard_end = min(shard_start + self.shard_blocks, end_block)
+            shards.append((shard_start, shard_end, asyncio.ensure_future(
+                fetch_shard(shard_start, shard_end))))
+        try:
+            yield shards
+        finally:
+            tasks = [task for _, _, task in shards]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
 
-         Returns:
-         - A DataFrame containing transaction details for the specified address and period.
+    @staticmethod
+    def _record(event: QueryEvent, response) -> None:
+        """
+        _record() adds the rows, size and server execution time of a Hypersync response to `event`.
+        """
+        event.rows += response.data.transactions.num_rows
+        event.result_bytes += response.data.transactions.nbytes + \
+            response.data.blocks.nbytes
+        # the server reports its execution time in milliseconds
+        execution_time = getattr(response, 'total_execution_time', None)
+        if execution_time is not None:
+            event.server_elapsed = (
+                event.server_elapsed or 0) + execution_time / 1000
+
+    async def fetch_data(self,
+                         address: Union[str, Dict[str, str]],
+                         period: int,
+                         from_block: Optional[int] = None,
+                         transactions: Optional[Sequence[TransactionField]] = None,
+                         blocks: Optional[Sequence[BlockField]] = None,
+                         end_time: Optional[datetime.datetime] = None,
+                         ) -> Tuple[pa.Table, pa.Table]:
+        """
+        Asynchronously fetches blockchain data for a specified "from" address over the blocks of the `period` days
+        before `end_time` (now by default), resolved from block timestamps by `resolver`.
+
+        The range is split into shards of `shard_blocks` blocks that are fetched concurrently, at most `concurrency`
+        at a time. Only the `transactions` and `blocks` fields are requested, which default to the fields set on the
+        instance.
+
+        If `from_block` is set, blocks before it are skipped, which lets callers fetch only blocks newer than data they already have.
+
+        Returns the transactions and blocks as Arrow tables.
         """
-        asyncio.run(self.fetch_data(address=address, period=period))
 
+        _, start_block, end_block = await self.block_range(period, end_time)
+        if from_block is not None:
+            start_block = max(start_block, from_block)
+
+        async with self._fetch_shards(address, start_block, end_block, *self._fields(transactions, blocks)) as shards:
+            shards = await asyncio.gather(*(task for _, _, task in shards))
+
+        return (
+            concat_tables([txs for txs, _ in shards]),
+            concat_tables([blocks for _, blocks in shards]),
+        )
+
+    def _join(self,
+              txs_table: pa.Table,
+              blocks_table: pa.Table,
+              transactions: Optional[Sequence[TransactionField]] = None,
+              blocks: Optional[Sequence[BlockField]] = None,
+              ) -> pl.DataFrame:
+        """
+        _join() joins transactions to their blocks and selects the requested fields, block fields first.
+        """
+        columns = self._columns(transactions, blocks)
+
+        if txs_table.num_rows == 0:
+            return pl.DataFrame(schema=columns)
+
+        return self._joined(txs_table, blocks_table).select(columns).unique().collect()
+
+    def _columns(self,
+                 transactions: Optional[Sequence[TransactionField]] = None,
+                 blocks: Optional[Sequence[BlockField]] = None,
+                 ) -> List[str]:
+        """
+        _columns() returns the columns of the joined transactions and blocks, in the order `query_txs()` returns them.
+        """
+        transaction_columns = [TransactionField(el).value for el in (transactions or self.transactions)
+                               if el != TransactionField.BLOCK_NUMBER]
+        block_columns = [BlockField(el).value for el in (blocks or self.blocks)
+                         if el != BlockField.NUMBER]
+        # block columns that share a name with a transaction column get a `_block` suffix
+        block_columns = [f'{name}_block' if name in transaction_columns else name
+                         for name in block_columns]
+        return ['block_number', *block_columns, *transaction_columns]
+
+    @staticmethod
+    def _joined(txs_table: pa.Table, blocks_table: pa.Table) -> pl.LazyFrame:
         # Merge separate datasets into a single dataset
-        txs_df = pl.scan_parquet('data/transactions.parquet')
-        blocks_df = pl.scan_parquet(
-            'data/blocks.parquet').rename({'number': 'block_number'})
+        txs_df = pl.from_arrow(txs_table).lazy()
+        blocks_df = pl.from_arrow(blocks_table).lazy().rename(
+            {'number': 'block_number'})
 
-        txs_blocks_joined = txs_df.join(
+        return txs_df.join(
             blocks_df,
             on='block_number',
             how='left',
             coalesce=True,
             suffix='_block'
-        ).unique()
-
-        final_df = txs_blocks_joined.select(
-            'block_number',
-            'extra_data',
-            'base_fee_per_gas',
-            'timestamp',
-            'hash',
-            'from',
-            'to',
-            'gas',
-            'transaction_index',
-            'gas_price',
-            'effective_gas_price',
-            'gas_used',
-            'cumulative_gas_used',
-            'max_fee_per_gas',
-            'max_priority_fee_per_gas',
-        ).collect()
-
-        return pl.DataFrame(final_df)
+        )
+
+    def query_txs(self,
+                  address: Union[str, Dict[list, list]],
+                  period: int,
+                  from_block: Optional[int] = None,
+                  transactions: Optional[Sequence[TransactionField]] = None,
+                  blocks: Optional[Sequence[BlockField]] = None,
+                  end_time: Optional[datetime.datetime] = None,
+                  stream: bool = False,
+                  ) -> pl.DataFrame:
+        """ Query transactions for a given address and period.
+
+         Parameters:
+         - address (str): The blockchain address to query transactions for.
+         - period (int): The time period over which transactions should be queried.
+         - from_block (int, optional): The first block to query, used to only fetch blocks newer than cached data.
+         - transactions, blocks (optional): The transaction and block fields to return, defaulting to the fields set on the instance.
+         - end_time (datetime, optional): The end of the period, now by default. Blocks with timestamps in
+           [end_time - period, end_time) are queried.
+         - stream (bool, optional): Build the result from the batches of `stream_txs()` rather than from all shards at once,
+           which lowers peak memory on long periods.
+
+         Returns:
+         - A DataFrame containing transaction details for the specified address and period.
+        """
+        return run_sync(self.query_txs_async(address=address, period=period, from_block=from_block,
+                                             transactions=transactions, blocks=blocks, end_time=end_time,
+                                             stream=stream))
+
+    async def query_txs_async(self,
+                              address: Union[str, Dict[list, list]],
+                              period: int,
+                              from_block: Optional[int] = None,
+                              transactions: Optional[Sequence[TransactionField]] = None,
+                              blocks: Optional[Sequence[BlockField]] = None,
+                              end_time: Optional[datetime.datetime] = None,
+                              stream: bool = False,
+                              ) -> pl.DataFrame:
+        """ Asynchronous version of `query_txs()`, which can be awaited alongside other fetches in a running event loop.
+        """
+        if stream:
+            batches = [batch async for batch in self.stream_txs(
+                address=address, period=period, from_block=from_block,
+                transactions=transactions, blocks=blocks, end_time=end_time)]
+            if not batches:
+                return pl.DataFrame(schema=self._columns(transactions, blocks))
+            return pl.concat(batches, how='vertical_relaxed', rechunk=True)
+
+        with measure(self.instrumentation, 'hypersync', 'query_txs') as event:
+            with timed(event, 'transfer'):
+                txs_table, blocks_table = await self.fetch_data(address=address, period=period, from_block=from_block,
+                                                                transactions=transactions, blocks=blocks, end_time=end_time)
+            with timed(event, 'convert'):
+                df = self._join(txs_table, blocks_table, transactions, blocks)
+            event.rows = df.height
+            event.result_bytes = result_bytes(df)
+        return df
+
+    async def stream_txs(self,
+                         address: Union[str, List[str]],
+                         period: int,
+                         from_block: Optional[int] = None,
+                         transactions: Optional[Sequence[TransactionField]] = None,
+                         blocks: Optional[Sequence[BlockField]] = None,
+                         end_time: Optional[datetime.datetime] = None,
+                         ) -> AsyncIterator[pl.DataFrame]:
+        """ Stream the transactions of `query_txs()` as DataFrames, one per Hypersync response page.
+
+         Each page of transactions is joined in memory with the blocks of the same page, so nothing is written to disk
+         and only one page is held at a time. Transactions are deduplicated on `hash` against every hash yielded so
+         far, rather than with a `unique()` over every column of the whole result. Pages are fetched by `concurrency`
+         parallel requests inside the Hypersync client.
+
+         Usage:
+
+            async for batch in hypersync.stream_txs(address, period=7):
+                store.write('txs', 'mainnet', batch, date_column='timestamp', sort_by='block_number')
+        """
+        _, start_block, end_block = await self.block_range(period, end_time)
+        if from_block is not None:
+            start_block = max(start_block, from_block)
+
+        transaction_fields, block_fields = self._fields(transactions, blocks)
+        # hashes are needed to deduplicate, even if they are not returned
+        if TransactionField.HASH not in transaction_fields:
+            transaction_fields.append(TransactionField.HASH)
+        columns = self._columns(transactions, blocks)
+
+        receiver = await self.client.stream_arrow(
+            self._query(address, start_block, end_block,
+                        transaction_fields, block_fields),
+            self._config(transaction_fields, block_fields, concurrency=self.concurrency),
+        )
+        # hashes yielded so far, appended to page by page
+        seen: Optional[pl.Series] = None
+        # a stream is measured as one event, from the query until its last page is read
+        with measure(self.instrumentation, 'hypersync', 'stream_txs') as event:
+            try:
+                while True:
+                    with timed(event, 'transfer'):
+                        response = await receiver.recv()
+                    if response is None:
+                        break
+                    if response.data.transactions.num_rows == 0:
+                        continue
+
+                    with timed(event, 'convert'):
+                        batch = self._joined(response.data.transactions, response.data.blocks)
+                        if seen is not None:
+                            batch = batch.filter(~pl.col('hash').is_in(seen))
+                        batch = batch.unique(subset='hash', keep='first', maintain_order=True).collect()
+                        if seen is None:
+                            seen = batch.get_column('hash')
+                        else:
+                            seen.append(batch.get_column('hash'))
+                    if batch.height > 0:
+                        batch = batch.select(columns)
+                        event.rows += batch.height
+                        event.result_bytes += result_bytes(batch)
+                        yield batch
+            finally:
+                await receiver.close()
+
+    def sync_path(self,
+                  address: Union[str, List[str]],
+                  transactions: Optional[Sequence[TransactionField]] = None,
+                  blocks: Optional[Sequence[BlockField]] = None,
+                  ) -> str:
+        """
+        sync_path() returns the folder `sync()` keeps the checkpoint and parquet parts of an address set in.
+        The folder is keyed on the addresses and the requested fields, so that different selections never mix.
+        """
+        addresses = sorted(a.lower() for a in ([address] if isinstance(address, str) else address))
+        transaction_fields, block_fields = self._fields(transactions, blocks)
+        key = json.dumps([addresses, sorted(el.value for el in transaction_fields),
+                          sorted(el.value for el in block_fields)])
+        return os.path.join(self.sync_folder, hashlib.sha256(key.encode()).hexdigest()[:16])
+
+    def sync(self,
+             address: Union[str, List[str]],
+             period: int,
+             transactions: Optional[Sequence[TransactionField]] = None,
+             blocks: Optional[Sequence[BlockField]] = None,
+             ) -> pl.DataFrame:
+        """ Incrementally sync the transactions of an address set and return those of the last `period` days.
+
+         Unlike `query_txs()`, which downloads the whole period on every call, `sync()` keeps the synced transactions as
+         parquet parts next to a checkpoint of the next block to fetch (see `sync_path()`), and only fetches blocks from
+         the checkpoint on. The last `reorg_blocks` blocks below the checkpoint are fetched again and replace the stored
+         rows, so transactions of reorged blocks are dropped. Shards are stored and checkpointed in block order as they
+         complete, so an interrupted sync resumes from the last stored shard. Parts older than `period` are deleted.
+
+         Returns:
+         - A DataFrame in the format of `query_txs()`, sorted by block number.
+        """
+        return run_sync(self.sync_async(address=address, period=period, transactions=transactions, blocks=blocks))
+
+    async def sync_async(self,
+                         address: Union[str, List[str]],
+                         period: int,
+                         transactions: Optional[Sequence[TransactionField]] = None,
+                         blocks: Optional[Sequence[BlockField]] = None,
+                         ) -> pl.DataFrame:
+        """ Asynchronous version of `sync()`.
+        """
+        folder = self.sync_path(address, transactions, blocks)
+        os.makedirs(folder, exist_ok=True)
+        checkpoint_file = os.path.join(folder, 'checkpoint.json')
+
+        height, period_start, _ = await self.block_range(period)
+
+        start_block = period_start
+        if os.path.exists(checkpoint_file):
+            with open(checkpoint_file) as f:
+                next_block = json.load(f)['next_block']
+            start_block = max(period_start, next_block - self.reorg_blocks)
+
+        # rows of the re-fetched tail are replaced, and parts older than the period are no longer needed
+        self._trim_parts(folder, keep_from=period_start, keep_until=start_block)
+
+        async with self._fetch_shards(address, start_block, height, *self._fields(transactions, blocks)) as shards:
+            for shard_start, shard_end, task in shards:
+                txs_table, blocks_table = await task
+                df = self._join(txs_table, blocks_table, transactions, blocks)
+                if df.height > 0:
+                    self._write_part(folder, shard_start, shard_end, df.sort('block_number'))
+                self._write_checkpoint(checkpoint_file, address, shard_end)
+
+        parts = self._parts(folder)
+        if not parts:
+            return self._join(pa.table({}), pa.table({}), transactions, blocks)
+        return pl.scan_parquet([path for _, _, path in parts]).filter(
+            pl.col('block_number') >= period_start).collect()
+
+    @staticmethod
+    def _parts(folder: str) -> List[Tuple[int, int, str]]:
+        """
+        _parts() returns the block range and path of every parquet part in `folder`, in block order.
+        Parts are named `part-<first block>-<end block>.parquet`, with an exclusive end block.
+        """
+        parts = []
+        for name in os.listdir(folder):
+            if name.startswith('part-') and name.endswith('.parquet'):
+                start, end = name[len('part-'):-len('.parquet')].split('-')
+                parts.append((int(start), int(end), os.path.join(folder, name)))
+        return sorted(parts)
+
+    def _trim_parts(self, folder: str, keep_from: int, keep_until: int) -> None:
+        """
+        _trim_parts() drops stored rows outside of [keep_from, keep_until). Whole parts are deleted where possible and
+        only parts that straddle a bound are rewritten.
+        """
+        for start, end, path in self._parts(folder):
+            if end <= keep_from or start >= keep_until:
+                os.remove(path)
+            elif start < keep_from or end > keep_until:
+                df = pl.read_parquet(path).filter(
+                    pl.col('block_number').is_between(keep_from, keep_until, closed='left'))
+                os.remove(path)
+                if df.height > 0:
+                    self._write_part(folder, max(start, keep_from), min(end, keep_until), df)
+
+    @staticmethod
+    def _write_part(folder: str, start: int, end: int, df: pl.DataFrame) -> None:
+        path = os.path.join(folder, f'part-{start:012d}-{end:012d}.parquet')
+        # write to a temporary name first so that an interrupted sync never leaves a partial part
+        df.write_parquet(f'{path}.tmp', compression='zstd')
+        os.replace(f'{path}.tmp', path)
+
+    @staticmethod
+    def _write_checkpoint(checkpoint_file: str, address: Union[str, List[str]], next_block: int) -> None:
+        with open(f'{checkpoint_file}.tmp', 'w') as f:
+            json.dump({'address': address, 'next_block': next_block}, f)
+        os.replace(f'{checkpoint_file}.tmp', checkpoint_file)
@@ -0,0 +1,190 @@
+import logging
+import polars as pl
+
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Sequence, Tuple, Union
+
+logger = logging.getLogger('ethpandaops_python')
+
+SECONDS_PER_SLOT = 12
+
+# beacon chain genesis time per network, in unix seconds
+GENESIS_TIME: Dict[str, int] = {
+    'mainnet': 1606824023,
+    'sepolia': 1655733600,
+    'holesky': 1695902400,
+}
+
+# columns of an inclusion index row that are merged from mempool sightings, before inclusion is resolved
+BASE_COLUMNS = ['hash', 'from', 'first_seen', 'sightings',
+                'blob_hashes', 'blob_count', 'fill_percentage']
+
+
+def blob_key(column: str) -> pl.Expr:
+    """
+    blob_key() hashes a versioned hash column to a UInt64 key. Joins on the integer key are faster than joins on the
+    66 character hex strings, and a collision between two of the blob hashes of a period is vanishingly unlikely.
+    """
+    return pl.col(column).hash(seed=0).alias('blob_key')
+
+
+def sequencer_names(blob_producer: Union[str, Dict[str, list[str]]]) -> Dict[str, str]:
+    """
+    sequencer_names() maps the lowercase addresses of a `blob_producer` to their sequencer names. A single address,
+    or an address of a dictionary without `sequencer_names`, is named after itself, like in `query.producer_table()`.
+    """
+    if isinstance(blob_producer, str):
+        return {blob_producer.lower(): blob_producer}
+    addresses = blob_producer['sequencer_addresses']
+    return {address.lower(): name for address, name in zip(
+        addresses, blob_producer.get('sequencer_names', addresses))}
+
+
+@dataclass
+class InclusionIndex:
+    """
+    `InclusionIndex` measures blob inclusion by joining the blob transactions seen in the mempool (`mempool_df`) to
+    the canonical sidecars of their blobs (`canonical_beacon_blob_sidecar_df`) and to the Hypersync transactions
+    (`txs`). It returns one row per blob transaction with:
+
+     * `first_seen`: the earliest mempool sighting, and `first_seen_slot`, the slot it falls in.
+     * `inclusion_slot`, `inclusion_time`: the slot, and its start, of the block that included the blobs.
+     * `slots_to_inclusion`: `inclusion_slot - first_seen_slot`, null while the transaction is pending.
+     * `sequencer`: the name of the sending address, or 'unknown'.
+     * the block number, position and gas of the transaction, from Hypersync.
+
+    `genesis_time` (unix seconds) places first sightings in slots; it defaults to the `GENESIS_TIME` of `network`.
+    Without one, `first_seen_slot` and `slots_to_inclusion` are null and the other columns are resolved as usual.
+
+    Versioned hashes are exploded and hashed to integer keys once: the keys of every sidecar added with
+    `add_sidecars()` are kept, so `update()` only explodes, joins and resolves new and still pending transactions.
+    """
+    # sequencer names by lowercase address, see `sequencer_names()`
+    sequencers: Dict[str, str] = field(default_factory=dict)
+    network: str = 'mainnet'
+    genesis_time: Optional[int] = None
+
+    _keys: Optional[pl.DataFrame] = field(default=None, init=False, repr=False)
+
+    def __post_init__(self):
+        if self.genesis_time is None:
+            self.genesis_time = GENESIS_TIME.get(self.network)
+        if self.genesis_time is None:
+            logger.warning(f"no genesis time for network '{self.network}', first_seen_slot and slots_to_inclusion "
+                           f"are left null; pass genesis_time to fill them")
+
+    def add_sidecars(self, sidecar_df: pl.DataFrame) -> None:
+        """
+        add_sidecars() adds the versioned hashes of canonical sidecars to the keys inclusion is resolved against.
+        """
+        keys = sidecar_df.select(
+            blob_key('versioned_hash'), 'slot', 'slot_start_date_time')
+        self._keys = keys if self._keys is None else pl.concat(
+            [self._keys, keys], how='vertical_relaxed')
+
+    def reset(self) -> None:
+        """
+        reset() forgets every sidecar added with `add_sidecars()`.
+        """
+        self._keys = None
+
+    def build(self, mempool_df: pl.DataFrame, sidecar_df: pl.DataFrame, txs_df: pl.DataFrame) -> pl.DataFrame:
+        """
+        build() computes the index of every blob transaction of `mempool_df` from scratch.
+        """
+        self.reset()
+        self.add_sidecars(sidecar_df)
+        return self._resolve(self._sightings(mempool_df), txs_df)
+
+    def update(self,
+               index_df: pl.DataFrame,
+               mempool_df: pl.DataFrame,
+               txs_df: pl.DataFrame,
+               ) -> Tuple[pl.DataFrame, pl.DataFrame]:
+        """
+        update() merges new mempool rows into an index and resolves the transactions that are new, newly sighted or
+        not yet included, against every sidecar added so far and `txs_df`. Add new sidecars with `add_sidecars()`
+        first. Returns the updated index and its changed rows.
+        """
+        sightings = self._sightings(mempool_df)
+        # rows that are included, matched to a Hypersync transaction and not sighted again are final
+        final = (pl.col('inclusion_slot').is_not_null() & pl.col('block_number').is_not_null()
+                 & ~pl.col('hash').is_in(sightings.get_column('hash')))
+
+        unchanged = index_df.filter(final)
+        changed = pl.concat([index_df.filter(~final).select(BASE_COLUMNS), sightings], how='vertical_relaxed') \
+            .group_by('hash', maintain_order=True).agg(
+                pl.col('from').first(),
+                pl.col('first_seen').min(),
+                pl.col('sightings').sum(),
+                pl.col('blob_hashes').first(),
+                pl.col('blob_count').first(),
+                pl.col('fill_percentage').first(),
+        )
+        changed = self._resolve(changed, txs_df)
+
+        return pl.concat([unchanged, changed], how='vertical_relaxed'), changed
+
+    def aggregate(self, index_df: pl.DataFrame, by: Sequence[str] = ('sequencer',)) -> pl.DataFrame:
+        """
+        aggregate() summarizes an index per `by` columns: transaction and blob counts, the share of transactions
+        included so far and the distribution of `slots_to_inclusion`.
+        """
+        return index_df.group_by(list(by)).agg(
+            pl.len().alias('transactions'),
+            pl.col('blob_count').sum().alias('blobs'),
+            pl.col('inclusion_slot').is_not_null().sum().alias('included'),
+            pl.col('inclusion_slot').is_not_null().mean().alias('inclusion_rate'),
+            pl.col('slots_to_inclusion').mean().alias('mean_slots_to_inclusion'),
+            pl.col('slots_to_inclusion').median().alias('median_slots_to_inclusion'),
+            pl.col('slots_to_inclusion').quantile(0.9).alias('p90_slots_to_inclusion'),
+            pl.col('slots_to_inclusion').max().alias('max_slots_to_inclusion'),
+            pl.col('fill_percentage').mean().alias('mean_fill_percentage'),
+        ).sort(list(by))
+
+    def _sightings(self, mempool_df: pl.DataFrame) -> pl.DataFrame:
+        """
+        _sightings() reduces mempool events, one per transaction and client, to one row per transaction.
+        """
+        return mempool_df.group_by('hash', maintain_order=True).agg(
+            # addresses may be Categorical, see `schema.py`
+            pl.col('from').first().cast(pl.String),
+            pl.col('event_date_time').min().alias('first_seen'),
+            pl.len().cast(pl.UInt32).alias('sightings'),
+            pl.col('blob_hashes').first(),
+            pl.col('blob_hashes').first().list.len().cast(
+                pl.UInt32).alias('blob_count'),
+            pl.col('fill_percentage').first(),
+        ).select(BASE_COLUMNS)
+
+    def _resolve(self, rows: pl.DataFrame, txs_df: pl.DataFrame) -> pl.DataFrame:
+        """
+        _resolve() adds the inclusion slot, Hypersync transaction fields and derived columns to rows of `BASE_COLUMNS`.
+        """
+        # every blob of a transaction is included in the same block, so the earliest slot of its blobs is its inclusion
+        if self._keys is None:
+            # without sidecars nothing is included yet, and every row is pending
+            inclusion = pl.DataFrame(schema={'hash': pl.String, 'inclusion_slot': pl.UInt32,
+                                             'inclusion_time': pl.Datetime})
+        else:
+            inclusion = rows.select('hash', 'blob_hashes').explode('blob_hashes').select(
+                'hash', blob_key('blob_hashes'),
+            ).join(self._keys, on='blob_key', how='inner').group_by('hash').agg(
+                pl.col('slot').min().alias('inclusion_slot'),
+                pl.col('slot_start_date_time').min().alias('inclusion_time'),
+            )
+
+        transactions = txs_df.select(
+            'hash', 'block_number', 'transaction_index', 'effective_gas_price', 'gas_used',
+        ).unique(subset='hash', keep='first')
+
+        first_seen_slot = pl.lit(None, dtype=pl.Int64) if self.genesis_time is None \
+            else (pl.col('first_seen').dt.epoch('s') - self.genesis_time) // SECONDS_PER_SLOT
+        return rows.join(inclusion, on='hash', how='left').join(transactions, on='hash', how='left').with_columns(
+            pl.col('from').str.to_lowercase().replace(
+                self.sequencers, default='unknown').alias('sequencer'),
+            first_seen_slot.alias('first_seen_slot'),
+        ).with_columns(
+            (pl.col('inclusion_slot').cast(pl.Int64) -
+             pl.col('first_seen_slot')).alias('slots_to_inclusion'),
+        )
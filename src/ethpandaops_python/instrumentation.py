@@ -0,0 +1,292 @@
+import json
+import logging
+import threading
+import time
+import uuid
+import pandas as pd
+import polars as pl
+import pyarrow as pa
+
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Any, Callable, Iterator, List, Mapping, Optional, Sequence
+
+logger = logging.getLogger('ethpandaops_python')
+
+# response header in which ClickHouse sends the statistics of a query, once it has finished
+SUMMARY_HEADER = 'X-ClickHouse-Summary'
+
+
+@dataclass
+class QueryEvent:
+    """
+    `QueryEvent` records one ClickHouse query or Hypersync call. Times are wall seconds.
+    """
+    # 'clickhouse' or 'hypersync'
+    source: str
+    # the table a ClickHouse query reads from, or the Hypersync call
+    name: str
+    # sent to ClickHouse as the `query_id` setting, so the query can be found in `system.query_log`
+    query_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    # unix time the call started
+    started: float = field(default_factory=time.time)
+    # time of the whole call, of receiving the response and of decoding and converting it
+    elapsed: float = 0.0
+    transfer: float = 0.0
+    convert: float = 0.0
+    # rows and in-memory size of the result
+    rows: int = 0
+    result_bytes: int = 0
+    # server side statistics, from the summary of the response or `Collector.fetch_server_stats()`
+    server_elapsed: Optional[float] = None
+    rows_read: Optional[int] = None
+    bytes_read: Optional[int] = None
+    # the result came from the `QueryCache`
+    cached: bool = False
+    error: Optional[str] = None
+
+
+Hook = Callable[[QueryEvent], None]
+
+
+def result_bytes(result: Any) -> int:
+    """
+    result_bytes() returns the in-memory size of a pandas, Arrow or polars result.
+    """
+    if isinstance(result, pl.DataFrame):
+        return int(result.estimated_size())
+    if isinstance(result, (pa.Table, pa.RecordBatch)):
+        return int(result.nbytes)
+    if isinstance(result, pd.DataFrame):
+        return int(result.memory_usage(deep=True).sum())
+    return 0
+
+
+def response_summary(response: Any) -> dict:
+    """
+    response_summary() returns the statistics ClickHouse sends in the `X-ClickHouse-Summary` header of an HTTP
+    response, like the `summary` of a clickhouse_connect `QueryResult`. Empty if the header is missing or malformed.
+    """
+    try:
+        return json.loads(response.headers.get(SUMMARY_HEADER) or '{}')
+    except ValueError:
+        return {}
+
+
+def record_summary(event: Optional[QueryEvent], summary: Mapping[str, Any]) -> None:
+    """
+    record_summary() fills the server elapsed time, rows read and bytes read of `event`, if set, from the summary of
+    its query. Older servers do not report the elapsed time there, `Collector.fetch_server_stats()` fills it instead.
+    """
+    if event is None:
+        return
+    # the values are sent as strings
+    if 'read_rows' in summary:
+        event.rows_read = int(summary['read_rows'])
+    if 'read_bytes' in summary:
+        event.bytes_read = int(summary['read_bytes'])
+    if 'elapsed_ns' in summary:
+        event.server_elapsed = int(summary['elapsed_ns']) / 1e9
+
+
+@contextmanager
+def measure(instrumentation: Optional['Instrumentation'], source: str, name: str) -> Iterator[QueryEvent]:
+    """
+    measure() times a call into a new `QueryEvent`, records its error if it raises and emits it to `instrumentation`,
+    if set, once the call ends.
+    """
+    event = QueryEvent(source=source, name=name)
+    start = time.perf_counter()
+    try:
+        yield event
+    except Exception as e:
+        event.error = repr(e)
+        raise
+    finally:
+        event.elapsed = time.perf_counter() - start
+        if instrumentation is not None:
+            instrumentation.emit(event)
+
+
+@contextmanager
+def timed(event: Optional[QueryEvent], phase: str) -> Iterator[None]:
+    """
+    timed() adds the wall time of a block to the `phase` ('transfer' or 'convert') of `event`, if set.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if event is not None:
+            setattr(event, phase, getattr(event, phase) +
+                    time.perf_counter() - start)
+
+
+def log_hook(level: int = logging.INFO) -> Hook:
+    """
+    log_hook() returns a hook that logs every event to the `ethpandaops_python` logger.
+    """
+    def hook(event: QueryEvent) -> None:
+        server = f', server {event.server_elapsed:.3f}s' if event.server_elapsed is not None else ''
+        status = f' failed: {event.error}' if event.error is not None else ''
+        logger.log(level, f'{event.source} {event.name} [{event.query_id}]: {event.rows} rows, '
+                   f'{event.result_bytes / 1024**2:.1f}MB in {event.elapsed:.3f}s (transfer {event.transfer:.3f}s, '
+                   f'convert {event.convert:.3f}s{server}){" from cache" if event.cached else ""}{status}')
+    return hook
+
+
+@dataclass
+class Instrumentation:
+    """
+    `Instrumentation` passes a `QueryEvent` for every call of the clients it is set on to each of its `hooks`.
+
+    Usage:
+
+        collector = Collector()
+        instrumentation = Instrumentation(hooks=[collector, log_hook()])
+        queries = Queries(instrumentation=instrumentation)
+        hypersync = Hypersync(instrumentation=instrumentation)
+    """
+    hooks: List[Hook] = field(default_factory=list)
+
+    def emit(self, event: QueryEvent) -> None:
+        """
+        emit() passes `event` to every hook. A failing hook is logged and never fails the query.
+        """
+        for hook in self.hooks:
+            try:
+                hook(event)
+            except Exception as e:
+                logger.warning(f'instrumentation hook {hook!r} failed: {e}')
+
+
+@dataclass
+class Collector:
+    """
+    `Collector` is a hook that keeps every event, and reports them as a DataFrame, a JSON report or Prometheus
+    text metrics.
+    """
+    events: List[QueryEvent] = field(default_factory=list)
+
+    _lock: threading.Lock = field(
+        default_factory=threading.Lock, init=False, repr=False)
+
+    def __call__(self, event: QueryEvent) -> None:
+        with self._lock:
+            self.events.append(event)
+
+    def clear(self) -> None:
+        """
+        clear() forgets every collected event.
+        """
+        with self._lock:
+            self.events.clear()
+
+    def frame(self) -> pl.DataFrame:
+        """
+        frame() returns the collected events as a DataFrame, one row per event.
+        """
+        with self._lock:
+            rows = [asdict(event) for event in self.events]
+        return pl.DataFrame(rows, schema={
+            'source': pl.String, 'name': pl.String, 'query_id': pl.String, 'started': pl.Float64,
+            'elapsed': pl.Float64, 'transfer': pl.Float64, 'convert': pl.Float64, 'rows': pl.Int64,
+            'result_bytes': pl.Int64, 'server_elapsed': pl.Float64, 'rows_read': pl.Int64, 'bytes_read': pl.Int64,
+            'cached': pl.Boolean, 'error': pl.String,
+        })
+
+    def summary(self, by: Sequence[str] = ('source', 'name')) -> pl.DataFrame:
+        """
+        summary() totals the collected events per `by` columns.
+        """
+        return self.frame().group_by(list(by)).agg(
+            pl.len().alias('calls'),
+            pl.col('error').is_not_null().sum().alias('errors'),
+            pl.col('cached').sum().alias('cache_hits'),
+            pl.col('elapsed').sum(),
+            pl.col('elapsed').max().alias('max_elapsed'),
+            pl.col('transfer').sum(),
+            pl.col('convert').sum(),
+            pl.col('server_elapsed').sum(),
+            pl.col('rows').sum(),
+            pl.col('result_bytes').sum(),
+            pl.col('rows_read').sum(),
+            pl.col('bytes_read').sum(),
+        ).sort('elapsed', descending=True)
+
+    def to_json(self, path: Optional[str] = None) -> str:
+        """
+        to_json() returns a JSON report of the summary and of every event, and writes it to `path` if set.
+        """
+        report = json.dumps({
+            'summary': self.summary().to_dicts(),
+            'events': self.frame().to_dicts(),
+        }, indent=2)
+        if path is not None:
+            with open(path, 'w') as f:
+                f.write(report)
+        return report
+
+    def to_prometheus(self, prefix: str = 'ethpandaops') -> str:
+        """
+        to_prometheus() returns the summary as Prometheus text exposition format counters, labelled by source and name.
+        """
+        metrics = [
+            ('calls', 'queries_total', 'Number of calls.'),
+            ('errors', 'query_errors_total', 'Number of failed calls.'),
+            ('cache_hits', 'query_cache_hits_total', 'Number of calls answered by the query cache.'),
+            ('elapsed', 'query_seconds_total', 'Wall time of the calls.'),
+            ('transfer', 'query_transfer_seconds_total', 'Time spent receiving responses.'),
+            ('convert', 'query_convert_seconds_total', 'Time spent decoding and converting responses.'),
+            ('server_elapsed', 'query_server_seconds_total', 'Execution time reported by the server.'),
+            ('rows', 'query_rows_total', 'Rows returned.'),
+            ('result_bytes', 'query_result_bytes_total', 'In-memory size of the results.'),
+            ('rows_read', 'query_rows_read_total', 'Rows read by the server.'),
+            ('bytes_read', 'query_bytes_read_total', 'Bytes read by the server.'),
+        ]
+        summary = self.summary().to_dicts()
+
+        lines = []
+        for column, metric, description in metrics:
+            lines.append(f'# HELP {prefix}_{metric} {description}')
+            lines.append(f'# TYPE {prefix}_{metric} counter')
+            for row in summary:
+                value = row[column] if row[column] is not None else 0
+                lines.append(
+                    f'{prefix}_{metric}{{source="{row["source"]}",name="{row["name"]}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def fetch_server_stats(self, client) -> int:
+        """
+        fetch_server_stats() fills the server elapsed time, rows read and bytes read of the collected ClickHouse events
+        whose query summary did not report them from `system.query_log`, using a clickhouse_connect client. ClickHouse
+        flushes the log every few seconds, so recent queries may only be found on a later call. Returns the number of
+        events updated.
+        """
+        with self._lock:
+            pending = {event.query_id: event for event in self.events
+                       if event.source == 'clickhouse' and not event.cached and event.server_elapsed is None}
+        if not pending:
+            return 0
+
+        try:
+            stats = client.query_arrow(
+                """
+                SELECT query_id, query_duration_ms, read_rows, read_bytes
+                FROM system.query_log
+                WHERE type = 'QueryFinish'
+                AND event_date >= yesterday()
+                AND query_id IN {ids:Array(String)}
+                """,
+                parameters={'ids': list(pending)}, use_strings=True).to_pylist()
+        except Exception as e:
+            # the query log is often not readable by read-only users
+            logger.warning(f'system.query_log is not readable: {e}')
+            return 0
+
+        for row in stats:
+            event = pending[row['query_id']]
+            event.server_elapsed = row['query_duration_ms'] / 1000
+            event.rows_read = row['read_rows']
+            event.bytes_read = row['read_bytes']
+        return len(stats)
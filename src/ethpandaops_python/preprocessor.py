@@ -1,16 +1,46 @@
 import os
+import json
+import time
+import asyncio
+import functools
 import polars as pl
 import datetime
 from dataclasses import dataclass, field
-from ethpandaops_python.client import Queries
+from ethpandaops_python.async_client import AsyncQueries, run_sync
+from ethpandaops_python.client import Queries, sidecar_restriction, to_polars
 from ethpandaops_python.hypersync import Hypersync
-from typing import Union, Dict
+from ethpandaops_python.inclusion import InclusionIndex, sequencer_names
+from ethpandaops_python.instrumentation import Instrumentation
+from ethpandaops_python.store import DatasetStore, LazyDatasets
+from typing import Optional, Sequence, Union, Dict
+
+# column each dataset is partitioned by date on, and the column its files are sorted by
+DATASETS: dict[str, tuple[str, str]] = {
+    'mempool_df': ('event_date_time', 'event_date_time'),
+    'canonical_beacon_blob_sidecar_df': ('slot_start_date_time', 'slot'),
+    'txs': ('timestamp', 'block_number'),
+}
+
+# columns identifying a row of a dataset, by which rows an incremental refresh fetches again are dropped
+DATASET_KEYS: dict[str, list[str]] = {
+    'mempool_df': ['hash', 'event_date_time', 'meta_client_name'],
+    'canonical_beacon_blob_sidecar_df': ['slot', 'blob_index'],
+    'txs': ['block_number', 'hash'],
+}
+
+# indexes derived from the datasets, stored alongside them and partitioned the same way
+INDEXES: dict[str, tuple[str, str]] = {
+    'inclusion_df': ('first_seen', 'first_seen'),
+}
 
 
 @dataclass
 class Preprocessor:
     """
     `Preprocessor` queries data and caches query results in memory in a dict[str] of dataframes.
+
+    Stored datasets are only read when they are first accessed in `cached_data`, and `cached_data.lazy(name)` scans
+    one without reading it, so constructing a `Preprocessor` over a fresh store reads only parquet footers.
     """
     # blob_producer can be a string or a dictionary of addresses with keys indicating their use
     blob_producer: Union[str, Dict[list[str], list[str]]] = field(default_factory=lambda: {
@@ -40,75 +70,362 @@ class Preprocessor:
 
     # default time period, in days
     period: int = 1
-    clickhouse_client: Queries = field(default_factory=Queries)
+    # the Arrow result path hands ClickHouse results to polars without building a pandas DataFrame
+    clickhouse_client: Queries = field(
+        default_factory=lambda: Queries(result_format='polars'))
     hypersync_client: Hypersync = field(default_factory=Hypersync)
     network: str = "mainnet"
+    # beacon chain genesis time of `network` in unix seconds, for networks missing from `GENESIS_TIME`
+    genesis_time: Optional[int] = None
+    # sidecars of the network are downloaded; 'producer' only downloads those of blobs the tracked sequencers sent
+    # to the mempool, see `sidecar_restriction()`
+    sidecar_filter: str = 'network'
+
+    # datasets by name, loaded from the store on first access, see `LazyDatasets`
+    cached_data: LazyDatasets = field(default_factory=LazyDatasets)
+    # wall time in seconds of the latest fetch, per source
+    timings: dict[str, float] = field(default_factory=dict)
+
+    # incremental refreshes fetch only rows newer than each dataset's high-water mark, append them
+    # to the stored datasets and trim rows that fall outside of the rolling `period`
+    incremental: bool = False
+    # incremental refreshes query this overlap before the mempool and sidecar high-water marks again, so rows that
+    # reach ClickHouse late are still fetched. Transactions are queried again from `Hypersync.reorg_blocks` blocks
+    # before their mark, so blocks that were reorged are fetched again. Rows already stored are dropped by their
+    # `DATASET_KEYS`.
+    mempool_lookback: datetime.timedelta = field(
+        default_factory=lambda: datetime.timedelta(minutes=10))
+    sidecar_lookback_slots: int = 64
 
-    cached_data: dict[str, pl.DataFrame] = field(default_factory=dict)
+    # local parquet store partitioned by dataset, network and date
+    store: DatasetStore = field(default_factory=DatasetStore)
+
+    # blob inclusion index over the cached datasets, kept in `cached_data['inclusion_df']`
+    inclusion_index: Optional[InclusionIndex] = None
+
+    # optional instrumentation, set on the ClickHouse and Hypersync clients that have none
+    instrumentation: Optional[Instrumentation] = None
+
+    # publish a snapshot of every refreshed dataset and of the inclusion index, see `DatasetStore.publish()`
+    publish: bool = False
 
     def __post_init__(self):
-        data_folder: str = 'data'
-        mempool_file: str = os.path.join(data_folder, 'mempool_df.parquet')
-        canonical_file: str = os.path.join(
-            data_folder, 'canonical_beacon_blob_sidecar_df.parquet')
-        txs_file: str = os.path.join(data_folder, 'txs.parquet')
-
-        # Ensure the data directory exists
-        if not os.path.exists(data_folder):
-            os.makedirs(data_folder)
-
-        # Check if the parquet files exist
-        if os.path.exists(mempool_file) and os.path.exists(canonical_file) and os.path.exists(txs_file):
-            # get the current date for beacon sidecar data and compare to current date.
-            # If the current date is different, then re-query data
-            current_date = datetime.datetime.now().date()
-
-            data_latest_date = pl.read_parquet(f'{canonical_file}').sort(
-                by='slot_start_date_time', descending=True).select('slot_start_date_time')[0].item().date()
-
-            # Check if the current date is one day ahead of the latest date
-            if current_date > data_latest_date + datetime.timedelta(days=1):
-                # Query clickhouse data
-                data: dict[str] = self.clickhouse_client.slot_inclusion_query(
-                    blob_producer=self.blob_producer, n_days=self.period, network=self.network)
-
-                self.cached_data['mempool_df'] = pl.from_pandas(
-                    data['mempool_df'])
-                self.cached_data['canonical_beacon_blob_sidecar_df'] = pl.from_pandas(
-                    data['canonical_beacon_blob_sidecar_df'])
-
-                # Query hypersync data
-                self.cached_data['txs'] = self.hypersync_client.query_txs(
-                    address=self.blob_producer['sequencer_addresses'], period=self.period)
-
-                # Save the data to parquet files
-                self.cached_data['mempool_df'].write_parquet(mempool_file)
-                self.cached_data['canonical_beacon_blob_sidecar_df'].write_parquet(
-                    canonical_file)
-                self.cached_data['txs'].write_parquet(txs_file)
+        if self.instrumentation is not None:
+            for client in (self.clickhouse_client, self.hypersync_client):
+                if getattr(client, 'instrumentation', None) is None:
+                    client.instrumentation = self.instrumentation
+        self.watermark_file: str = os.path.join(
+            self.store.root, 'watermarks', f'{self.network}.json')
+        if self.inclusion_index is None:
+            self.inclusion_index = InclusionIndex(
+                sequencers=sequencer_names(self.blob_producer), network=self.network, genesis_time=self.genesis_time)
+
+        # freshness is checked under the write lock, so that processes started together refresh the store once
+        with self.store.lock(self.network):
+            # Check if every dataset is stored for this network
+            if all(self.store.exists(name, self.network) for name in DATASETS):
+                if self.incremental:
+                    self.incremental_refresh()
+                    return
+
+                # get the current date for beacon sidecar data and compare to current date.
+                # If the current date is different, then re-query data
+                current_date = datetime.datetime.now().date()
+
+                # the latest sidecar is found from the parquet footer statistics, without reading any rows
+                data_latest_date = self.store.max_value(
+                    'canonical_beacon_blob_sidecar_df', self.network, 'slot_start_date_time').date()
 
+                # Check if the current date is one day ahead of the latest date
+                if current_date > data_latest_date + datetime.timedelta(days=1):
+                    self.full_refresh()
+
+                else:
+                    print(f'{current_date} is within a day of {data_latest_date}')
+                    # the stored datasets are read on first access
+                    for name in DATASETS:
+                        self._register(name)
+                    self._load_index()
             else:
-                print(f'{current_date} is within a day of {data_latest_date}')
-                # Load the parquet files
-                self.cached_data['mempool_df'] = pl.read_parquet(mempool_file)
-                self.cached_data['canonical_beacon_blob_sidecar_df'] = pl.read_parquet(
-                    canonical_file)
-                self.cached_data['txs'] = pl.read_parquet(txs_file)
+                self.full_refresh()
+
+    def full_refresh(self) -> None:
+        """
+        full_refresh() queries the whole `period` from Clickhouse and Hypersync and overwrites the stored datasets.
+        """
+        with self.store.lock(self.network):
+            self.cached_data.update(self.fetch())
+
+            for name, (date_column, sort_by) in DATASETS.items():
+                self.store.write(name, self.network, self.cached_data[name],
+                                 date_column=date_column, sort_by=sort_by, mode='overwrite')
+            self.cached_data['inclusion_df'] = self._build_index()
+            self._write_watermarks()
+            self._publish([*DATASETS, *INDEXES])
+
+    def fetch(
+        self,
+        mempool_since: Optional[datetime.datetime] = None,
+        sidecar_since_slot: Optional[int] = None,
+        from_block: Optional[int] = None,
+        datasets: Sequence[str] = tuple(DATASETS),
+    ) -> dict[str, pl.DataFrame]:
+        """
+        fetch() runs the mempool and sidecar Clickhouse queries and the Hypersync transaction query concurrently,
+        so that the total latency is close to the slowest source rather than the sum of all three.
+
+        The Clickhouse queries run through `AsyncQueries` and the Hypersync query runs on the event loop.
+        Wall time per source is printed and kept in `timings`. In a running event loop, e.g. Jupyter, `fetch()`
+        blocks the loop while it runs on a helper thread, await `fetch_async()` to keep the loop running.
+
+        `datasets` selects the sources to query, all three by default.
+        """
+        return run_sync(self.fetch_async(
+            mempool_since=mempool_since, sidecar_since_slot=sidecar_since_slot, from_block=from_block,
+            datasets=datasets))
+
+    async def fetch_async(
+        self,
+        mempool_since: Optional[datetime.datetime] = None,
+        sidecar_since_slot: Optional[int] = None,
+        from_block: Optional[int] = None,
+        datasets: Sequence[str] = tuple(DATASETS),
+    ) -> dict[str, pl.DataFrame]:
+        """
+        Asynchronous version of `fetch()`, which can be awaited in a running event loop.
+        """
+        # every source queries the same window, so that mempool, sidecar and transaction data line up
+        end = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+
+        async def timed(name: str, awaitable) -> pl.DataFrame:
+            start = time.perf_counter()
+            result = to_polars(await awaitable)
+            self.timings[name] = time.perf_counter() - start
+            print(f'{name}: fetched {result.height} rows in {self.timings[name]:.2f}s')
+            return result
+
+        async with AsyncQueries(self.clickhouse_client, max_concurrency=2) as queries:
+            sources = {
+                'mempool_df': lambda: queries.slot_inclusion_mempool(
+                    blob_producer=self.blob_producer, n_days=self.period, network=self.network, since=mempool_since, end=end),
+                'canonical_beacon_blob_sidecar_df': lambda: queries.slot_inclusion_sidecar(
+                    n_days=self.period, since_slot=sidecar_since_slot, end=end,
+                    **sidecar_restriction(self.sidecar_filter, self.network, self.blob_producer)),
+                'txs': lambda: self.hypersync_client.query_txs_async(
+                    address=self.blob_producer['sequencer_addresses'], period=self.period, from_block=from_block, end_time=end),
+            }
+            names = [name for name in DATASETS if name in datasets]
+            results = await asyncio.gather(*(timed(name, sources[name]()) for name in names))
+
+        return dict(zip(names, results))
+
+    def incremental_refresh(self, datasets: Sequence[str] = tuple(DATASETS)) -> None:
+        """
+        incremental_refresh() reloads the stored datasets, queries only rows newer than the stored high-water marks,
+        appends them and trims rows older than the rolling `period`. Mempool and sidecar rows are queried from
+        `mempool_lookback` and `sidecar_lookback_slots` before their marks, so rows that reached ClickHouse late are
+        appended too, and transactions from `Hypersync.reorg_blocks` blocks before theirs, so reorged blocks are fetched
+        again. Rows that are already stored are dropped. `datasets` selects the datasets to refresh, all of
+        them by default; the inclusion index is updated after any of them.
+
+        High-water marks are kept per network in `<store root>/watermarks/<network>.json`:
+         * `mempool_df`: latest `event_date_time`
+         * `canonical_beacon_blob_sidecar_df`: latest `slot`
+         * `txs`: latest `block_number`
+        """
+        with self.store.lock(self.network):
+            self._incremental_refresh(datasets)
+
+    def _incremental_refresh(self, datasets: Sequence[str]) -> None:
+        """
+        _incremental_refresh() is `incremental_refresh()`, run while holding the write lock.
+        """
+        # other processes may have written to the store since the last refresh, so the datasets and the index are read
+        # again from the store, on first access, rather than kept from earlier refreshes
+        for name in DATASETS:
+            self._register(name)
+        self._load_index()
+        # the index is read, or built, before new rows are appended to the datasets it is built from
+        index_df = self.cached_data['inclusion_df']
+        self.inclusion_index.reset()
+        sidecar_df = self.store.read(
+            'canonical_beacon_blob_sidecar_df', self.network, columns=['versioned_hash', 'slot', 'slot_start_date_time'])
+        if sidecar_df is not None:
+            self.inclusion_index.add_sidecars(sidecar_df)
+
+        watermarks = self._read_watermarks()
+
+        # A missing watermark (empty dataset) re-queries that dataset over the whole period
+        mempool_since = watermarks['mempool_df']
+        sidecar_since = watermarks['canonical_beacon_blob_sidecar_df']
+        txs_since = watermarks['txs']
+
+        # Query clickhouse and hypersync data newer than the watermarks, and the lookback before them
+        new_data: dict[str, pl.DataFrame] = self.fetch(
+            mempool_since=datetime.datetime.fromisoformat(
+                mempool_since) - self.mempool_lookback if mempool_since is not None else None,
+            sidecar_since_slot=max(int(sidecar_since) - self.sidecar_lookback_slots,
+                                   0) if sidecar_since is not None else None,
+            from_block=max(int(txs_since) + 1 - self.hypersync_client.reorg_blocks,
+                           0) if txs_since is not None else None,
+            datasets=datasets,
+        )
+
+        for name, df in new_data.items():
+            df = new_data[name] = self._unseen(name, df)
+            print(f'{name}: appending {df.height} new rows')
+            date_column, sort_by = DATASETS[name]
+            self.store.write(name, self.network, df,
+                             date_column=date_column, sort_by=sort_by, mode='append')
+            # datasets that are not loaded yet read the appended rows from the store on first access
+            if self.cached_data.is_loaded(name):
+                self.cached_data[name] = pl.concat(
+                    [self.cached_data[name], df], how='vertical_relaxed')
+
+        # only new transactions and those not yet included are resolved again, and only their dates rewritten
+        if 'canonical_beacon_blob_sidecar_df' in new_data:
+            self.inclusion_index.add_sidecars(
+                new_data['canonical_beacon_blob_sidecar_df'])
+        mempool_df = new_data['mempool_df'] if 'mempool_df' in new_data \
+            else self.cached_data.lazy('mempool_df').clear().collect()
+        previous_index_df = index_df
+        index_df, changed = self.inclusion_index.update(
+            index_df, mempool_df, self.cached_data['txs'])
+        self.cached_data['inclusion_df'] = index_df
+        print(f'inclusion_df: resolved {changed.height} new or pending transactions')
+
+        # changed rows are rewritten on their dates, and removed from the dates they were stored under before, which
+        # differ when a late sighting moves `first_seen` to an earlier date
+        date_column, sort_by = INDEXES['inclusion_df']
+        changed_dates = pl.concat([
+            changed.get_column(date_column).dt.date(),
+            previous_index_df.filter(pl.col('hash').is_in(changed.get_column('hash')))
+            .get_column(date_column).dt.date(),
+        ]).unique()
+        self.store.write('inclusion_df', self.network,
+                         index_df.filter(pl.col(date_column).dt.date().is_in(
+                             changed_dates)),
+                         date_column=date_column, sort_by=sort_by, mode='replace', dates=changed_dates.to_list())
+
+        self._trim()
+        self._write_watermarks()
+        self._publish([*new_data, *INDEXES])
+
+    def _unseen(self, name: str, df: pl.DataFrame) -> pl.DataFrame:
+        """
+        _unseen() drops the rows of `df` that are already stored, by the `DATASET_KEYS` of the dataset. Only the stored
+        rows from the earliest row of `df` on are read. Rows are kept as they are when either side lacks a key column.
+        """
+        keys = DATASET_KEYS.get(name)
+        if keys is None or df.height == 0 or not self.store.exists(name, self.network):
+            return df
+        date_column, _ = DATASETS[name]
+        earliest = df.get_column(date_column).min()
+        # hypersync block timestamps are unix seconds
+        start = datetime.datetime.fromtimestamp(earliest, datetime.timezone.utc).date() \
+            if df.schema[date_column].is_integer() else earliest.date()
+        stored = self.store.scan(name, self.network, start=start)
+        if not set(keys) <= set(df.columns) & set(stored.columns):
+            return df
+        # keys may be Categorical, see `schema.py`, which are compared as strings rather than re-encoded by the join
+        as_strings = [pl.col(key).cast(pl.String) for key in keys if df.schema[key] == pl.Categorical]
+        stored = stored.filter(pl.col(date_column) >= earliest).select(keys).with_columns(as_strings).collect()
+        unseen = df.select(keys).with_columns(as_strings).with_row_index('row') \
+            .join(stored, on=keys, how='anti').get_column('row')
+        return df[unseen]
+
+    def _publish(self, names: Sequence[str]) -> None:
+        """
+        _publish() publishes a snapshot of each of the cached datasets `names`, if `publish` is set.
+        """
+        if not self.publish:
+            return
+        for name in names:
+            path = self.store.publish(name, self.network, self.cached_data[name])
+            print(f'{name}: published {path}')
+
+    def _trim(self) -> None:
+        """
+        _trim() drops cached and stored rows that fall outside of the rolling `period`.
+        """
+        # cached timestamps are naive UTC
+        cutoff = datetime.datetime.now(datetime.timezone.utc).replace(
+            tzinfo=None) - datetime.timedelta(days=self.period)
+
+        for name, (date_column, _) in {**DATASETS, **INDEXES}.items():
+            if name not in self.cached_data:
+                continue
+            # datasets that are not loaded yet are read from the trimmed store on first access
+            if self.cached_data.is_loaded(name):
+                df = self.cached_data[name]
+                # hypersync block timestamps are unix seconds
+                limit = int(cutoff.replace(tzinfo=datetime.timezone.utc).timestamp(
+                )) if df.schema[date_column].is_integer() else cutoff
+                self.cached_data[name] = df.filter(pl.col(date_column) > limit)
+            self.store.delete_before(name, self.network, date_column, cutoff)
+
+    def sequencer_inclusion(self) -> pl.DataFrame:
+        """
+        sequencer_inclusion() summarizes blob inclusion per sequencer, see `InclusionIndex.aggregate()`.
+        """
+        return self.inclusion_index.aggregate(self.cached_data['inclusion_df'])
+
+    def _register(self, name: str) -> None:
+        """
+        _register() sets a stored dataset to be read from the store on first access.
+        """
+        self.cached_data.register(name,
+                                  load=functools.partial(self.store.read, name, self.network),
+                                  scan=functools.partial(self.store.scan, name, self.network))
+
+    def _build_index(self) -> pl.DataFrame:
+        """
+        _build_index() computes the inclusion index from the cached datasets, overwrites the stored index and returns it.
+        """
+        index_df = self.inclusion_index.build(
+            self.cached_data['mempool_df'], self.cached_data['canonical_beacon_blob_sidecar_df'], self.cached_data['txs'])
+
+        date_column, sort_by = INDEXES['inclusion_df']
+        self.store.write('inclusion_df', self.network, index_df,
+                         date_column=date_column, sort_by=sort_by, mode='overwrite')
+        return index_df
+
+    def _load_index(self) -> None:
+        """
+        _load_index() sets the stored inclusion index to be read on first access, or built on first access when it is
+        missing.
+        """
+        if self.store.exists('inclusion_df', self.network):
+            self._register('inclusion_df')
         else:
-            # Query clickhouse data
-            data: dict[str] = self.clickhouse_client.slot_inclusion_query(
-                blob_producer=self.blob_producer, n_days=self.period, network=self.network)
-
-            self.cached_data['mempool_df'] = pl.from_pandas(data['mempool_df'])
-            self.cached_data['canonical_beacon_blob_sidecar_df'] = pl.from_pandas(
-                data['canonical_beacon_blob_sidecar_df'])
-
-            # Query hypersync data
-            self.cached_data['txs'] = self.hypersync_client.query_txs(
-                address=self.blob_producer['sequencer_addresses'], period=self.period)
-
-            # Save the data to parquet files
-            self.cached_data['mempool_df'].write_parquet(mempool_file)
-            self.cached_data['canonical_beacon_blob_sidecar_df'].write_parquet(
-                canonical_file)
-            self.cached_data['txs'].write_parquet(txs_file)
+            self.cached_data.register('inclusion_df', load=self._build_index)
+
+    def _watermarks(self) -> dict:
+        """
+        _watermarks() computes the high-water mark of every stored dataset from its parquet footer statistics.
+        """
+        latest_event = self.store.max_value(
+            'mempool_df', self.network, 'event_date_time')
+
+        return {
+            'mempool_df': latest_event.isoformat() if latest_event is not None else None,
+            'canonical_beacon_blob_sidecar_df': self.store.max_value('canonical_beacon_blob_sidecar_df', self.network, 'slot'),
+            'txs': self.store.max_value('txs', self.network, 'block_number'),
+        }
+
+    def _read_watermarks(self) -> dict:
+        """
+        _read_watermarks() reads the stored high-water marks, falling back to the stored data when they are missing.
+        """
+        if os.path.exists(self.watermark_file):
+            with open(self.watermark_file) as f:
+                return json.load(f)
+        return self._watermarks()
+
+    def _write_watermarks(self) -> None:
+        """
+        _write_watermarks() stores the high-water marks of the cached data.
+        """
+        os.makedirs(os.path.dirname(self.watermark_file), exist_ok=True)
+        with open(self.watermark_file, 'w') as f:
+            json.dump(self._watermarks(), f)
@@ -0,0 +1,272 @@
+"""
+Builder of the SELECT statements run by `Queries`.
+
+Statements are generated from the metadata of the table they read: its time column and its default projection.
+Values are never written into the SQL text. Networks, transaction types and high-water marks are bound as ClickHouse
+server-side parameters, and address lists are sent as an external table that travels with the query. The text of a
+statement therefore only depends on its shape, so it is parsed and planned the same way, and cached by ClickHouse and
+`QueryCache` alike, however many networks or addresses it filters on.
+
+Usage:
+
+    statement = Select('mempool_transaction', columns=['hash', 'from']) \\
+        .window().tx_type(3).network(['mainnet', 'holesky']).producer(blob_producer)
+    statement.sql(), statement.parameters, statement.external
+"""
+import datetime
+import textwrap
+
+from clickhouse_connect.driver.external import ExternalData
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+# name of the external table of `Select.producer()`
+PRODUCER_TABLE = 'producer_addresses'
+
+
+@dataclass(frozen=True)
+class Table:
+    """
+    `Table` is the metadata of a ClickHouse table that statements are generated from.
+    """
+    name: str
+    # column that the time window of a query filters on
+    time_column: str
+    # projection of a statement that selects no columns
+    all_columns: str = '*'
+    network_column: str = 'meta_network_name'
+
+
+TABLES: Dict[str, Table] = {table.name: table for table in [
+    # meta_labels is a map column, which the Arrow format cannot send
+    Table('mempool_transaction', 'event_date_time', '* EXCEPT (meta_labels)'),
+    Table('canonical_beacon_block_execution_transaction', 'slot_start_date_time'),
+    Table('canonical_beacon_blob_sidecar', 'slot_start_date_time'),
+    Table('canonical_beacon_block', 'slot_start_date_time'),
+    Table('beacon_api_eth_v1_events_blob_sidecar', 'slot_start_date_time'),
+]}
+
+
+def time_window(column: str) -> str:
+    """
+    time_window() returns a filter on `column` for the [start, end) window bound by `Queries._run()`.
+    Bounds are sent as unix seconds server-side parameters, so sharded queries share one query text.
+    """
+    return f"{column} >= toDateTime({{start:UInt32}}) AND {column} < toDateTime({{end:UInt32}})"
+
+
+def full_window(column: str) -> str:
+    """
+    full_window() returns a filter on `column` for the whole window of `Queries._run()`. Unlike `time_window()` it is
+    not narrowed to a shard, for subqueries that must see the whole window from every shard.
+    """
+    return f"{column} >= toDateTime({{window_start:UInt32}}) AND {column} < toDateTime({{window_end:UInt32}})"
+
+
+def _escape(value: str) -> str:
+    """
+    _escape() escapes a value of the TabSeparated format.
+    """
+    return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n')
+
+
+@dataclass(frozen=True)
+class ExternalTable:
+    """
+    `ExternalTable` is a table of strings sent along with a query, which the query reads like a temporary table.
+    """
+    name: str
+    # column definitions, e.g. ('address String', 'sequencer String')
+    structure: Tuple[str, ...]
+    rows: Tuple[Tuple[str, ...], ...]
+
+    def data(self) -> bytes:
+        """
+        data() returns the rows in the TabSeparated format.
+        """
+        return ''.join('\t'.join(_escape(value) for value in row) + '\n' for row in self.rows).encode()
+
+
+def external_data(tables: Sequence[ExternalTable]) -> Optional[ExternalData]:
+    """
+    external_data() returns the clickhouse_connect `external_data` argument of a query, None without external tables.
+    """
+    if not tables:
+        return None
+    data = ExternalData()
+    for table in tables:
+        data.add_file(file_name=table.name, data=table.data(), fmt='TabSeparated',
+                      structure=list(table.structure))
+    return data
+
+
+def producer_table(blob_producer: Union[str, Dict[list[str], list[str]]]) -> ExternalTable:
+    """
+    producer_table() returns the addresses of a `blob_producer`, a single address or a dictionary with
+    `sequencer_addresses` and `sequencer_names`, with the name of their sequencer. A single address is named after itself.
+    """
+    if isinstance(blob_producer, str):
+        rows = ((blob_producer, blob_producer),)
+    else:
+        rows = tuple(zip(blob_producer['sequencer_addresses'], blob_producer['sequencer_names'])) \
+            if 'sequencer_names' in blob_producer \
+            else tuple((address, address) for address in blob_producer['sequencer_addresses'])
+    return ExternalTable(PRODUCER_TABLE, ('address String', 'sequencer String'), rows)
+
+
+@dataclass
+class Select:
+    """
+    `Select` builds a SELECT statement on a table of `TABLES`. Filters are added with the chainable methods below,
+    which bind their values as parameters, and subqueries are added with `join()` and `filter_in()`, which merge
+    their parameters and external tables into the statement.
+
+    `columns` is the projection, the `all_columns` of the table by default. When `alias` is set, the filters qualify
+    their columns with it.
+    """
+    table: Union[str, Table]
+    columns: Sequence[str] = ()
+    alias: Optional[str] = None
+    distinct: bool = False
+    group_by: Sequence[str] = ()
+    order_by: Sequence[str] = ()
+    limit: Optional[int] = None
+
+    conditions: List[str] = field(default_factory=list, init=False)
+    joins: List[str] = field(default_factory=list, init=False)
+    # values of the {name:Type} placeholders of the statement
+    parameters: Dict[str, object] = field(default_factory=dict, init=False)
+    # external tables read by the statement, by name
+    external: Dict[str, ExternalTable] = field(default_factory=dict, init=False)
+
+    def __post_init__(self):
+        if isinstance(self.table, str):
+            if self.table not in TABLES:
+                raise ValueError(f"unknown table '{self.table}', tables are {list(TABLES)}")
+            self.table = TABLES[self.table]
+
+    def column(self, name: str) -> str:
+        """
+        column() qualifies a column name with the statement's alias, if any.
+        """
+        return f"{self.alias}.{name}" if self.alias else name
+
+    def _bind(self, parameters: Dict[str, object], external: Sequence[ExternalTable] = ()) -> None:
+        for name, value in parameters.items():
+            if self.parameters.get(name, value) != value:
+                raise ValueError(f"parameter '{name}' is bound to different values")
+            self.parameters[name] = value
+        for table in external:
+            if self.external.get(table.name, table) != table:
+                raise ValueError(f"external table '{table.name}' is bound to different rows")
+            self.external[table.name] = table
+
+    def bind(self, **parameters) -> 'Select':
+        """
+        bind() sets the values of placeholders in the projection or other clauses of the statement.
+        """
+        self._bind(parameters)
+        return self
+
+    def filter(self, condition: str, **parameters) -> 'Select':
+        """
+        filter() adds a condition, with the values of its placeholders.
+        """
+        self._bind(parameters)
+        self.conditions.append(condition)
+        return self
+
+    def window(self, full: bool = False) -> 'Select':
+        """
+        window() filters the time column on the window of the shard, see `time_window()`, or with `full` on the whole
+        window of the query, see `full_window()`.
+        """
+        column = self.column(self.table.time_column)
+        return self.filter(full_window(column) if full else time_window(column))
+
+    def network(self, network: Optional[Union[str, Sequence[str]]]) -> 'Select':
+        """
+        network() keeps the rows of one network, or of any of a list of networks. None keeps every network.
+        """
+        column = self.column(self.table.network_column)
+        if network is None:
+            return self
+        if isinstance(network, str):
+            return self.filter(f"{column} = {{network:String}}", network=network)
+        return self.filter(f"{column} IN {{networks:Array(String)}}", networks=list(network))
+
+    def tx_type(self, type: int) -> 'Select':
+        """
+        tx_type() keeps the transactions of one type, 3 for blob transactions.
+        """
+        return self.filter(f"{self.column('type')} = {{type:UInt8}}", type=type)
+
+    def since(self, since: Optional[datetime.datetime]) -> 'Select':
+        """
+        since() keeps the rows after the high-water mark `since` (naive UTC) of the time column, if it is set.
+        """
+        if since is None:
+            return self
+        since_ms = int(since.replace(tzinfo=datetime.timezone.utc).timestamp() * 1000)
+        return self.filter(f"{self.column(self.table.time_column)} > fromUnixTimestamp64Milli({{since_ms:Int64}})",
+                           since_ms=since_ms)
+
+    def after_slot(self, slot: Optional[int]) -> 'Select':
+        """
+        after_slot() keeps the rows of slots after the high-water mark `slot`, if it is set.
+        """
+        if slot is None:
+            return self
+        return self.filter(f"{self.column('slot')} > {{since_slot:UInt32}}", since_slot=slot)
+
+    def producer(self, blob_producer: Union[str, Dict[list[str], list[str]]]) -> 'Select':
+        """
+        producer() keeps the transactions sent from the addresses of a `blob_producer`, which are sent as the
+        external table of `producer_table()` rather than written into the query. Addresses are compared in lowercase,
+        so checksummed addresses match.
+        """
+        self._bind({}, [producer_table(blob_producer)])
+        return self.filter(f"lower({self.column('from')}) IN (SELECT lower(address) FROM {PRODUCER_TABLE})")
+
+    def join(self, join: str, subquery: 'Select', alias: str, constraint: str) -> 'Select':
+        """
+        join() joins a subquery, e.g. `join('ANY INNER JOIN', blobs, 'producer_blobs', 'USING (versioned_hash)')`.
+        """
+        self._bind(subquery.parameters, list(subquery.external.values()))
+        self.joins.append(f"{join} (\n{textwrap.indent(subquery.sql(), '    ')}\n) AS {alias} {constraint}")
+        return self
+
+    def filter_in(self, column: str, subquery: 'Select') -> 'Select':
+        """
+        filter_in() keeps the rows whose `column` is one of the values returned by a subquery, a semi-join.
+        """
+        self._bind(subquery.parameters, list(subquery.external.values()))
+        return self.filter(f"{self.column(column)} IN (\n{textwrap.indent(subquery.sql(), '    ')}\n)")
+
+    def sql(self) -> str:
+        """
+        sql() returns the text of the statement.
+        """
+        projection = ",\n    ".join(self.columns) if self.columns else self.table.all_columns
+        lines = [f"SELECT{' DISTINCT' if self.distinct else ''}\n    {projection}",
+                 f"FROM {self.table.name}{f' AS {self.alias}' if self.alias else ''}",
+                 *self.joins]
+        for i, condition in enumerate(self.conditions):
+            lines.append(f"{'AND' if i else 'WHERE'} {condition}")
+        if self.group_by:
+            lines.append(f"GROUP BY {', '.join(self.group_by)}")
+        if self.order_by:
+            lines.append(f"ORDER BY {', '.join(self.order_by)}")
+        if self.limit is not None:
+            lines.append(f"LIMIT {int(self.limit)}")
+        return "\n".join(lines)
+
+
+def sequencer_column(column: str = 'from') -> str:
+    """
+    sequencer_column() returns a `sequencer` column naming the sequencer of the `column` address, from the external
+    table of `Select.producer()`, 'unknown' for other addresses. Addresses are compared in lowercase.
+    """
+    return (f"transform(lower({column}), "
+            f"(SELECT groupArray(lower(address)) FROM {PRODUCER_TABLE}), "
+            f"(SELECT groupArray(sequencer) FROM {PRODUCER_TABLE}), 'unknown') AS sequencer")
@@ -0,0 +1,290 @@
+import logging
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from typing import Dict, Optional
+
+logger = logging.getLogger('ethpandaops_python')
+
+# Categorical columns are built without polars' global string cache, which is left to the user: results built under
+# different `pl.StringCache()` scopes cannot be combined at all, while local categoricals are concatenated and joined
+# by re-encoding their categories. Enable `pl.enable_string_cache()` to combine many results without re-encoding.
+
+# Column types, by their ClickHouse names:
+#  * 'UInt8' to 'UInt64' and 'Int8' to 'Int64' are cast to that Arrow integer type when every value fits. Wide
+#    integer columns declared with one of these types are decoded into it exactly, see `decode_wide_int()`.
+#  * 'UInt128', 'UInt256', 'Int128' and 'Int256' are decoded into decimal128(38, 0). Decimals are exact in Arrow and
+#    pandas, but polars 0.20 reads them as float64: it cannot read decimal parquet columns back, so decimals are not
+#    activated. Columns that must be exact in polars are declared with an integer type.
+#  * 'Categorical' strings are dictionary encoded: polars Categorical, pandas category.
+INTEGER_TYPES: Dict[str, pa.DataType] = {
+    'UInt8': pa.uint8(), 'UInt16': pa.uint16(), 'UInt32': pa.uint32(), 'UInt64': pa.uint64(),
+    'Int8': pa.int8(), 'Int16': pa.int16(), 'Int32': pa.int32(), 'Int64': pa.int64(),
+}
+
+# columns that are shared by most tables
+META_COLUMNS: Dict[str, str] = {
+    'slot': 'UInt32',
+    'epoch': 'UInt32',
+    'blob_index': 'UInt8',
+    'blob_hashes_length': 'UInt8',
+    'meta_network_name': 'Categorical',
+    'meta_client_name': 'Categorical',
+    'meta_client_implementation': 'Categorical',
+    'meta_client_version': 'Categorical',
+    'meta_client_os': 'Categorical',
+    'meta_client_geo_city': 'Categorical',
+    'meta_client_geo_country': 'Categorical',
+    'meta_client_geo_country_code': 'Categorical',
+    'meta_client_geo_continent_code': 'Categorical',
+    'meta_consensus_implementation': 'Categorical',
+    'meta_consensus_version': 'Categorical',
+    # the sequencer name added by `Queries.slot_inclusion_batch()`
+    'sequencer': 'Categorical',
+}
+
+TRANSACTION_COLUMNS: Dict[str, str] = {
+    'type': 'UInt8',
+    'nonce': 'UInt64',
+    'gas': 'UInt64',
+    'size': 'UInt32',
+    'call_data_size': 'UInt32',
+    'blob_gas': 'UInt64',
+    # fees per gas are UInt128 in ClickHouse, but fit UInt64, which holds up to 18 ETH per gas
+    'gas_price': 'UInt64',
+    'gas_tip_cap': 'UInt64',
+    'priority_fee': 'UInt64',
+    'gas_fee_cap': 'UInt64',
+    'max_fee_per_gas': 'UInt64',
+    'blob_gas_fee_cap': 'UInt64',
+    'value': 'UInt256',
+    # blob transactions are sent by a small set of addresses
+    'from': 'Categorical',
+    'to': 'Categorical',
+}
+
+# column types per table, applied to every query reading from the table
+TABLE_SCHEMAS: Dict[str, Dict[str, str]] = {
+    'mempool_transaction': {
+        **META_COLUMNS,
+        **TRANSACTION_COLUMNS,
+        'blob_sidecars_size': 'UInt32',
+        'blob_sidecars_empty_size': 'UInt32',
+        'first_seen_client': 'Categorical',
+    },
+    'canonical_beacon_block_execution_transaction': {
+        **META_COLUMNS,
+        **TRANSACTION_COLUMNS,
+        'position': 'UInt32',
+    },
+    'canonical_beacon_blob_sidecar': {
+        **META_COLUMNS,
+        'blob_size': 'UInt32',
+        'blob_empty_size': 'UInt32',
+    },
+    'canonical_beacon_block': {
+        **META_COLUMNS,
+        'blob_size': 'UInt32',
+        'block_total_bytes': 'UInt32',
+        'block_total_bytes_compressed': 'UInt32',
+        'execution_payload_transactions_count': 'UInt32',
+        'execution_payload_transactions_total_bytes': 'UInt32',
+        'execution_payload_transactions_total_bytes_compressed': 'UInt32',
+        'meta_network_name_block': 'Categorical',
+        'meta_network_name_blob': 'Categorical',
+    },
+    'beacon_api_eth_v1_events_blob_sidecar': {
+        **META_COLUMNS,
+        'propagation_slot_start_diff': 'UInt32',
+    },
+}
+
+# 10**38, above the largest value of a decimal128(38, 0), as 64 bit limbs
+_DECIMAL_LIMIT = divmod(10**38, 2**64)
+# 10**38 - 1, above the bitwise inverse of the smallest value of a decimal128(38, 0)
+_NEGATIVE_LIMIT = divmod(10**38 - 1, 2**64)
+_ALL_ONES = np.uint64(2**64 - 1)
+_WIDE_DECIMAL = pa.decimal128(38, 0)
+
+
+def table_schema(table: str) -> Dict[str, str]:
+    """
+    table_schema() returns the column types of a table, empty for tables without a schema.
+    """
+    return TABLE_SCHEMAS.get(table, {})
+
+
+def decode_wide_int(column: pa.ChunkedArray,
+                    signed: bool = False,
+                    dtype: Optional[pa.DataType] = None,
+                    ) -> pa.Array:
+    """
+    decode_wide_int() decodes a little endian (U)Int128/(U)Int256 column, which ClickHouse sends as fixed size binary,
+    into the integer `dtype` when every value fits it, and into decimal128(38, 0) otherwise. A column's type therefore
+    only depends on its schema, so shards, cache entries and stored parts of a table concatenate. Decimals are exact
+    below 10**38 in magnitude, e.g. wei values, and larger values, which a decimal128(38, 0) cannot hold, become null.
+    """
+    column = column.combine_chunks()
+    limbs = _limbs(column)
+    valid = column.is_valid().to_numpy(zero_copy_only=False)
+
+    negative = (limbs[:, -1] >> np.uint64(63)).astype(bool) if signed \
+        else np.zeros(len(column), dtype=bool)
+    # a value fits in 64 bits when the upper limbs only extend its sign, which the lowest limb must hold as well
+    extension = np.where(negative, _ALL_ONES, np.uint64(0))
+    if dtype is not None and ((limbs[:, 1:] == extension[:, None]).all(axis=1) | ~valid).all():
+        if not signed or ((limbs[:, 0] >> np.uint64(63)).astype(bool) == negative)[valid].all():
+            values = pa.Array.from_buffers(pa.int64() if signed else pa.uint64(), len(column), [
+                pa.py_buffer(np.packbits(valid, bitorder='little').tobytes()),
+                pa.py_buffer(np.ascontiguousarray(limbs[:, 0]).tobytes()),
+            ], null_count=int((~valid).sum()))
+            narrowed = _narrow(values, dtype)
+            return values if narrowed is None else narrowed
+
+    # a value fits in 128 bits when the upper limbs only extend its sign
+    fits = (limbs[:, 2:] == extension[:, None]).all(axis=1)
+    # the magnitude is below 10**38 when the value, or the bitwise inverse (magnitude - 1) of a negative value, is
+    # below the limit
+    high = np.where(negative, ~limbs[:, 1], limbs[:, 1])
+    low = np.where(negative, ~limbs[:, 0], limbs[:, 0])
+    limit_high = np.where(negative, np.uint64(_NEGATIVE_LIMIT[0]), np.uint64(_DECIMAL_LIMIT[0]))
+    limit_low = np.where(negative, np.uint64(_NEGATIVE_LIMIT[1]), np.uint64(_DECIMAL_LIMIT[1]))
+    fits &= (high < limit_high) | ((high == limit_high) & (low < limit_low))
+
+    overflow = valid & ~fits
+    if overflow.any():
+        logger.warning(f'{overflow.sum()} wide integer values of 10**38 or more do not fit decimal128(38, 0) and are '
+                       f'set to null')
+    valid &= fits
+    # decimal128 values are 128 bit little endian two's complement integers, the layout of the two lowest limbs
+    data = pa.py_buffer(np.ascontiguousarray(limbs[:, :2]).tobytes())
+    validity = pa.py_buffer(np.packbits(valid, bitorder='little').tobytes())
+    return pa.Array.from_buffers(_WIDE_DECIMAL, len(column), [validity, data], null_count=int((~valid).sum()))
+
+
+def apply_arrow(table: pa.Table, schema: Dict[str, str]) -> pa.Table:
+    """
+    apply_arrow() converts the columns of an Arrow result to their `schema` types. Wide integer columns without a
+    schema type are decoded as unsigned decimals.
+    """
+    for i, field in enumerate(table.schema):
+        dtype = schema.get(field.name)
+        column = table.column(i)
+
+        if pa.types.is_fixed_size_binary(field.type) and field.type.byte_width in (16, 32):
+            column = decode_wide_int(
+                column, signed=dtype is not None and dtype.startswith('Int'), dtype=INTEGER_TYPES.get(dtype))
+        elif dtype == 'Categorical' and (pa.types.is_string(field.type) or pa.types.is_large_string(field.type)):
+            column = column.dictionary_encode()
+        elif dtype in INTEGER_TYPES and pa.types.is_integer(field.type) and INTEGER_TYPES[dtype].bit_width < field.type.bit_width:
+            column = _narrow(column, INTEGER_TYPES[dtype])
+            if column is None:
+                continue
+        else:
+            continue
+        table = table.set_column(i, field.name, column)
+    return table
+
+
+def apply_pandas(df: pd.DataFrame, schema: Dict[str, str]) -> pd.DataFrame:
+    """
+    apply_pandas() converts the columns of a pandas result to their `schema` types. (U)Int128/(U)Int256 columns are
+    read by clickhouse_connect as exact Python integers, which are converted to their integer schema type when every
+    value fits, and left as they are otherwise.
+    """
+    for name, dtype in schema.items():
+        if name not in df.columns:
+            continue
+        column = df[name]
+        if dtype == 'Categorical' and pd.api.types.is_string_dtype(column.dtype):
+            df[name] = column.astype('category')
+        elif dtype in INTEGER_TYPES and (pd.api.types.is_integer_dtype(column.dtype) or _is_python_int(column)):
+            target = INTEGER_TYPES[dtype].to_pandas_dtype()
+            info = np.iinfo(target)
+            if len(column) == 0 or (column.notna().all() and column.min() >= info.min and column.max() <= info.max):
+                df[name] = column.astype(target)
+    return df
+
+
+def pandas_to_arrow(df: pd.DataFrame) -> pa.Table:
+    """
+    pandas_to_arrow() converts a pandas result to an Arrow table. Columns of Python integers, which is how
+    clickhouse_connect reads (U)Int128/(U)Int256 columns, are converted to decimal128(38, 0) rather than int64, which
+    they can overflow. Values of 10**38 or more do not fit and become null.
+    """
+    wide = [name for name in df.columns if _is_python_int(df[name])]
+    table = pa.Table.from_pandas(df.drop(columns=wide), preserve_index=False)
+    columns = dict(zip(table.column_names, table.columns))
+    for name in wide:
+        values = df[name].to_numpy(dtype=object)
+        valid = pd.notna(values)
+        # the two lowest 64 bit limbs of the two's complement values
+        integers = np.where(valid, values, 0)
+        low, high = (integers.min(), integers.max()) if len(values) else (0, 0)
+        limbs = np.zeros((len(values), 2), dtype='<u8')
+        fits = valid
+        if 0 <= low and high < 2**64:
+            limbs[:, 0] = integers.astype(np.uint64)
+        elif -2**63 <= low and high < 2**63:
+            limbs[:, 0] = integers.astype(np.int64).view(np.uint64)
+            limbs[:, 1] = np.where(limbs[:, 0] >> np.uint64(63), _ALL_ONES, np.uint64(0))
+        else:
+            # split with vectorised Python int operations
+            fits = valid & (integers > -10**38) & (integers < 10**38)
+            integers = np.where(fits, integers, 0)
+            limbs[:, 0] = (integers & (2**64 - 1)).astype(np.uint64)
+            limbs[:, 1] = ((integers >> 64) & (2**64 - 1)).astype(np.uint64)
+        overflow = valid & ~fits
+        if overflow.any():
+            logger.warning(f'{overflow.sum()} wide integer values of 10**38 or more do not fit decimal128(38, 0) and '
+                           f'are set to null')
+        columns[name] = pa.Array.from_buffers(_WIDE_DECIMAL, len(values), [
+            pa.py_buffer(np.packbits(fits, bitorder='little').tobytes()),
+            pa.py_buffer(limbs.tobytes()),
+        ], null_count=int((~fits).sum()))
+    return pa.Table.from_arrays([columns[name] for name in df.columns], names=list(df.columns))
+
+
+def arrow_to_pandas(table: pa.Table) -> pd.DataFrame:
+    """
+    arrow_to_pandas() converts an Arrow result to pandas like clickhouse_connect's pandas result: integer
+    decimal128(38, 0) columns, the decoded (U)Int128/(U)Int256 columns, hold Python integers.
+    """
+    decimals = [field.name for field in table.schema if field.type == _WIDE_DECIMAL]
+    df = table.drop_columns(decimals).to_pandas()
+    for name in decimals:
+        column = table.column(name).combine_chunks()
+        limbs = np.frombuffer(column.buffers()[1], dtype='<u8', count=len(column) * 2,
+                              offset=column.offset * 16).reshape(-1, 2)
+        # the high limb is signed, and Python ints combine the limbs without overflowing
+        values = (limbs[:, 1].view(np.int64).astype(object) << 64) + limbs[:, 0].astype(object)
+        values[~column.is_valid().to_numpy(zero_copy_only=False)] = None
+        df.insert(table.schema.get_field_index(name), name, values)
+    return df
+
+
+def _is_python_int(column: pd.Series) -> bool:
+    """
+    _is_python_int() returns whether a pandas column holds Python integers, as clickhouse_connect reads wide integers.
+    """
+    return column.dtype == object and pd.api.types.infer_dtype(column, skipna=True) == 'integer'
+
+
+def _narrow(column: pa.ChunkedArray, dtype: pa.DataType) -> Optional[pa.ChunkedArray]:
+    """
+    _narrow() casts an integer column to `dtype`, or returns None if a value does not fit.
+    """
+    try:
+        return column.cast(dtype, safe=True)
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+        return None
+
+
+def _limbs(column: pa.Array) -> np.ndarray:
+    """
+    _limbs() views a fixed size binary column as rows of little endian 64 bit limbs, without copying.
+    """
+    width = column.type.byte_width
+    return np.frombuffer(column.buffers()[1], dtype='<u8', count=len(column) * width // 8,
+                         offset=column.offset * width).reshape(-1, width // 8)
@@ -0,0 +1,118 @@
+import os
+import uuid
+import pandas as pd
+import polars as pl
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from dataclasses import dataclass, field
+from ethpandaops_python.schema import pandas_to_arrow
+from typing import Dict, Iterable, Optional, Union
+
+Batch = Union[pa.RecordBatch, pa.Table, pl.DataFrame, pd.DataFrame]
+
+
+def to_arrow(batch: Batch) -> pa.Table:
+    """
+    to_arrow() converts a batch yielded by a `Queries` stream to an Arrow table.
+    """
+    if isinstance(batch, pa.Table):
+        return batch
+    if isinstance(batch, pa.RecordBatch):
+        return pa.Table.from_batches([batch])
+    if isinstance(batch, pl.DataFrame):
+        return batch.to_arrow()
+    return pandas_to_arrow(batch)
+
+
+@dataclass
+class ParquetSink:
+    """
+    `ParquetSink` writes a stream of batches to parquet files as they arrive, so exports of any size run in
+    constant memory.
+
+    If `partition_column` is set, rows are partitioned by the date of that timestamp column into hive style
+    `<root>/date=YYYY-MM-DD/` folders. A new file is started once a file holds `rows_per_file` rows.
+
+    Usage:
+
+        with ParquetSink('exports/mempool', partition_column='event_date_time') as sink:
+            sink.write_all(queries.mempool_transaction_stream(time=30))
+    """
+    root: str
+    partition_column: Optional[str] = None
+    compression: str = 'zstd'
+    rows_per_file: int = 5_000_000
+
+    rows_written: int = field(default=0, init=False)
+    _writers: Dict[str, pq.ParquetWriter] = field(
+        default_factory=dict, init=False, repr=False)
+    _writer_rows: Dict[str, int] = field(
+        default_factory=dict, init=False, repr=False)
+    _file_count: int = field(default=0, init=False, repr=False)
+    # files of one sink share a prefix, so that several exports can append to the same root
+    _prefix: str = field(default_factory=lambda: uuid.uuid4().hex[:8], init=False, repr=False)
+
+    def __enter__(self) -> 'ParquetSink':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def write(self, batch: Batch) -> None:
+        """
+        write() appends a batch to the parquet files of its partitions.
+        """
+        table = to_arrow(batch)
+        if table.num_rows == 0:
+            return
+
+        if self.partition_column is None:
+            self._write_partition('', table)
+        else:
+            dates = pc.cast(table.column(self.partition_column), pa.date32())
+            for date in pc.unique(dates).to_pylist():
+                partition = f'date={date}' if date is not None else 'date=null'
+                mask = pc.is_null(dates) if date is None else pc.equal(dates, pa.scalar(date, pa.date32()))
+                self._write_partition(partition, table.filter(mask))
+
+        self.rows_written += table.num_rows
+
+    def write_all(self, batches: Iterable[Batch]) -> int:
+        """
+        write_all() writes every batch of a stream and returns the number of rows written.
+        """
+        for batch in batches:
+            self.write(batch)
+        return self.rows_written
+
+    def close(self) -> None:
+        """
+        close() finalizes every open parquet file.
+        """
+        for writer in self._writers.values():
+            writer.close()
+        self._writers.clear()
+        self._writer_rows.clear()
+
+    def _write_partition(self, partition: str, table: pa.Table) -> None:
+        writer = self._writers.get(partition)
+        if writer is not None and (self._writer_rows[partition] >= self.rows_per_file
+                                   or not writer.schema.equals(table.schema)):
+            writer.close()
+            writer = None
+
+        if writer is None:
+            directory = os.path.join(self.root, partition)
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(
+                directory, f'part-{self._prefix}-{self._file_count:05d}.parquet')
+            self._file_count += 1
+            writer = pq.ParquetWriter(
+                path, table.schema, compression=self.compression)
+            self._writers[partition] = writer
+            self._writer_rows[partition] = 0
+
+        writer.write_table(table)
+        self._writer_rows[partition] += table.num_rows
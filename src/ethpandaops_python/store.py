@@ -0,0 +1,422 @@
+import datetime
+import os
+import shutil
+import threading
+import uuid
+import polars as pl
+import pyarrow.parquet as pq
+
+from collections.abc import MutableMapping
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import IO, Any, Callable, Dict, Iterator, Optional, Sequence, Union
+
+try:
+    import fcntl
+except ImportError:
+    # without fcntl (Windows), `DatasetStore.lock()` only excludes threads of the same process
+    fcntl = None
+
+# zero-row file holding the schema of a dataset and network, written next to its dates
+SCHEMA_FILE = '_schema.parquet'
+
+
+def date_expr(column: str, dtype: pl.DataType) -> pl.Expr:
+    """
+    date_expr() returns the date of a datetime column, or of an integer column holding unix seconds.
+    """
+    if dtype.is_integer():
+        return pl.from_epoch(pl.col(column), time_unit='s').dt.date()
+    return pl.col(column).dt.date()
+
+
+@dataclass
+class DatasetStore:
+    """
+    `DatasetStore` is a local parquet store partitioned by dataset, network and date:
+
+        <root>/dataset=<dataset>/network=<network>/date=YYYY-MM-DD/part-<id>.parquet
+        <root>/dataset=<dataset>/network=<network>/_schema.parquet
+
+    Files are zstd compressed and sorted by slot or time, so row group statistics let readers skip data. `scan()`
+    returns a `pl.LazyFrame` over only the partitions of the requested dates, and filters and projections applied
+    to it are pushed down into the parquet reader. Every write also records the dataset's schema, so datasets without
+    rows in the requested dates are read as empty frames with their columns. Networks are stored apart and never overwrite each other.
+
+    Writers of a network hold `lock()`, so processes sharing a store never write at the same time. `publish()` writes
+    a dataset as an immutable, uncompressed Arrow IPC snapshot and atomically points `CURRENT` at it, so readers in
+    other processes memory-map a complete version with `snapshot()` while ingestion continues:
+
+        <root>/snapshots/dataset=<dataset>/network=<network>/<version>.arrow
+        <root>/snapshots/dataset=<dataset>/network=<network>/CURRENT
+    """
+    root: str = 'data'
+    compression: str = 'zstd'
+    row_group_size: int = 128_000
+    # number of snapshot versions kept per dataset, older versions stay readable by processes that mapped them
+    keep_snapshots: int = 3
+
+    # guards `_locks`, the thread lock of each network
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False, compare=False)
+    _locks: Dict[str, threading.RLock] = field(default_factory=dict, init=False, repr=False, compare=False)
+    _held: Dict[str, tuple[IO, int]] = field(default_factory=dict, init=False, repr=False, compare=False)
+
+    def path(self, dataset: str, network: str, date: Optional[datetime.date] = None) -> str:
+        """
+        path() returns the folder of a dataset and network, or of one of its dates.
+        """
+        path = os.path.join(
+            self.root, f'dataset={dataset}', f'network={network}')
+        if date is not None:
+            path = os.path.join(path, f'date={date.isoformat()}')
+        return path
+
+    def dates(self, dataset: str, network: str) -> list[datetime.date]:
+        """
+        dates() returns the sorted dates stored for a dataset and network.
+        """
+        path = self.path(dataset, network)
+        if not os.path.isdir(path):
+            return []
+        return sorted(
+            datetime.date.fromisoformat(name[len('date='):])
+            for name in os.listdir(path)
+            if name.startswith('date=') and self._files(os.path.join(path, name))
+        )
+
+    def exists(self, dataset: str, network: str) -> bool:
+        return len(self.dates(dataset, network)) > 0
+
+    def files(self,
+              dataset: str,
+              network: str,
+              start: Optional[datetime.date] = None,
+              end: Optional[datetime.date] = None,
+              ) -> list[str]:
+        """
+        files() returns the parquet files of the dates in [start, end].
+        """
+        return [
+            file
+            for date in self.dates(dataset, network)
+            if (start is None or date >= start) and (end is None or date <= end)
+            for file in self._files(self.path(dataset, network, date))
+        ]
+
+    def scan(self,
+             dataset: str,
+             network: str,
+             start: Optional[datetime.date] = None,
+             end: Optional[datetime.date] = None,
+             ) -> Optional[pl.LazyFrame]:
+        """
+        scan() lazily reads the dates in [start, end] of a dataset. Only the files of those dates are opened. Without
+        rows in those dates it returns an empty frame with the schema of the dataset, and None if the dataset was never
+        written.
+        """
+        files = self.files(dataset, network, start, end)
+        if files:
+            return pl.scan_parquet(files, hive_partitioning=False)
+        schema_file = os.path.join(self.path(dataset, network), SCHEMA_FILE)
+        if os.path.exists(schema_file):
+            return pl.scan_parquet(schema_file, hive_partitioning=False)
+        # stores written before the schema file was recorded
+        stored = self.files(dataset, network)
+        if stored:
+            return pl.scan_parquet(stored[-1], hive_partitioning=False).clear()
+        return None
+
+    def read(self,
+             dataset: str,
+             network: str,
+             start: Optional[datetime.date] = None,
+             end: Optional[datetime.date] = None,
+             columns: Optional[Sequence[str]] = None,
+             ) -> Optional[pl.DataFrame]:
+        """
+        read() reads the dates in [start, end] of a dataset, optionally only `columns`. Like `scan()`, it returns an
+        empty frame with the schema of the dataset without rows in those dates, and None if it was never written.
+        """
+        lf = self.scan(dataset, network, start, end)
+        if lf is None:
+            return None
+        if columns is not None:
+            lf = lf.select(columns)
+        return lf.collect()
+
+    def max_value(self, dataset: str, network: str, column: str) -> Any:
+        """
+        max_value() returns the largest value of `column` on the latest stored date of a dataset, None if nothing is
+        stored. That is the largest value of the column the dataset is partitioned on, and of columns growing with it
+        such as slots and block numbers. It reads only the parquet footer statistics of each row group, falling back to
+        reading the column of files written without statistics.
+        """
+        dates = self.dates(dataset, network)
+        if not dates:
+            return None
+
+        values = []
+        for file in self._files(self.path(dataset, network, dates[-1])):
+            metadata = pq.read_metadata(file)
+            for i in range(metadata.num_row_groups):
+                row_group = metadata.row_group(i)
+                statistics = next(row_group.column(j).statistics for j in range(row_group.num_columns)
+                                  if row_group.column(j).path_in_schema == column)
+                if statistics is None or not statistics.has_min_max:
+                    values.append(pl.scan_parquet(file, hive_partitioning=False).select(
+                        pl.col(column).max()).collect().item())
+                    break
+                values.append(statistics.max)
+        values = [value for value in values if value is not None]
+        return max(values) if values else None
+
+    def write(self,
+              dataset: str,
+              network: str,
+              df: pl.DataFrame,
+              date_column: str,
+              sort_by: Union[str, Sequence[str]],
+              mode: str = 'append',
+              dates: Sequence[datetime.date] = (),
+              ) -> None:
+        """
+        write() partitions `df` by the date of `date_column` and writes one file per date, sorted by `sort_by`.
+
+        mode:
+         * 'append' adds the rows to the stored dates.
+         * 'overwrite' replaces every stored date of the dataset and network.
+         * 'replace' replaces only the stored dates `df` has rows on, and the `dates` it has no rows on, which are
+           emptied. Rows that move to another date are removed from the date they were stored on by listing it.
+        """
+        match mode:
+            case 'overwrite':
+                shutil.rmtree(self.path(dataset, network), ignore_errors=True)
+            case 'append' | 'replace':
+                pass
+            case _:
+                raise ValueError(
+                    f"mode must be 'append', 'overwrite' or 'replace', got '{mode}'")
+
+        self._write_schema(self.path(dataset, network), df)
+        written = set()
+        if df.height > 0:
+            partitions = df.with_columns(
+                date_expr(date_column, df.schema[date_column]).alias('__date')
+            ).partition_by('__date', as_dict=True, include_key=False)
+
+            for key, partition in partitions.items():
+                # partition_by keys are tuples from polars 1.0, plain values before
+                date = key[0] if isinstance(key, tuple) else key
+                written.add(date)
+                path = self.path(dataset, network, date)
+                # the replaced files are removed only once the new file is in place
+                replaced = self._files(path) if mode == 'replace' else []
+                self._write_file(path, partition.sort(sort_by))
+                for file in replaced:
+                    os.remove(file)
+
+        if mode == 'replace':
+            for date in set(dates) - written:
+                shutil.rmtree(self.path(dataset, network, date), ignore_errors=True)
+
+    def delete_before(self, dataset: str, network: str, date_column: str, cutoff: datetime.datetime) -> None:
+        """
+        delete_before() drops rows with `date_column` at or before `cutoff`. Older dates are removed as a whole and only
+        the date of the cutoff is rewritten.
+        """
+        for date in self.dates(dataset, network):
+            path = self.path(dataset, network, date)
+            if date < cutoff.date():
+                shutil.rmtree(path, ignore_errors=True)
+            elif date == cutoff.date():
+                files = self._files(path)
+                df = pl.scan_parquet(files, hive_partitioning=False).collect()
+                dtype = df.schema[date_column]
+                limit = int(cutoff.replace(tzinfo=datetime.timezone.utc).timestamp()
+                            ) if dtype.is_integer() else cutoff
+                self._write_file(path, df.filter(pl.col(date_column) > limit))
+                for file in files:
+                    os.remove(file)
+
+    @contextmanager
+    def lock(self, network: str) -> Iterator[None]:
+        """
+        lock() holds the exclusive write lock of a network, an `fcntl` lock on `<root>/locks/<network>.lock` shared by
+        every process using the store. It waits for the lock, and is reentrant within the holding thread. Threads of
+        one process take turns on a lock per network, so writers of different networks never wait for each other.
+        """
+        with self._lock:
+            network_lock = self._locks.setdefault(network, threading.RLock())
+        with network_lock:
+            file, depth = self._held.get(network, (None, 0))
+            if file is None:
+                os.makedirs(os.path.join(self.root, 'locks'), exist_ok=True)
+                file = open(os.path.join(self.root, 'locks', f'{network}.lock'), 'a')
+                if fcntl is not None:
+                    fcntl.flock(file, fcntl.LOCK_EX)
+            self._held[network] = (file, depth + 1)
+            try:
+                yield
+            finally:
+                file, depth = self._held.pop(network)
+                if depth > 1:
+                    self._held[network] = (file, depth - 1)
+                else:
+                    # closing the file releases the fcntl lock
+                    file.close()
+
+    def snapshot_path(self, dataset: str, network: str) -> str:
+        """
+        snapshot_path() returns the folder of the snapshots of a dataset and network.
+        """
+        return os.path.join(self.root, 'snapshots', f'dataset={dataset}', f'network={network}')
+
+    def publish(self, dataset: str, network: str, df: pl.DataFrame) -> str:
+        """
+        publish() writes `df` as the next snapshot version of a dataset and makes it the current one. The snapshot is
+        complete before `CURRENT` is atomically replaced, so readers see either the previous or the new version.
+        Versions beyond `keep_snapshots` are removed. Returns the path of the snapshot.
+        """
+        folder = self.snapshot_path(dataset, network)
+        os.makedirs(folder, exist_ok=True)
+        versions = self._snapshots(folder)
+        version = int(versions[-1][:-len('.arrow')]) + 1 if versions else 1
+        name = f'{version:010d}.arrow'
+
+        # uncompressed IPC files are memory-mapped by readers without copying
+        file = os.path.join(folder, name)
+        df.write_ipc(f'{file}.tmp', compression='uncompressed')
+        os.replace(f'{file}.tmp', file)
+        with open(os.path.join(folder, 'CURRENT.tmp'), 'w') as f:
+            f.write(name)
+        os.replace(os.path.join(folder, 'CURRENT.tmp'), os.path.join(folder, 'CURRENT'))
+
+        # readers that mapped a removed version keep reading it until they release it
+        for old in [*versions, name][:-self.keep_snapshots]:
+            os.remove(os.path.join(folder, old))
+        return file
+
+    def snapshot(self, dataset: str, network: str) -> Optional[pl.DataFrame]:
+        """
+        snapshot() memory-maps the current snapshot of a dataset, None if none was published. The DataFrame reads the
+        mapped file without copying it, and stays valid when newer versions are published.
+        """
+        folder = self.snapshot_path(dataset, network)
+        # a version can be removed between reading `CURRENT` and opening it, if several are published meanwhile
+        for _ in range(self.keep_snapshots):
+            try:
+                with open(os.path.join(folder, 'CURRENT')) as f:
+                    name = f.read().strip()
+                return pl.read_ipc(os.path.join(folder, name), memory_map=True)
+            except FileNotFoundError:
+                if not os.path.exists(os.path.join(folder, 'CURRENT')):
+                    return None
+        raise RuntimeError(f'snapshots of {dataset} on {network} changed during every read')
+
+    @staticmethod
+    def _snapshots(folder: str) -> list[str]:
+        return sorted(name for name in os.listdir(folder) if name.endswith('.arrow'))
+
+    def _write_file(self, path: str, df: pl.DataFrame) -> None:
+        if df.height == 0:
+            return
+        os.makedirs(path, exist_ok=True)
+        file = os.path.join(path, f'part-{uuid.uuid4().hex}.parquet')
+        # write to a temporary name first so readers never see a partial file
+        df.write_parquet(f'{file}.tmp', compression=self.compression,
+                         row_group_size=self.row_group_size)
+        os.replace(f'{file}.tmp', file)
+
+    @staticmethod
+    def _write_schema(path: str, df: pl.DataFrame) -> None:
+        os.makedirs(path, exist_ok=True)
+        file = os.path.join(path, SCHEMA_FILE)
+        df.clear().write_parquet(f'{file}.tmp')
+        os.replace(f'{file}.tmp', file)
+
+    @staticmethod
+    def _files(path: str) -> list[str]:
+        if not os.path.isdir(path):
+            return []
+        return sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith('.parquet'))
+
+
+@dataclass
+class LazyDatasets(MutableMapping):
+    """
+    `LazyDatasets` maps dataset names to DataFrames, like a dict, but a dataset registered with `register()` is only
+    loaded when it is first accessed, and `lazy()` returns a `pl.LazyFrame` of it without loading it at all.
+    Assigned DataFrames are kept as they are. Iterating or checking membership never loads a dataset.
+
+    Usage:
+
+        datasets = LazyDatasets()
+        datasets.register('txs', load=lambda: store.read('txs', 'mainnet'), scan=lambda: store.scan('txs', 'mainnet'))
+        datasets.lazy('txs').filter(pl.col('block_number') > 19_000_000).collect()
+        datasets['txs']  # read in full on first access
+    """
+    _frames: Dict[str, pl.DataFrame] = field(default_factory=dict, init=False)
+    _loaders: Dict[str, Callable[[], pl.DataFrame]] = field(default_factory=dict, init=False)
+    _scanners: Dict[str, Callable[[], pl.LazyFrame]] = field(default_factory=dict, init=False)
+
+    def register(self,
+                 name: str,
+                 load: Callable[[], pl.DataFrame],
+                 scan: Optional[Callable[[], pl.LazyFrame]] = None,
+                 ) -> None:
+        """
+        register() sets the function loading a dataset on first access, and optionally the one scanning it for
+        `lazy()`, replacing a loaded DataFrame.
+        """
+        self._frames.pop(name, None)
+        self._loaders[name] = load
+        if scan is not None:
+            self._scanners[name] = scan
+        else:
+            self._scanners.pop(name, None)
+
+    def is_loaded(self, name: str) -> bool:
+        """
+        is_loaded() returns whether a dataset is held in memory.
+        """
+        return name in self._frames
+
+    def lazy(self, name: str) -> pl.LazyFrame:
+        """
+        lazy() returns a LazyFrame of a dataset: over the loaded DataFrame if there is one, otherwise over its scan,
+        which pushes filters and projections down into the parquet reader.
+        """
+        if name not in self._frames and name in self._scanners:
+            return self._scanners[name]()
+        return self[name].lazy()
+
+    def __getitem__(self, name: str) -> pl.DataFrame:
+        if name not in self._frames:
+            if name not in self._loaders:
+                raise KeyError(name)
+            self._frames[name] = self._loaders[name]()
+        return self._frames[name]
+
+    def __setitem__(self, name: str, df: pl.DataFrame) -> None:
+        self._frames[name] = df
+        self._loaders.pop(name, None)
+        self._scanners.pop(name, None)
+
+    def __delitem__(self, name: str) -> None:
+        if name not in self:
+            raise KeyError(name)
+        for values in (self._frames, self._loaders, self._scanners):
+            values.pop(name, None)
+
+    def __contains__(self, name: object) -> bool:
+        return name in self._frames or name in self._loaders
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(dict.fromkeys([*self._loaders, *self._frames]))
+
+    def __len__(self) -> int:
+        return len(self._loaders.keys() | self._frames.keys())
+
+    def __repr__(self) -> str:
+        states = ', '.join(f"'{name}': {'loaded' if self.is_loaded(name) else 'not loaded'}" for name in self)
+        return f'LazyDatasets({{{states}}})'
@@ -0,0 +1,32 @@
+import datetime
+import pytest
+
+from benchmarks.standin import StandInClient, StandInHypersyncClient, synthetic_hypersync
+from ethpandaops_python.client import ClientPool, Queries
+from ethpandaops_python.hypersync import Hypersync
+from ethpandaops_python.store import DatasetStore
+
+# rows per day of the largest stand-in tables, small enough to keep tests fast
+ROWS_PER_DAY = 2_000
+
+
+@pytest.fixture
+def standin() -> StandInClient:
+    return StandInClient(rows_per_day=ROWS_PER_DAY, days=1)
+
+
+@pytest.fixture
+def queries(standin: StandInClient) -> Queries:
+    return Queries(pool=ClientPool(client=standin), result_format='polars')
+
+
+@pytest.fixture
+def hypersync(tmp_path) -> Hypersync:
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return Hypersync(client=StandInHypersyncClient(*synthetic_hypersync(ROWS_PER_DAY, 1, now)),
+                     sync_folder=str(tmp_path / 'hypersync'))
+
+
+@pytest.fixture
+def store(tmp_path) -> DatasetStore:
+    return DatasetStore(root=str(tmp_path / 'store'))
@@ -0,0 +1,52 @@
+import datetime
+import threading
+import time
+import pytest
+import polars as pl
+
+from clickhouse_connect.driver.exceptions import DatabaseError, OperationalError
+from ethpandaops_python.executor import ShardedExecutor
+
+START = datetime.datetime(2024, 5, 1)
+
+
+def test_shards_are_concatenated_in_order():
+    executor = ShardedExecutor(window=datetime.timedelta(hours=1))
+    df = executor.run(lambda start, end: pl.DataFrame({'start': [start]}), START, START + datetime.timedelta(hours=5))
+    assert df.get_column('start').to_list() == [START + datetime.timedelta(hours=i) for i in range(5)]
+
+
+def test_transient_errors_are_retried():
+    attempts = []
+
+    def fetch(start, end):
+        attempts.append(start)
+        if len(attempts) == 1:
+            raise OperationalError('connection reset')
+        return pl.DataFrame({'start': [start]})
+
+    executor = ShardedExecutor(window=datetime.timedelta(hours=1), backoff=0.01)
+    assert executor.run(fetch, START, START + datetime.timedelta(hours=1)).height == 1
+    assert len(attempts) == 2
+
+
+def test_permanent_failure_cancels_the_other_shards():
+    started = []
+    lock = threading.Lock()
+
+    def fetch(start, end):
+        with lock:
+            started.append(start)
+        if start == START:
+            raise DatabaseError('memory limit exceeded')
+        # the other running shard keeps failing with a retried error
+        time.sleep(0.05)
+        raise OperationalError('timeout')
+
+    executor = ShardedExecutor(window=datetime.timedelta(hours=1), max_workers=2, max_retries=5, backoff=1.0)
+    began = time.perf_counter()
+    with pytest.raises(DatabaseError):
+        executor.run(fetch, START, START + datetime.timedelta(hours=8))
+    # without cancellation the retries alone of every shard would take over 30 seconds
+    assert time.perf_counter() - began < 1
+    assert len(started) <= 3
@@ -0,0 +1,62 @@
+import datetime
+import polars as pl
+
+from ethpandaops_python.first_seen import FIRST_SEEN_COLUMNS, FirstSeenTable
+
+
+class Sightings:
+    """
+    Sightings stands in for `Queries`, returning one 'first_seen' result per refresh.
+    """
+
+    def __init__(self, *results: pl.DataFrame):
+        self.results = list(results)
+
+    def mempool_transaction(self, **kwargs) -> pl.DataFrame:
+        return self.results.pop(0)
+
+
+def sightings(rows: list[tuple[str, datetime.datetime, int]]) -> pl.DataFrame:
+    return pl.DataFrame({
+        'hash': [hash for hash, _, _ in rows],
+        'first_seen': [first_seen for _, first_seen, _ in rows],
+        'last_seen': [first_seen for _, first_seen, _ in rows],
+        'sightings': pl.Series([count for _, _, count in rows], dtype=pl.UInt64),
+        'first_seen_client': ['sentry-1' for _ in rows],
+    }).select(FIRST_SEEN_COLUMNS)
+
+
+def test_late_sighting_moves_hash_to_an_earlier_date(store):
+    midnight = datetime.datetime(2024, 5, 2)
+    table = FirstSeenTable(queries=Sightings(
+        sightings([('0xa', midnight + datetime.timedelta(minutes=5), 2),
+                   ('0xb', midnight + datetime.timedelta(minutes=6), 1)]),
+        # a sighting that reached ClickHouse late, seconds before midnight
+        sightings([('0xa', midnight - datetime.timedelta(seconds=30), 1)]),
+    ), period=7, store=store)
+
+    end = midnight + datetime.timedelta(hours=1)
+    table.refresh(end=end)
+    table.refresh(end=end)
+
+    stored = store.read('first_seen_df', 'mainnet').sort('hash')
+    assert stored.get_column('hash').to_list() == ['0xa', '0xb']
+    assert stored.get_column('first_seen').to_list() == [midnight - datetime.timedelta(seconds=30),
+                                                         midnight + datetime.timedelta(minutes=6)]
+    assert stored.get_column('sightings').to_list() == [3, 1]
+    assert store.dates('first_seen_df', 'mainnet') == [datetime.date(2024, 5, 1), datetime.date(2024, 5, 2)]
+
+
+def test_moving_the_only_row_of_a_date_empties_it(store):
+    midnight = datetime.datetime(2024, 5, 2)
+    table = FirstSeenTable(queries=Sightings(
+        sightings([('0xa', midnight + datetime.timedelta(minutes=5), 1)]),
+        sightings([('0xa', midnight - datetime.timedelta(seconds=30), 1)]),
+    ), period=7, store=store)
+
+    end = midnight + datetime.timedelta(hours=1)
+    table.refresh(end=end)
+    table.refresh(end=end)
+
+    assert store.read('first_seen_df', 'mainnet').get_column('hash').to_list() == ['0xa']
+    assert store.dates('first_seen_df', 'mainnet') == [datetime.date(2024, 5, 1)]
@@ -0,0 +1,16 @@
+import datetime
+import os
+
+from ethpandaops_python.hypersync import Hypersync
+
+
+def test_anchors_are_kept_per_chain(hypersync):
+    holesky = Hypersync(client=hypersync.client, url='http://holesky.hypersync.xyz',
+                        sync_folder=hypersync.sync_folder)
+    assert hypersync.resolver.anchors_file != holesky.resolver.anchors_file
+
+    hypersync.query_txs(address='0xa', period=1, end_time=datetime.datetime.now(datetime.timezone.utc))
+    assert os.listdir(hypersync.sync_folder) == [os.path.basename(hypersync.resolver.anchors_file)]
+    # a later client of the same chain starts from its anchors
+    assert Hypersync(client=hypersync.client, sync_folder=hypersync.sync_folder).resolver.anchors_file \
+        == hypersync.resolver.anchors_file
@@ -0,0 +1,61 @@
+import datetime
+import polars as pl
+
+from ethpandaops_python.inclusion import InclusionIndex, sequencer_names
+from ethpandaops_python.preprocessor import Preprocessor
+
+TXS_SCHEMA = {'hash': pl.String, 'block_number': pl.UInt64, 'transaction_index': pl.UInt64,
+              'effective_gas_price': pl.UInt64, 'gas_used': pl.UInt64}
+
+
+def mempool(hashes: list[str], first_seen: datetime.datetime) -> pl.DataFrame:
+    return pl.DataFrame({
+        'hash': hashes,
+        'from': ['0xabc'] * len(hashes),
+        'event_date_time': [first_seen] * len(hashes),
+        'blob_hashes': [[f'0x01{h}'] for h in hashes],
+        'fill_percentage': [0.5] * len(hashes),
+    })
+
+
+def test_resolve_without_sidecars_is_pending():
+    index = InclusionIndex().build(
+        mempool(['0xa'], datetime.datetime(2024, 5, 1)),
+        pl.DataFrame(schema={'versioned_hash': pl.String, 'slot': pl.UInt32, 'slot_start_date_time': pl.Datetime}),
+        pl.DataFrame(schema=TXS_SCHEMA))
+    assert index.get_column('inclusion_slot').to_list() == [None]
+    assert index.get_column('first_seen_slot').to_list() == [(1714521600 - 1606824023) // 12]
+
+
+def test_unknown_network_leaves_slots_null(caplog):
+    index = InclusionIndex(network='gnosis')
+    assert 'gnosis' in caplog.text
+    df = index.build(mempool(['0xa'], datetime.datetime(2024, 5, 1)),
+                     pl.DataFrame({'versioned_hash': ['0x010xa'], 'slot': [7],
+                                   'slot_start_date_time': [datetime.datetime(2024, 5, 1, 0, 1)]}),
+                     pl.DataFrame(schema=TXS_SCHEMA))
+    assert df.get_column('inclusion_slot').to_list() == [7]
+    assert df.get_column('first_seen_slot').to_list() == [None]
+    assert df.get_column('slots_to_inclusion').to_list() == [None]
+
+
+def test_genesis_time_override():
+    index = InclusionIndex(network='gnosis', genesis_time=1714521600 - 120)
+    df = index.build(mempool(['0xa'], datetime.datetime(2024, 5, 1)),
+                     pl.DataFrame(schema={'versioned_hash': pl.String, 'slot': pl.UInt32,
+                                          'slot_start_date_time': pl.Datetime}),
+                     pl.DataFrame(schema=TXS_SCHEMA))
+    assert df.get_column('first_seen_slot').to_list() == [10]
+
+
+def test_preprocessor_on_unlisted_network(queries, hypersync, store):
+    preprocessor = Preprocessor(network='gnosis', clickhouse_client=queries, hypersync_client=hypersync, store=store)
+    index_df = preprocessor.cached_data['inclusion_df']
+    assert index_df.height > 0
+    assert index_df.get_column('first_seen_slot').null_count() == index_df.height
+    assert store.exists('mempool_df', 'gnosis')
+
+
+def test_sequencer_names_without_names():
+    assert sequencer_names({'sequencer_addresses': ['0xAb', '0xcd']}) == {'0xab': '0xAb', '0xcd': '0xcd'}
+    assert sequencer_names({'sequencer_addresses': ['0xAb'], 'sequencer_names': ['base']}) == {'0xab': 'base'}
@@ -0,0 +1,57 @@
+from types import SimpleNamespace
+
+import pytest
+
+from ethpandaops_python.client import ClientPool, Queries
+from ethpandaops_python.instrumentation import Collector, Instrumentation, response_summary
+
+
+@pytest.mark.parametrize('result_format', ['polars', 'arrow', 'pandas'])
+def test_server_stats_come_from_the_response_summary(standin, result_format):
+    collector = Collector()
+    queries = Queries(pool=ClientPool(client=standin), result_format=result_format,
+                      instrumentation=Instrumentation(hooks=[collector]))
+    df = queries.mempool_transaction(time=1)
+
+    [event] = collector.events
+    assert event.rows == len(df) > 0
+    assert event.rows_read == event.rows
+    assert event.bytes_read > 0
+    assert event.server_elapsed == 0.0
+
+
+def test_streams_record_the_response_summary(standin):
+    collector = Collector()
+    queries = Queries(pool=ClientPool(client=standin), result_format='polars',
+                      instrumentation=Instrumentation(hooks=[collector]))
+    rows = sum(batch.height for batch in queries.mempool_transaction_stream(time=1, batch_size=500))
+
+    [event] = collector.events
+    assert event.rows == event.rows_read == rows
+
+
+def test_query_log_fills_what_the_summary_lacks(standin):
+    collector = Collector()
+    queries = Queries(pool=ClientPool(client=standin), result_format='polars',
+                      instrumentation=Instrumentation(hooks=[collector]))
+    queries.mempool_transaction(time=1)
+    queries.blob_propagation(time=1)
+    # a server that does not report its elapsed time in the summary
+    collector.events[1].server_elapsed = None
+
+    logged = []
+
+    class QueryLog:
+        def query_arrow(self, query, parameters, use_strings):
+            logged.extend(parameters['ids'])
+            return SimpleNamespace(to_pylist=lambda: [
+                {'query_id': id, 'query_duration_ms': 250, 'read_rows': 7, 'read_bytes': 70} for id in logged])
+
+    assert collector.fetch_server_stats(QueryLog()) == 1
+    assert logged == [collector.events[1].query_id]
+    assert collector.events[1].server_elapsed == 0.25
+
+
+def test_malformed_summary_header():
+    assert response_summary(SimpleNamespace(headers={'X-ClickHouse-Summary': '{"read_rows":'})) == {}
+    assert response_summary(SimpleNamespace(headers={})) == {}
@@ -0,0 +1,23 @@
+from ethpandaops_python.preprocessor import DATASET_KEYS, Preprocessor
+
+
+def test_incremental_refresh_fetches_the_reorg_tail_again(queries, hypersync, store):
+    Preprocessor(clickhouse_client=queries, hypersync_client=hypersync, store=store)
+    stored = store.read('txs', 'mainnet')
+    latest = stored.get_column('block_number').max()
+
+    calls = []
+    query_txs_async = hypersync.query_txs_async
+
+    async def recorded(**kwargs):
+        calls.append(kwargs['from_block'])
+        return await query_txs_async(**kwargs)
+
+    hypersync.query_txs_async = recorded
+    Preprocessor(clickhouse_client=queries, hypersync_client=hypersync, store=store, incremental=True)
+
+    assert calls == [latest + 1 - hypersync.reorg_blocks]
+    # the transactions of the refetched blocks are stored once
+    for name, keys in DATASET_KEYS.items():
+        df = store.read(name, 'mainnet')
+        assert df.select(keys).is_duplicated().sum() == 0, name
@@ -0,0 +1,54 @@
+import decimal
+import numpy as np
+import pandas as pd
+import polars as pl
+import pyarrow as pa
+
+from ethpandaops_python.client import normalize_arrow, to_polars
+from ethpandaops_python.schema import arrow_to_pandas, pandas_to_arrow, table_schema
+
+
+def wide(values: list, width: int) -> pa.Array:
+    """
+    wide() encodes Python integers the way ClickHouse writes (U)Int128/(U)Int256 columns to Arrow.
+    """
+    data = b''.join(value.to_bytes(width, 'little', signed=True) for value in values)
+    return pa.FixedSizeBinaryArray.from_buffers(pa.binary(width), len(values), [None, pa.py_buffer(data)])
+
+
+def test_fees_decode_to_exact_polars_integers():
+    gas_price = 2**63 + 12345
+    table = normalize_arrow(pa.table({
+        'gas_price': wide([gas_price, 1], 16),
+        'value': wide([10**30 + 1, 0], 32),
+    }), table_schema('mempool_transaction'))
+    df = to_polars(table)
+    assert df.schema['gas_price'] == pl.UInt64
+    assert df.get_column('gas_price').to_list() == [gas_price, 1]
+    assert table.column('value').to_pylist() == [decimal.Decimal(10**30 + 1), decimal.Decimal(0)]
+
+
+def test_fees_above_uint64_fall_back_to_decimal():
+    table = normalize_arrow(pa.table({'gas_price': wide([2**64, 1], 16)}), table_schema('mempool_transaction'))
+    assert table.schema.field('gas_price').type == pa.decimal128(38, 0)
+    assert arrow_to_pandas(table)['gas_price'].tolist() == [2**64, 1]
+
+
+def test_pandas_round_trip_keeps_python_integers():
+    values = [-(10**38) + 1, -1, 0, 2**64 + 7, None, 10**38 - 1]
+    df = pd.DataFrame({'a': np.arange(6), 'value': pd.Series(values, dtype=object), 'b': list('uvwxyz')})
+    table = pandas_to_arrow(df)
+    assert table.column_names == ['a', 'value', 'b']
+    assert table.schema.field('value').type == pa.decimal128(38, 0)
+    assert arrow_to_pandas(table)['value'].tolist() == values
+
+
+def test_pandas_overflow_becomes_null():
+    df = pd.DataFrame({'value': pd.Series([10**38, 5], dtype=object)})
+    assert arrow_to_pandas(pandas_to_arrow(df))['value'].tolist() == [None, 5]
+
+
+def test_pandas_round_trip_of_64_bit_values():
+    for values in ([0, 2**64 - 1, None], [-(2**63), 2**63 - 1, -1]):
+        df = pd.DataFrame({'value': pd.Series(values, dtype=object)})
+        assert arrow_to_pandas(pandas_to_arrow(df))['value'].tolist() == values